@@ -0,0 +1,260 @@
+import io
+import json
+import logging
+import uuid
+from typing import Any, Iterable, List, Optional, Tuple
+
+import boto3
+import numpy as np
+from botocore.exceptions import ClientError
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Prefix of the session objects in the embedding bucket; the bucket expires them after a day
+EPHEMERAL_STORE_PREFIX = "comparison-sessions"
+
+s3 = boto3.client('s3')
+
+
+def session_key(session_id: str) -> str:
+    """
+    Return the S3 key of a comparison session's vectors.
+    """
+    return f"{EPHEMERAL_STORE_PREFIX}/{session_id}.npz"
+
+
+def delete_session_files(bucket: str, session_id: str) -> None:
+    """
+    Delete the objects under a session's prefix: its ingestion manifest and expected file markers.
+
+    The session's vectors are stored beside the prefix, at `session_key`, and are not deleted.
+    """
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{EPHEMERAL_STORE_PREFIX}/{session_id}/"):
+        objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+        if objects:
+            s3.delete_objects(Bucket=bucket, Delete={"Objects": objects, "Quiet": True})
+
+
+class EphemeralVectorStore(VectorStore):
+    """
+    In-memory vector store for the single-use vectors of a comparison session.
+
+    The vectors are kept as one L2-normalized float32 NumPy matrix and searched with a single
+    matrix-vector product, so cosine similarity needs no database. The store is saved to S3 as
+    one compressed .npz object holding the matrix and a JSON blob with the page texts, their
+    metadata and the embedding model id, and is loaded from there by the evaluation.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        key: str,
+        embeddings: Optional[Embeddings] = None,
+        embedding_model_id: Optional[str] = None
+    ):
+        """
+        Args:
+            bucket (str): The S3 bucket the store is saved to.
+            key (str): The S3 key of the store, see `session_key`.
+            embeddings (Embeddings, optional): The embeddings used for added texts and queries.
+            embedding_model_id (str, optional): The id of the model the vectors are embedded with.
+        """
+        self.bucket = bucket
+        self.key = key
+        self.embedding = embeddings
+        self.embedding_model_id = embedding_model_id or getattr(embeddings, "model_id", None)
+        self.vectors: Optional[np.ndarray] = None
+        self.texts: List[str] = []
+        self.metadatas: List[dict] = []
+        self.ids: List[str] = []
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.embedding
+
+    def add_embeddings(
+        self,
+        texts: Iterable[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        """
+        Add texts with precomputed vectors.
+
+        Returns:
+            List[str]: The ids of the added texts.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+        self.vectors = matrix if self.vectors is None else np.vstack([self.vectors, matrix])
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas)
+        self.ids.extend(ids)
+        return ids
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), metadatas, ids)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        bucket: str,
+        key: str,
+        **kwargs: Any
+    ) -> "EphemeralVectorStore":
+        store = cls(bucket=bucket, key=key, embeddings=embedding)
+        store.add_texts(texts, metadatas)
+        return store
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4
+    ) -> List[Tuple[Document, float]]:
+        """
+        Return the k texts most similar to a vector, with their cosine similarity.
+        """
+        if self.vectors is None or not len(self.texts):
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        scores = self.vectors @ query
+
+        k = min(k, len(scores))
+        # Select the top k without sorting every score, then order only those
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (Document(id=self.ids[i], page_content=self.texts[i], metadata=self.metadatas[i]), float(scores[i]))
+            for i in top
+        ]
+
+    def similarity_search_by_vectors(self, embeddings: List[List[float]], k: int = 4) -> List[List[Document]]:
+        """
+        Return the k texts most similar to each of several vectors with one matrix product.
+
+        Returns:
+            List[List[Document]]: The documents of each vector, most similar first.
+        """
+        if not embeddings:
+            return []
+        if self.vectors is None or not len(self.texts):
+            return [[] for _ in embeddings]
+
+        queries = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        scores = queries @ self.vectors.T
+
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        top = np.take_along_axis(top, np.argsort(-top_scores, axis=1), axis=1)
+        return [
+            [Document(id=self.ids[i], page_content=self.texts[i], metadata=self.metadatas[i]) for i in row]
+            for row in top
+        ]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k)
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities
+        return lambda score: score
+
+    def save(self) -> None:
+        """
+        Write the store to S3 as one compressed .npz object.
+        """
+        blob = json.dumps({
+            "embedding_model_id": self.embedding_model_id,
+            "texts": self.texts,
+            "metadatas": self.metadatas,
+            "ids": self.ids,
+        }).encode("utf-8")
+        vectors = self.vectors if self.vectors is not None else np.zeros((0, 0), dtype=np.float32)
+
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, vectors=vectors, blob=np.frombuffer(blob, dtype=np.uint8))
+        s3.put_object(Bucket=self.bucket, Key=self.key, Body=buffer.getvalue())
+        logger.info(f"Saved {len(self.texts)} vectors to s3://{self.bucket}/{self.key}.")
+
+    @classmethod
+    def load(
+        cls,
+        bucket: str,
+        key: str,
+        embeddings: Optional[Embeddings] = None,
+        missing_ok: bool = False
+    ) -> "EphemeralVectorStore":
+        """
+        Read a store from S3.
+
+        Args:
+            bucket (str): The S3 bucket of the store.
+            key (str): The S3 key of the store.
+            embeddings (Embeddings, optional): The embeddings used for added texts and queries.
+            missing_ok (bool, optional): Return an empty store instead of raising if the object does not exist.
+        """
+        try:
+            body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except ClientError as e:
+            if missing_ok and e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return cls(bucket=bucket, key=key, embeddings=embeddings)
+            raise
+
+        with np.load(io.BytesIO(body), allow_pickle=False) as data:
+            vectors = data["vectors"]
+            blob = json.loads(data["blob"].tobytes().decode("utf-8"))
+
+        store = cls(bucket=bucket, key=key, embeddings=embeddings, embedding_model_id=blob["embedding_model_id"])
+        if len(blob["texts"]):
+            store.vectors = vectors
+            store.texts = blob["texts"]
+            store.metadatas = blob["metadatas"]
+            store.ids = blob["ids"]
+        return store
+
+    def delete_collection(self) -> None:
+        """
+        Delete the store from S3, as PGVector.delete_collection does for a session's collection.
+        """
+        s3.delete_object(Bucket=self.bucket, Key=self.key)
+        logger.info(f"Deleted s3://{self.bucket}/{self.key}.")
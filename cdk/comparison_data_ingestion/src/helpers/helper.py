@@ -1,9 +1,10 @@
 import logging
 import boto3
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 import psycopg2
 from langchain_aws import BedrockEmbeddings
 from langchain_postgres import PGVector
+from helpers.ephemeral_store import EphemeralVectorStore, session_key
 from processing.documents import process_documents
 
 # Create an S3 client using the boto3 library
@@ -20,7 +21,8 @@ def get_vectorstore(
     user: str, 
     password: str, 
     host: str, 
-    port: int
+    port: int,
+    collection_metadata: Optional[dict] = None
 ) -> Optional[Tuple[PGVector, str]]:
     """
     Initialize and return a PGVector instance along with a connection string.
@@ -40,6 +42,7 @@ def get_vectorstore(
         password (str): The database password.
         host (str): The hostname or IP address of the database server.
         port (int): The port number on which the database server is listening.
+        collection_metadata (dict, optional): Metadata stored with the collection when it is created.
     
     Returns:
         Optional[PGVector, str]: 
@@ -62,7 +65,8 @@ def get_vectorstore(
             embeddings=embeddings,
             collection_name=collection_name,
             connection=connection_string,
-            use_jsonb=True
+            use_jsonb=True,
+            collection_metadata=collection_metadata
         )
         print(f"vectorstore in get_vectorstore")
 
@@ -78,7 +82,8 @@ def store_category_data(
     bucket: str,
     category_id: str,
     vectorstore_config_dict: Dict[str, str], 
-    embeddings: BedrockEmbeddings
+    embeddings: BedrockEmbeddings,
+    document_keys: Optional[List[str]] = None
 ) -> str:
     """
     Retrieve a PGVector store, then process and store documents from a given S3 bucket 
@@ -90,8 +95,12 @@ def store_category_data(
         vectorstore_config_dict (Dict[str, str]): Configuration for connecting to 
             the vector store database. Should contain keys:
             'collection_name', 'dbname', 'user', 'password', 'host', and 'port'.
+            If it also contains 'ephemeral_bucket', the vectors are saved to that
+            bucket as an EphemeralVectorStore instead of a PGVector collection.
         embeddings (BedrockEmbeddings): The embeddings provider instance used 
             to transform text into vector embeddings.
+        document_keys (List[str], optional): The documents to process. Defaults to
+            every document in the category folder.
 
     Returns:
         str: 
@@ -99,24 +108,40 @@ def store_category_data(
               guardrail conflicts. 
             - Otherwise, an error message string if restricted content is detected.
     """
-    # Obtain the vectorstore instance and connection string using the config dictionary
-    vectorstore, connection_string = get_vectorstore(
-        collection_name=vectorstore_config_dict['collection_name'],
-        embeddings=embeddings,
-        dbname=vectorstore_config_dict['dbname'],
-        user=vectorstore_config_dict['user'],
-        password=vectorstore_config_dict['password'],
-        host=vectorstore_config_dict['host'],
-        port=int(vectorstore_config_dict['port'])
-    )
-    print("vector_store in store category data")
+    if vectorstore_config_dict.get('ephemeral_bucket'):
+        # Keep the session's vectors out of the database; pages uploaded earlier
+        # in the same session are loaded so the new ones are added to them
+        vectorstore = EphemeralVectorStore.load(
+            bucket=vectorstore_config_dict['ephemeral_bucket'],
+            key=session_key(vectorstore_config_dict['collection_name']),
+            embeddings=embeddings,
+            missing_ok=True
+        )
+    else:
+        # Obtain the vectorstore instance and connection string using the config dictionary
+        vectorstore, connection_string = get_vectorstore(
+            collection_name=vectorstore_config_dict['collection_name'],
+            embeddings=embeddings,
+            dbname=vectorstore_config_dict['dbname'],
+            user=vectorstore_config_dict['user'],
+            password=vectorstore_config_dict['password'],
+            host=vectorstore_config_dict['host'],
+            port=int(vectorstore_config_dict['port']),
+            # Lets the evaluation embed queries with the model the session was embedded with
+            collection_metadata={"embedding_model_id": getattr(embeddings, "model_id", None)}
+        )
+        print("vector_store in store category data")
 
     # Process documents from S3 and store them in the vectorstore
     message = process_documents(
         bucket=bucket,
         category_id=category_id,
-        vectorstore=vectorstore
+        vectorstore=vectorstore,
+        document_keys=document_keys
     )
 
+    if message == "SUCCESS" and isinstance(vectorstore, EphemeralVectorStore):
+        vectorstore.save()
+
     # Return the result of the document processing
     return message
@@ -1,11 +1,12 @@
-from typing import Dict
+from typing import Dict, List, Optional
 from helpers.helper import store_category_data
 
 def update_vectorstore(
     bucket: str,
     category_id: str,
     vectorstore_config_dict: Dict[str, str],
-    embeddings #: BedrockEmbeddings
+    embeddings, #: BedrockEmbeddings
+    document_keys: Optional[List[str]] = None
 ) -> str:
     """
     Update the vectorstore with embeddings for all documents in the S3 bucket.
@@ -16,6 +17,8 @@ def update_vectorstore(
         vectorstore_config_dict (Dict[str, str]): The configuration dictionary for the vectorstore,
             including parameters like collection name, database name, user, password, host, and port.
         embeddings (BedrockEmbeddings): The embeddings instance used to process the documents.
+        document_keys (List[str], optional): The documents to process. Defaults to every
+            document in the folder.
 
     Returns:
         str: 
@@ -30,7 +33,8 @@ def update_vectorstore(
         bucket=bucket,
         category_id=category_id,
         vectorstore_config_dict=vectorstore_config_dict,
-        embeddings=embeddings
+        embeddings=embeddings,
+        document_keys=document_keys
     )
 
     # Return the message (either "SUCCESS" or error message) to the caller so that any status or result information 
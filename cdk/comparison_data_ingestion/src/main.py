@@ -9,6 +9,8 @@ import time
 # import requests
 
 from helpers.vectorstore import update_vectorstore
+from helpers.embedding_cache import PostgresCachedEmbeddings
+from processing.manifest import SessionManifest
 from langchain_aws import BedrockEmbeddings
 
 
@@ -27,15 +29,31 @@ EMBEDDING_BUCKET_NAME = os.environ["EMBEDDING_BUCKET_NAME"]
 APPSYNC_API_URL = os.environ["APPSYNC_API_URL"]
 # APPSYNC_API_ID = os.environ["APPSYNC_API_ID"]
 EMBEDDING_MODEL_PARAM = os.environ["EMBEDDING_MODEL_PARAM"]
+# "ephemeral" keeps session vectors in S3 and searches them in memory, "pgvector" stores them in the database
+COMPARISON_VECTORSTORE = os.environ.get("COMPARISON_VECTORSTORE", "pgvector")
+# Cache embeddings in the comparison database. Off by default with the ephemeral store, which
+# otherwise keeps comparison ingestion entirely off the database
+COMPARISON_EMBEDDING_CACHE = os.environ.get(
+    "COMPARISON_EMBEDDING_CACHE", "false" if COMPARISON_VECTORSTORE == "ephemeral" else "true"
+).lower() == "true"
+# Deliveries of a file before its ingestion error is reported to the user instead of retried.
+# A retry only arrives after the queue's visibility timeout, longer than the frontend waits for
+# the session, so by default a failed file is reported at once
+COMPARISON_MAX_ATTEMPTS = int(os.environ.get("COMPARISON_MAX_ATTEMPTS", "1"))
+INGESTION_ERROR_MESSAGE = "Sorry, your document(s) could not be processed. Kindly try uploading them again."
+# How long the embedding model id is cached, so a model switch reaches warm containers
+EMBEDDING_CONFIG_TTL_SECONDS = int(os.environ.get("EMBEDDING_CONFIG_TTL_SECONDS", "300"))
 # AWS Clients
 secrets_manager_client = boto3.client("secretsmanager")
 ssm_client = boto3.client("ssm")
+s3_client = boto3.client("s3")
 bedrock_runtime = boto3.client("bedrock-runtime", region_name=REGION)
 
 # Cached resources
 connection = None
 db_secret = None
 EMBEDDING_MODEL_ID = None
+embedding_model_expires_at = 0
 
 
 
@@ -85,11 +103,12 @@ def get_parameter():
     """
     Fetch a parameter value from Systems Manager Parameter Store.
     """
-    global EMBEDDING_MODEL_ID
-    if EMBEDDING_MODEL_ID is None:
+    global EMBEDDING_MODEL_ID, embedding_model_expires_at
+    if EMBEDDING_MODEL_ID is None or time.time() >= embedding_model_expires_at:
         try:
             response = ssm_client.get_parameter(Name=EMBEDDING_MODEL_PARAM, WithDecryption=True)
             EMBEDDING_MODEL_ID = response["Parameter"]["Value"]
+            embedding_model_expires_at = time.time() + EMBEDDING_CONFIG_TTL_SECONDS
         except Exception as e:
             logger.error(f"Error fetching parameter {EMBEDDING_MODEL_PARAM}: {e}")
             raise
@@ -108,14 +127,64 @@ def get_secret():
             raise
     return db_secret
 
-def update_vectorstore_from_s3(bucket, session_id):
-    # bucket = "DSA-data-ingestion-bucket"
-    
+def connect_to_db():
+    global connection
+    if connection is None or connection.closed:
+        try:
+            secret = get_secret()
+            connection_params = {
+                'dbname': secret["dbname"],
+                'user': secret["username"],
+                'password': secret["password"],
+                'host': RDS_PROXY_ENDPOINT,
+                'port': secret["port"]
+            }
+            connection_string = " ".join([f"{key}={value}" for key, value in connection_params.items()])
+            connection = psycopg2.connect(connection_string)
+            logger.info("Connected to the database!")
+        except Exception as e:
+            logger.error(f"Failed to connect to database: {e}")
+            if connection:
+                connection.rollback()
+                connection.close()
+            raise
+    return connection
+
+def get_embeddings():
+    """
+    Build the Bedrock embeddings instance. When COMPARISON_EMBEDDING_CACHE is set it is wrapped
+    in the Postgres embedding cache, so re-uploads of the same document are not sent to Bedrock again.
+    """
+    model_id = get_parameter()
     embeddings = BedrockEmbeddings(
-        model_id=get_parameter(), 
+        model_id=model_id,
         client=bedrock_runtime,
         region_name=REGION
     )
+    if not COMPARISON_EMBEDDING_CACHE:
+        return embeddings
+    return PostgresCachedEmbeddings(
+        underlying_embeddings=embeddings,
+        model_id=model_id,
+        connection=connect_to_db()
+    )
+
+def update_vectorstore_from_s3(bucket, session_id, document_key):
+    """
+    Ingest one uploaded file of a comparison session and notify the user once every file
+    of the session is ready, or as soon as a file is rejected by the guardrail.
+    """
+    filename = document_key.rsplit('/', 1)[-1]
+    manifest = SessionManifest(EMBEDDING_BUCKET_NAME, session_id)
+    if manifest.failed:
+        # The user was already shown why the session's documents were rejected
+        logger.info(f"Skipping {document_key}: another file of session {session_id} was rejected.")
+        s3_client.delete_object(Bucket=bucket, Key=document_key)
+        if manifest.mark_skipped(filename):
+            manifest.clear()
+        return
+
+    embeddings = get_embeddings()
     
     db_secret = get_secret()
 
@@ -127,6 +196,8 @@ def update_vectorstore_from_s3(bucket, session_id):
         'host': RDS_PROXY_ENDPOINT,
         'port': db_secret["port"]
     }
+    if COMPARISON_VECTORSTORE == "ephemeral":
+        vectorstore_config_dict['ephemeral_bucket'] = EMBEDDING_BUCKET_NAME
 
     try:
         
@@ -134,18 +205,48 @@ def update_vectorstore_from_s3(bucket, session_id):
             bucket=bucket,
             category_id=session_id,
             vectorstore_config_dict=vectorstore_config_dict,
-            embeddings=embeddings
+            embeddings=embeddings,
+            document_keys=[document_key]
         )
         
+        if isinstance(embeddings, PostgresCachedEmbeddings):
+            logger.info(f"Embedding cache hits: {embeddings.hits}, misses: {embeddings.misses}.")
+            embeddings.maybe_evict()
+
         if message == "SUCCESS":
-            invoke_event_notification(session_id, "Embeddings created successfully")
+            if manifest.mark_ready(filename):
+                invoke_event_notification(session_id, "Embeddings created successfully")
+                # The session's next upload is tracked by a new manifest
+                manifest.clear()
 
         else:
+            upload_done = manifest.mark_failed(message, filename)
             invoke_event_notification(session_id, message) # <- KANISH: This is the personalized guardrail message due to which embeddings haven't been created and stored. You will have to show this to the user.
+            if upload_done:
+                manifest.clear()
     except Exception as e:
         logger.error(f"Error updating vectorstore for session {session_id}: {e}")
         raise
 
+def report_ingestion_failure(session_id, document_key):
+    """
+    Record a file that could not be ingested as failed in the session manifest and tell the user,
+    so the session does not wait for it.
+    """
+    filename = document_key.rsplit('/', 1)[-1]
+    try:
+        manifest = SessionManifest(EMBEDDING_BUCKET_NAME, session_id)
+        if manifest.failed:
+            # The user was already told why the upload failed
+            upload_done = manifest.mark_skipped(filename)
+        else:
+            upload_done = manifest.mark_failed(INGESTION_ERROR_MESSAGE, filename)
+            invoke_event_notification(session_id, INGESTION_ERROR_MESSAGE)
+        if upload_done:
+            manifest.clear()
+    except Exception as e:
+        logger.error(f"Error reporting the failed ingestion of {document_key} for session {session_id}: {e}")
+
 def handler(event, context):
     time.sleep(1)
     records = event.get('Records', [])
@@ -156,8 +257,19 @@ def handler(event, context):
         }
         
     bucket_name = DSA_COMPARISON_BUCKET
+    processed_keys = []
+    # A failed file is redelivered by SQS; later files of its session wait for it, as in a FIFO group
+    failed_items = []
+    failed_groups = set()
 
+    # Each message names one uploaded file, and only that file is ingested
     for record in records:
+        attributes = record.get('attributes', {})
+        group_id = attributes.get('MessageGroupId')
+        if group_id is not None and group_id in failed_groups:
+            failed_items.append(record['messageId'])
+            continue
+
         # Extract the message body from the SQS event
         message_body = json.loads(record['body'])
         session_id = message_body.get('sessionId')
@@ -168,35 +280,30 @@ def handler(event, context):
             logger.error("Missing required parameters in the message.")
             continue
 
-        # Assuming the file path is of the format: {session_id}/{filename}
-        document_key = f"{session_id}/{filename}.{file_type}"
+        # The file path is of the format: {session_id}/{filename}, where the filename includes its extension
+        document_key = message_body.get('filePath') or f"{session_id}/{filename}"
         
         try:
-                update_vectorstore_from_s3(bucket_name, session_id)
-                logger.info(f"Vectorstore updated successfully for course {session_id}.")
+            update_vectorstore_from_s3(bucket_name, session_id, document_key)
+            logger.info(f"Vectorstore updated successfully with {document_key} for session {session_id}.")
         except Exception as e:
-                logger.error(f"Error updating vectorstore for course {session_id}: {e}")
-                return {
-                    "statusCode": 500,
-                    "body": json.dumps(f"Document inserted, but error updating vectorstore: {e}")
-                }
-        # If update_vectorstore_from_s3() was executed successfully, the following code snippet removes this document from the s3 bucket
-        s3_client = boto3.client('s3')
-        try:
-            s3_client.delete_object(Bucket=bucket_name, Key=document_key)
-            logger.info(f"Successfully deleted {document_key} from {bucket_name} after vectorstore update.")
-        except Exception as e:
-            logger.error(f"Error deleting {document_key} from {bucket_name}: {e}")
-
-        return {
-                "statusCode": 200,
-                "body": json.dumps({
-                    "message": "New file inserted into database. Vectorstore updated and document deleted from S3 successfully.",
-                    "location": f"s3://{bucket_name}/{document_key}"
-                })
-            }
+            logger.error(f"Error updating vectorstore with {document_key} for session {session_id}: {e}")
+            attempt = int(attributes.get('ApproximateReceiveCount', 1))
+            if attempt < COMPARISON_MAX_ATTEMPTS:
+                failed_items.append(record['messageId'])
+                if group_id is not None:
+                    failed_groups.add(group_id)
+            else:
+                logger.error(f"Giving up on {document_key} after {attempt} attempts.")
+                report_ingestion_failure(session_id, document_key)
+            continue
+        processed_keys.append(document_key)
 
+    logger.info(
+        f"Processed {len(processed_keys)} of {len(records)} files, {len(failed_items)} will be retried: "
+        f"{[f's3://{bucket_name}/{key}' for key in processed_keys]}"
+    )
+    # Report failures so that only the failed messages are redelivered by SQS
     return {
-        "statusCode": 400,
-        "body": json.dumps("No new document upload or deletion event found.")
+        "batchItemFailures": [{"itemIdentifier": item} for item in failed_items]
     }
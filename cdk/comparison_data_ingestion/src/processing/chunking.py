@@ -0,0 +1,63 @@
+import logging
+import os
+import re
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE_TOKENS = int(os.environ.get("CHUNK_SIZE_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "64"))
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate the number of model tokens in a text without calling a tokenizer.
+
+    Words and punctuation marks are counted separately, which tracks subword tokenizers
+    closely enough for sizing chunks and never requires a network call.
+    """
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def chunk_documents(
+    documents: List[Document],
+    chunk_size: int = CHUNK_SIZE_TOKENS,
+    chunk_overlap: int = CHUNK_OVERLAP_TOKENS
+) -> List[Document]:
+    """
+    Split page Documents into token-bounded, overlapping chunks on paragraph, line and
+    sentence boundaries, so each guideline retrieves focused passages instead of whole pages.
+
+    Args:
+        documents (List[Document]): One Document per page.
+        chunk_size (int, optional): Maximum estimated tokens per chunk.
+        chunk_overlap (int, optional): Estimated tokens shared by consecutive chunks of a page.
+
+    Returns:
+        List[Document]: The chunks in page order. Each keeps its page's metadata and
+            adds its position within the page as "chunk".
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=estimate_tokens,
+        separators=["\n\n", "\n", ". ", " ", ""]
+    )
+
+    chunks = []
+    for document in documents:
+        for chunk_idx, chunk in enumerate(text_splitter.split_text(document.page_content)):
+            chunks.append(Document(
+                page_content=chunk,
+                metadata={**document.metadata, "chunk": chunk_idx}
+            ))
+
+    logger.info(f"Split {len(documents)} pages into {len(chunks)} chunks.")
+    return chunks
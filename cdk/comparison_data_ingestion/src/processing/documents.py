@@ -1,8 +1,12 @@
-import logging, uuid, time
-from typing import List
+import json, logging, os, threading, uuid, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional
 import boto3, pymupdf
+from botocore.exceptions import ClientError
 from langchain_postgres import PGVector
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from processing.chunking import chunk_documents
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -12,6 +16,52 @@ logger = logging.getLogger(__name__)
 s3 = boto3.client('s3')
 bedrock_client = boto3.client(service_name='bedrock')
 bedrock_runtime_client = boto3.client(service_name='bedrock-runtime')
+ssm_client = boto3.client('ssm')
+
+GUARDRAIL_NAME = 'comprehensive-guardrails'
+# SSM parameter holding the resolved guardrail as {"id": ..., "version": ...}, or none
+GUARDRAIL_PARAM = os.environ.get("GUARDRAIL_PARAM")
+# Longest time to wait for a created guardrail or version to become READY
+GUARDRAIL_READY_TIMEOUT_SECONDS = 60
+# Characters of page text sent in one apply_guardrail request, within the service's content limit
+GUARDRAIL_MAX_REQUEST_CHARS = int(os.environ.get("GUARDRAIL_MAX_REQUEST_CHARS", "25000"))
+# Characters repeated between the pieces of a page split over several requests, so a phrase
+# that crosses a split is still seen whole by the guardrail
+GUARDRAIL_SPLIT_OVERLAP_CHARS = int(os.environ.get("GUARDRAIL_SPLIT_OVERLAP_CHARS", "300"))
+# Number of apply_guardrail requests in flight at once
+GUARDRAIL_CONCURRENCY = int(os.environ.get("GUARDRAIL_CONCURRENCY", "4"))
+# Embed pages while the guardrail checks run, and only store them once every page has passed
+GUARDRAIL_PIPELINE = os.environ.get("GUARDRAIL_PIPELINE", "true").lower() == "true"
+# Chunks embedded per call, i.e. how soon embedding stops after an intervention
+STAGING_BATCH_SIZE = 32
+
+# Cached guardrail (id, version), resolved once per container
+guardrail = None
+
+def wait_for_guardrail(guardrail_id: str, guardrail_version: Optional[str] = None) -> None:
+    """
+    Poll the status of a guardrail, or of one of its versions, until it is READY.
+
+    Polls with a short exponential backoff instead of sleeping for a fixed time.
+    Raises an error if the guardrail fails or is not ready within GUARDRAIL_READY_TIMEOUT_SECONDS.
+    """
+    request = {'guardrailIdentifier': guardrail_id}
+    if guardrail_version:
+        request['guardrailVersion'] = guardrail_version
+
+    delay = 0.25
+    deadline = time.monotonic() + GUARDRAIL_READY_TIMEOUT_SECONDS
+    while True:
+        status = bedrock_client.get_guardrail(**request)['status']
+        if status == 'READY':
+            return
+        if status == 'FAILED':
+            raise RuntimeError(f"Guardrail {guardrail_id} version {guardrail_version or 'DRAFT'} failed.")
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Guardrail {guardrail_id} was not ready after {GUARDRAIL_READY_TIMEOUT_SECONDS} seconds.")
+        time.sleep(delay)
+        delay = min(delay * 2, 2)
+
 
 def setup_guardrail(guardrail_name: str) -> tuple[str, str]:
     """
@@ -79,13 +129,12 @@ def setup_guardrail(guardrail_name: str) -> tuple[str, str]:
             blockedOutputsMessaging='Sorry, I cannot respond to that.'
         )
         
-        # Wait for 5 seconds so that the guardrail's status can become 'READY'
-        logger.info("Waiting for 5 seconds so that the created guardrail's status changes to 'READY'...")
-        time.sleep(5)
-        
         guardrail_id = response['guardrailId']
         logger.info(f"ID: {guardrail_id}")
-        
+
+        # Wait until the guardrail's status becomes 'READY'
+        wait_for_guardrail(guardrail_id)
+
         # Publish the initial version of the guardrail
         version_response = bedrock_client.create_guardrail_version(
             guardrailIdentifier=guardrail_id,
@@ -94,25 +143,243 @@ def setup_guardrail(guardrail_name: str) -> tuple[str, str]:
         )
         guardrail_version = version_response['version']
         logger.info(f"Version: {guardrail_version}")
+        wait_for_guardrail(guardrail_id, guardrail_version)
 
-    
     return guardrail_id, guardrail_version
 
+def get_guardrail() -> tuple[str, str]:
+    """
+    Return the (guardrail_id, guardrail_version) of the comparison guardrail.
+
+    The guardrail is resolved once and stored in the GUARDRAIL_PARAM SSM parameter, so the
+    guardrails are only listed, or the guardrail created, by the first cold start of the
+    deployment. The result is also cached for the lifetime of the container.
+    """
+    global guardrail
+    if guardrail:
+        return guardrail
+
+    if GUARDRAIL_PARAM:
+        try:
+            value = ssm_client.get_parameter(Name=GUARDRAIL_PARAM)["Parameter"]["Value"]
+            if value and value.lower() != "none":
+                stored = json.loads(value)
+                guardrail = (stored["id"], stored["version"])
+                logger.info(f"Using guardrail id={guardrail[0]}, version={guardrail[1]} from {GUARDRAIL_PARAM}.")
+                return guardrail
+        except Exception as e:
+            logger.error(f"Error reading guardrail from {GUARDRAIL_PARAM}, resolving it again: {e}")
+
+    guardrail = setup_guardrail(guardrail_name=GUARDRAIL_NAME)
+
+    if GUARDRAIL_PARAM:
+        try:
+            ssm_client.put_parameter(
+                Name=GUARDRAIL_PARAM,
+                Value=json.dumps({"id": guardrail[0], "version": guardrail[1]}),
+                Type="String",
+                Overwrite=True
+            )
+        except Exception as e:
+            # The guardrail is still cached in this container and resolved again by others
+            logger.error(f"Error storing guardrail in {GUARDRAIL_PARAM}: {e}")
+
+    return guardrail
+
+def forget_guardrail() -> None:
+    """
+    Drop the cached guardrail, e.g. after it was deleted, so that the next call resolves it again.
+    """
+    global guardrail
+    guardrail = None
+    if GUARDRAIL_PARAM:
+        try:
+            ssm_client.put_parameter(Name=GUARDRAIL_PARAM, Value="none", Type="String", Overwrite=True)
+        except Exception as e:
+            logger.error(f"Error clearing guardrail from {GUARDRAIL_PARAM}: {e}")
+
+def assessment_message(response: dict) -> str:
+    """
+    Map the assessments of an apply_guardrail response that intervened to the message shown to the user.
+
+    Args:
+        response (dict): The apply_guardrail response.
+
+    Returns:
+        str: The message for the first violation found, checking topics before sensitive information.
+    """
+    for assessment in response.get('assessments', []):
+        # Topics policy checks (Financial Advice, Offensive Content)
+        for topic in assessment.get('topicPolicy', {}).get('topics', []):
+            if topic.get('name') == 'FinancialAdvice' and topic.get('action') == 'BLOCKED':
+                return "Sorry, I cannot process your document(s) because they contain financial content. Kindly remove the relevant content and try again."
+
+            elif topic.get('name') == 'OffensiveContent' and topic.get('action') == 'BLOCKED':
+                return "Sorry, I cannot process your document(s) because they contain offensive content. Kindly remove the relevant content and try again."
+
+        # Sensitive information policy (PII) checks
+        for pii in assessment.get('sensitiveInformationPolicy', {}).get('piiEntities', []):
+            if pii.get('action') in ['BLOCKED']: # ['BLOCKED', 'ANONYMIZED']:
+                return "Sorry, I cannot process your document(s) because they contain sensitive (personally identifiable) information. Kindly remove the relevant content and try again."
+
+    # No specific violation was reported, but there was an intervention
+    return "Sorry, I cannot process your document(s) because they contain restricted content. Kindly remove the relevant content and try again."
+
+def split_text(text: str, max_chars: int, overlap: int = GUARDRAIL_SPLIT_OVERLAP_CHARS) -> List[str]:
+    """
+    Split a text into pieces of at most `max_chars` characters that overlap by about `overlap`.
+
+    Pieces end at whitespace, so words are not cut, unless the second half of a piece has none.
+    Each piece after the first starts at a word boundary about `overlap` characters before the
+    end of the previous one.
+    """
+    if len(text) <= max_chars:
+        return [text]
+
+    overlap = min(overlap, max_chars // 2)
+    pieces, start = [], 0
+    while start + max_chars < len(text):
+        end = start + max_chars
+        cut = end
+        while cut > start + max_chars // 2 and not text[cut - 1].isspace():
+            cut -= 1
+        if cut <= start + max_chars // 2:
+            cut = end
+        pieces.append(text[start:cut])
+
+        next_start = max(cut - overlap, start + 1)
+        while next_start < cut and not text[next_start - 1].isspace():
+            next_start += 1
+        start = next_start
+    pieces.append(text[start:])
+    return pieces
+
+def pack_texts(texts: List[str], max_chars: int = GUARDRAIL_MAX_REQUEST_CHARS) -> List[List[str]]:
+    """
+    Group texts into guardrail requests of at most `max_chars` characters each.
+
+    Texts keep their order, and texts longer than `max_chars` are split over several requests
+    with `split_text`.
+
+    Returns:
+        List[List[str]]: The text blocks of each request.
+    """
+    requests = []
+    current, current_chars = [], 0
+    for text in texts:
+        for piece in split_text(text, max_chars):
+            if current and current_chars + len(piece) > max_chars:
+                requests.append(current)
+                current, current_chars = [], 0
+            current.append(piece)
+            current_chars += len(piece)
+    if current:
+        requests.append(current)
+    return requests
+
+def apply_guardrail_to_texts(guardrail_id: str, guardrail_version: str, texts: List[str]) -> dict:
+    """
+    Check several texts with one apply_guardrail request, one content block per text.
+    """
+    try:
+        return bedrock_runtime_client.apply_guardrail(
+            guardrailIdentifier=guardrail_id,
+            guardrailVersion=guardrail_version,
+            source="INPUT",
+            content=[
+                {"text": {"text": text, "qualifiers": ["guard_content"]}}
+                for text in texts
+            ]
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ResourceNotFoundException":
+            # The stored guardrail was deleted; the retried message resolves it again
+            forget_guardrail()
+        raise
+
+def screen_texts(guardrail_id: str, guardrail_version: str, texts: List[str]) -> Optional[str]:
+    """
+    Check texts against the guardrail with packed requests, GUARDRAIL_CONCURRENCY at a time.
+
+    Checks that have not started are cancelled as soon as one request reports an intervention.
+
+    Args:
+        guardrail_id (str): The guardrail ID.
+        guardrail_version (str): The guardrail version.
+        texts (List[str]): The texts to check, e.g. the pages of the uploaded documents.
+
+    Returns:
+        Optional[str]: The message to show the user if the guardrail intervened, otherwise None.
+    """
+    requests = pack_texts(texts)
+    logger.info(f"Checking {len(texts)} texts with {len(requests)} guardrail requests.")
+
+    executor = ThreadPoolExecutor(max_workers=max(1, GUARDRAIL_CONCURRENCY))
+    try:
+        pending = {
+            executor.submit(apply_guardrail_to_texts, guardrail_id, guardrail_version, request)
+            for request in requests
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    logger.error(f"Error applying guardrail: {e}")
+                    raise
+                if response.get('action') == 'GUARDRAIL_INTERVENED':
+                    return assessment_message(response)
+        return None
+    finally:
+        # Requests already in flight finish in the background; their results are not needed
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def stage_embeddings(
+    embeddings: Embeddings,
+    texts: List[str],
+    stop: threading.Event,
+    batch_size: int = STAGING_BATCH_SIZE
+) -> Optional[List[List[float]]]:
+    """
+    Embed texts in batches into memory, without storing them in the vectorstore.
+
+    Args:
+        embeddings (Embeddings): The embeddings used by the vectorstore.
+        texts (List[str]): The texts to embed.
+        stop (threading.Event): Set when the vectors are no longer needed, e.g. after a
+            guardrail intervention; no further batches are embedded once it is set.
+        batch_size (int, optional): Number of texts embedded per call.
+
+    Returns:
+        Optional[List[List[float]]]: One vector per text, or None if stopped.
+    """
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        if stop.is_set():
+            return None
+        vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+    return vectors
+
 def process_documents(
     bucket: str,
     category_id: str, 
-    vectorstore: PGVector
+    vectorstore: PGVector,
+    document_keys: Optional[List[str]] = None
 ) -> str:
     """
     Process documents stored in an S3 bucket under the provided category ID. 
     
     1. Retrieve or create guardrails needed for content filtering.
-    2. List documents in the specified S3 path.
-    3. Download and process each document (PDF), page by page.
-    4. Apply the configured guardrail checks via the Bedrock Runtime.
+    2. List documents in the specified S3 path, unless `document_keys` are given.
+    3. Download each document (PDF) and extract the text of its pages.
+    4. Apply the configured guardrail checks to all pages via the Bedrock Runtime,
+       packing several pages into each request and sending requests concurrently.
+       Unless GUARDRAIL_PIPELINE is disabled, the pages' token-bounded chunks are
+       embedded into memory at the same time.
        - If any restricted content is found, all documents are deleted from S3, 
          and processing is aborted with an error message.
-    5. Otherwise, successful documents are added to the vectorstore, 
+    5. Otherwise, the chunks are embedded in batches and added to the vectorstore, 
        and the originals are removed from S3.
 
     Args:
@@ -120,6 +387,8 @@ def process_documents(
         category_id (str): A specific prefix in the S3 bucket indicating which 
                         documents to process.
         vectorstore (PGVector): An instance of PGVector for adding the processed documents.
+        document_keys (List[str], optional): The documents to process, e.g. the file named
+                        by an upload event. Defaults to every document under the prefix.
     
     Returns:
         str: 
@@ -129,30 +398,30 @@ def process_documents(
     """
     logger.info("Starting document processing...")
 
-    # Setup or retrieve the necessary guardrail
-    guardrail_id, guardrail_version = setup_guardrail(guardrail_name='comprehensive-guardrails')
+    # Retrieve the guardrail, which is only set up on the first cold start of the deployment
+    guardrail_id, guardrail_version = get_guardrail()
 
-    # Collect all document keys under the specified prefix
-    document_keys = []
-    paginator = s3.get_paginator('list_objects_v2')
-    page_iterator = paginator.paginate(Bucket=bucket, Prefix=f"{category_id}/")
-    try:
-        for page in page_iterator:
-            if "Contents" not in page:
-                continue
-            for obj in page['Contents']:
-                key = obj['Key']
-                # Skip folders (keys ending with "/")
-                if not key.endswith("/"):
-                    document_keys.append(key)
-    except Exception as e:
-        logger.error(f"Error listing documents: {e}")
-        raise
+    if document_keys is None:
+        # Collect all document keys under the specified prefix
+        document_keys = []
+        paginator = s3.get_paginator('list_objects_v2')
+        page_iterator = paginator.paginate(Bucket=bucket, Prefix=f"{category_id}/")
+        try:
+            for page in page_iterator:
+                if "Contents" not in page:
+                    continue
+                for obj in page['Contents']:
+                    key = obj['Key']
+                    # Skip folders (keys ending with "/")
+                    if not key.endswith("/"):
+                        document_keys.append(key)
+        except Exception as e:
+            logger.error(f"Error listing documents: {e}")
+            raise
 
     all_docs = []
-    error_message = None
 
-    # Process each document individually
+    # Extract the text of every page first, so all pages can be checked together
     for document_key in document_keys:
         logger.info(f"Processing document: {document_key}")
         try:
@@ -171,67 +440,7 @@ def process_documents(
                 if not page_text:
                     continue
 
-                # Apply the guardrail to the extracted text
-                try:
-                    response = bedrock_runtime_client.apply_guardrail(
-                        guardrailIdentifier=guardrail_id,
-                        guardrailVersion=guardrail_version,
-                        source="INPUT",
-                        content=[{"text": {
-                            "text": page_text,
-                            "qualifiers": ["guard_content"]}
-                        }]
-                    )
-                    
-                    # Check if guardrail intervention occurred
-                    if response.get('action') == 'GUARDRAIL_INTERVENED':
-                        error_message = None
-                        # Inspect each assessment for violations in order of priority
-                        for assessment in response.get('assessments', []):
-                            # Topics policy checks (Financial Advice, Offensive Content)
-                            if 'topicPolicy' in assessment:
-                                for topic in assessment['topicPolicy'].get('topics', []):
-                                    if topic.get('name') == 'FinancialAdvice' and topic.get('action') == 'BLOCKED':
-                                        error_message = "Sorry, I cannot process your document(s) because they contain financial content. Kindly remove the relevant content and try again."
-                                        break
-
-                                    elif topic.get('name') == 'OffensiveContent' and topic.get('action') == 'BLOCKED':
-                                        error_message = "Sorry, I cannot process your document(s) because they contain offensive content. Kindly remove the relevant content and try again."
-                                        break
-                                if error_message:
-                                    break
-
-                            # Sensitive information policy (PII) checks
-                            if not error_message and 'sensitiveInformationPolicy' in assessment:
-                                for pii in assessment['sensitiveInformationPolicy'].get('piiEntities', []):
-                                    if pii.get('action') in ['BLOCKED']: # ['BLOCKED', 'ANONYMIZED']:
-                                        error_message = "Sorry, I cannot process your document(s) because they contain sensitive (personally identifiable) information. Kindly remove the relevant content and try again."
-                                        break
-                                if error_message:
-                                    break
-
-                        # If we still have no specific message but there's an intervention
-                        if not error_message:
-                            error_message = "Sorry, I cannot process your document(s) because they contain restricted content. Kindly remove the relevant content and try again."
-
-                        # Cleanup before aborting
-                        doc_pdf.close()
-
-                        # Delete all documents from S3 since the user must re-upload 
-                        # for a new attempt
-                        for key in document_keys:
-                            s3.delete_object(Bucket=bucket, Key=key)
-                            logger.info(f"Deleted {key} from S3.")
-
-                        # Return the error message triggered by guardrails
-                        return error_message
-
-                except Exception as e:
-                    logger.error(f"Error applying guardrail: {e}")
-                    raise
-
-                # If guardrail did not trigger a block, 
-                # create a Document object for further processing
+                # Create a Document object for further processing
                 all_docs.append(Document(
                     page_content=page_text,
                     metadata={
@@ -248,10 +457,51 @@ def process_documents(
             logger.error(f"Error processing document {document_key}: {e}")
             raise
 
-    # If no guardrail errors occurred, add all documents to the vector store
-    if all_docs:
-        vectorstore.add_documents(all_docs)
-        logger.info(f"Added {len(all_docs)} documents to vectorstore.")
+    # Whole pages are screened, while their token-bounded chunks are embedded and stored
+    page_texts = [doc.page_content for doc in all_docs]
+    chunks = chunk_documents(all_docs)
+    chunk_texts = [chunk.page_content for chunk in chunks]
+    vectors = None
+
+    if GUARDRAIL_PIPELINE and chunk_texts:
+        # Embed the chunks into memory while the guardrail checks the pages. The vectors are
+        # only written to the session collection if every page passes, so on clean documents
+        # the upload takes about as long as the slower of the two instead of their sum.
+        stop = threading.Event()
+        staging = ThreadPoolExecutor(max_workers=1)
+        staged = staging.submit(stage_embeddings, vectorstore.embeddings, chunk_texts, stop)
+        try:
+            error_message = screen_texts(guardrail_id, guardrail_version, page_texts)
+            if not error_message:
+                vectors = staged.result()
+        finally:
+            # Discard the staged vectors on intervention or error
+            stop.set()
+            staging.shutdown(wait=False, cancel_futures=True)
+    else:
+        # Apply the guardrail to the extracted text
+        error_message = screen_texts(guardrail_id, guardrail_version, page_texts)
+        if not error_message:
+            vectors = stage_embeddings(vectorstore.embeddings, chunk_texts, threading.Event())
+
+    if error_message:
+        # Delete all documents from S3 since the user must re-upload 
+        # for a new attempt
+        for key in document_keys:
+            s3.delete_object(Bucket=bucket, Key=key)
+            logger.info(f"Deleted {key} from S3.")
+
+        # Return the error message triggered by guardrails
+        return error_message
+
+    # If no guardrail errors occurred, add all chunks to the vector store
+    if chunks:
+        vectorstore.add_embeddings(
+            texts=chunk_texts,
+            embeddings=vectors,
+            metadatas=[chunk.metadata for chunk in chunks]
+        )
+        logger.info(f"Added {len(chunks)} chunks of {len(all_docs)} pages to vectorstore.")
 
     # Regardless of success or error, delete the original S3 objects if we've reached this point
     for key in document_keys:
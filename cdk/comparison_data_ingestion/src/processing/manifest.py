@@ -0,0 +1,135 @@
+import json
+import logging
+from typing import List, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+from helpers.ephemeral_store import EPHEMERAL_STORE_PREFIX, delete_session_files
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+s3 = boto3.client('s3')
+
+
+class SessionManifest:
+    """
+    Tracks which files of a comparison session have been ingested.
+
+    The comparison pre-signed URL function writes one `expected/<file>` marker per file the
+    user uploads, holding the number of files in the upload when the frontend sends it.
+    Ingestion processes one file per message and records it as ready in `manifest.json`; the
+    session is complete once every expected file is ready, so "embeddings ready" is sent once.
+
+    The manifest and markers cover one upload. They are deleted with `clear` once the upload
+    is notified as ready, once every file of a rejected upload has been skipped, and by the
+    evaluation when it deletes the session's vectors, so the next upload of the session is
+    neither skipped nor left without its "embeddings ready" message.
+
+    Messages of a session share an SQS FIFO message group and are processed one at a time,
+    so the manifest is updated without concurrent writers.
+    """
+
+    def __init__(self, bucket: str, session_id: str):
+        """
+        Args:
+            bucket (str): The S3 bucket holding the manifest and the expected file markers.
+            session_id (str): The comparison session ID.
+        """
+        self.bucket = bucket
+        self.session_id = session_id
+        self.prefix = f"{EPHEMERAL_STORE_PREFIX}/{session_id}"
+        self.key = f"{self.prefix}/manifest.json"
+        self.state = self._load()
+
+    def _load(self) -> dict:
+        try:
+            body = s3.get_object(Bucket=self.bucket, Key=self.key)['Body'].read()
+            return json.loads(body)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return {"ready": [], "skipped": [], "failed": None, "notified": False}
+            raise
+
+    def _save(self) -> None:
+        s3.put_object(Bucket=self.bucket, Key=self.key, Body=json.dumps(self.state).encode("utf-8"))
+
+    def _expected_files(self) -> tuple[List[str], int]:
+        """
+        Return the names of the expected files and the number of files announced with them.
+        """
+        names, announced = [], 0
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}/expected/"):
+            for obj in page.get('Contents', []):
+                names.append(obj['Key'].rsplit('/', 1)[-1])
+                body = s3.get_object(Bucket=self.bucket, Key=obj['Key'])['Body'].read().decode("utf-8").strip()
+                if body.isdigit():
+                    announced = max(announced, int(body))
+        return names, announced
+
+    @property
+    def failed(self) -> Optional[str]:
+        """
+        The message sent to the user if a file of the session was rejected, otherwise None.
+        """
+        return self.state.get("failed")
+
+    def mark_ready(self, filename: str) -> bool:
+        """
+        Record a file as ingested.
+
+        Returns:
+            bool: True if this completed the session and "embeddings ready" must now be sent.
+        """
+        if filename not in self.state["ready"]:
+            self.state["ready"].append(filename)
+
+        names, announced = self._expected_files()
+        ready = set(self.state["ready"])
+        complete = ready.issuperset(names) and len(ready) >= announced
+        logger.info(
+            f"Session {self.session_id}: {len(ready)} files ready, "
+            f"expecting {max(len(set(names) | ready), announced)}."
+        )
+
+        notify = complete and not self.state["notified"] and not self.failed
+        if notify:
+            self.state["notified"] = True
+        self._save()
+        return notify
+
+    def mark_skipped(self, filename: str) -> bool:
+        """
+        Record a file of a rejected upload as skipped.
+
+        Returns:
+            bool: True if every expected file of the upload has now been ingested or skipped.
+        """
+        skipped = self.state.setdefault("skipped", [])
+        if filename not in skipped:
+            skipped.append(filename)
+        self._save()
+
+        names, announced = self._expected_files()
+        done = set(self.state["ready"]) | set(skipped)
+        return done.issuperset(names) and len(done) >= announced
+
+    def mark_failed(self, message: str, filename: str) -> bool:
+        """
+        Record that a file was rejected, so the upload's other files are skipped.
+
+        Returns:
+            bool: True if every expected file of the upload has now been ingested or skipped.
+        """
+        self.state["failed"] = message
+        return self.mark_skipped(filename)
+
+    def clear(self) -> None:
+        """
+        Delete the manifest and the expected file markers, so the next upload starts afresh.
+        """
+        delete_session_files(self.bucket, self.session_id)
+        self.state = {"ready": [], "skipped": [], "failed": None, "notified": False}
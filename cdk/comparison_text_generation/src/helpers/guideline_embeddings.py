@@ -0,0 +1,96 @@
+import hashlib
+import logging
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+from psycopg2.extras import execute_values
+
+from helpers.retrieval import embed_queries
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+GUIDELINE_EMBEDDINGS_TABLE = "guideline_embeddings"
+
+
+def guideline_hash(text: str) -> str:
+    """
+    Return the sha256 hex digest of a guideline text with its whitespace normalized.
+    """
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def get_guideline_embeddings(
+    connection,
+    embeddings: Embeddings,
+    guidelines: List[str],
+    max_concurrency: int = 1
+) -> List[List[float]]:
+    """
+    Return the query embeddings of guideline texts, embedding only those not yet stored.
+
+    Guideline embeddings are kept in the `guideline_embeddings` table next to the guidelines,
+    keyed by (model_id, content hash). Guidelines are edited by replacing them, so an unchanged
+    guideline keeps its entry and an edited one is embedded on its first evaluation. Database
+    errors are logged and fall back to embedding every guideline, so evaluations never depend
+    on the table.
+
+    Args:
+        connection: An open psycopg2 connection to the database holding the guidelines.
+        embeddings (Embeddings): The embeddings of the model the session was embedded with.
+        guidelines (List[str]): The guideline texts, as evaluated.
+        max_concurrency (int, optional): Number of missing guidelines embedded concurrently.
+
+    Returns:
+        List[List[float]]: One vector per guideline, in input order.
+    """
+    model_id = getattr(embeddings, "model_id", None)
+    if not guidelines or not model_id:
+        return embed_queries(embeddings, guidelines, max_concurrency)
+
+    hashes = [guideline_hash(guideline) for guideline in guidelines]
+    stored: Dict[str, List[float]] = {}
+    cur = connection.cursor()
+    try:
+        cur.execute(f"""
+            SELECT content_hash, embedding
+            FROM "{GUIDELINE_EMBEDDINGS_TABLE}"
+            WHERE model_id = %s AND content_hash = ANY(%s);
+        """, (model_id, list(set(hashes))))
+        stored = {row[0]: row[1] for row in cur.fetchall()}
+        connection.commit()
+    except Exception as e:
+        connection.rollback()
+        logger.error(f"Error reading guideline embeddings, embedding the guidelines instead: {e}")
+    finally:
+        cur.close()
+
+    missing = {}
+    for guideline, text_hash in zip(guidelines, hashes):
+        if text_hash not in stored and text_hash not in missing:
+            missing[text_hash] = guideline
+
+    if missing:
+        computed = dict(zip(missing.keys(), embed_queries(embeddings, list(missing.values()), max_concurrency)))
+        cur = connection.cursor()
+        try:
+            execute_values(
+                cur,
+                f"""
+                INSERT INTO "{GUIDELINE_EMBEDDINGS_TABLE}" (model_id, content_hash, embedding)
+                VALUES %s
+                ON CONFLICT (model_id, content_hash) DO NOTHING;
+                """,
+                [(model_id, text_hash, vector) for text_hash, vector in computed.items()]
+            )
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            logger.error(f"Error storing guideline embeddings: {e}")
+        finally:
+            cur.close()
+        stored.update(computed)
+
+    logger.info(f"Loaded {len(guidelines) - len(missing)} stored guideline embeddings, embedded {len(missing)}.")
+    return [list(stored[text_hash]) for text_hash in hashes]
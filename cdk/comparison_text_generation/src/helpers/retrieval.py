@@ -0,0 +1,109 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStoreRetriever
+from langchain_postgres import PGVector
+from sqlalchemy import text
+
+from helpers.ephemeral_store import EphemeralVectorStore
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+
+
+def embed_queries(embeddings: Embeddings, queries: List[str], max_concurrency: int = 1) -> List[List[float]]:
+    """
+    Embed all queries in one pass.
+
+    Bedrock embedding models take one text per request, so the queries are embedded
+    concurrently rather than one after another. `embed_query` is used rather than
+    `embed_documents` because some models embed queries differently from documents.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        return list(executor.map(embeddings.embed_query, queries))
+
+
+def pgvector_batch_search(vectorstore: PGVector, query_embeddings: List[List[float]], k: int) -> List[List[Document]]:
+    """
+    Return the k nearest documents of a PGVector collection for each query with one SQL statement.
+    """
+    results: List[List[Document]] = [[] for _ in query_embeddings]
+    if not query_embeddings:
+        return results
+
+    with vectorstore._make_sync_session() as session:
+        collection = vectorstore.get_collection(session)
+        if not collection:
+            return results
+
+        rows = session.execute(
+            text(f"""
+                SELECT q.idx, nearest.document, nearest.cmetadata
+                FROM unnest(CAST(:queries AS text[])) WITH ORDINALITY AS q(query, idx)
+                CROSS JOIN LATERAL (
+                    SELECT document, cmetadata, embedding <=> CAST(q.query AS vector) AS distance
+                    FROM {EMBEDDING_TABLE}
+                    WHERE collection_id = :collection_id
+                    ORDER BY distance
+                    LIMIT :k
+                ) AS nearest
+                ORDER BY q.idx, nearest.distance;
+            """),
+            {
+                "queries": [str(list(embedding)) for embedding in query_embeddings],
+                "collection_id": collection.uuid,
+                "k": k,
+            }
+        ).fetchall()
+        session.commit()
+
+    for idx, document, cmetadata in rows:
+        results[idx - 1].append(Document(page_content=document, metadata=cmetadata or {}))
+    return results
+
+
+def retrieve_for_queries(
+    retriever: VectorStoreRetriever,
+    queries: List[str],
+    max_concurrency: int = 1,
+    query_embedder: Optional[Callable[[Embeddings, List[str]], List[List[float]]]] = None
+) -> List[List[Document]]:
+    """
+    Retrieve the documents of every query with a single batched search.
+
+    All queries are embedded in one pass, and the nearest documents of all of them are found with
+    one matrix product for an EphemeralVectorStore or one SQL statement for a PGVector collection.
+    Other retrievers fall back to retrieving each query separately.
+
+    Args:
+        retriever (VectorStoreRetriever): The session's retriever; its `k` is used for every query.
+        queries (List[str]): The queries, e.g. the guidelines to evaluate.
+        max_concurrency (int, optional): Number of queries embedded concurrently.
+        query_embedder (Callable, optional): Returns the vectors of the queries for the store's
+            embeddings, e.g. from stored guideline embeddings. Defaults to `embed_queries`.
+
+    Returns:
+        List[List[Document]]: The retrieved documents of each query, in query order.
+    """
+    vectorstore = getattr(retriever, "vectorstore", None)
+    if not isinstance(vectorstore, (EphemeralVectorStore, PGVector)):
+        return retriever.batch(queries, config={"max_concurrency": max_concurrency})
+
+    k = retriever.search_kwargs.get("k", 4)
+    if query_embedder:
+        query_embeddings = query_embedder(vectorstore.embeddings, queries)
+    else:
+        query_embeddings = embed_queries(vectorstore.embeddings, queries, max_concurrency)
+    if isinstance(vectorstore, EphemeralVectorStore):
+        results = vectorstore.similarity_search_by_vectors(query_embeddings, k)
+    else:
+        results = pgvector_batch_search(vectorstore, query_embeddings, k)
+
+    logger.info(f"Retrieved the top {k} documents of {len(queries)} queries with one batched search.")
+    return results
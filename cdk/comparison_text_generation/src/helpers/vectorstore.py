@@ -2,6 +2,7 @@ from typing import Dict
 
 from langchain_core.vectorstores import VectorStoreRetriever
 from helpers.helper import get_vectorstore
+from helpers.ephemeral_store import EphemeralVectorStore, session_key
 
 
 def get_vectorstore_retriever_ordinary(
@@ -35,3 +36,27 @@ def get_vectorstore_retriever_ordinary(
     )
     
     return vectorstore.as_retriever(search_kwargs={'k': 5}), vectorstore
+
+
+def get_vectorstore_retriever_ephemeral(
+    bucket: str,
+    session_id: str,
+    embeddings_for_model  # : Callable[[Optional[str]], BedrockEmbeddings]
+) -> VectorStoreRetriever:
+    """
+    Load a comparison session's vectors from S3 and return an ordinary retriever searching
+    them in memory, along with the vectorstore itself.
+
+    Args:
+        bucket (str): The S3 bucket the session's vectors were saved to.
+        session_id (str): The comparison session ID.
+        embeddings_for_model: Returns the embeddings instance for the model id recorded
+            with the session's vectors, so queries are embedded with the same model.
+
+    Returns:
+        (VectorStoreRetriever, EphemeralVectorStore): The retriever and the vectorstore.
+    """
+    vectorstore = EphemeralVectorStore.load(bucket=bucket, key=session_key(session_id))
+    vectorstore.embedding = embeddings_for_model(vectorstore.embedding_model_id)
+
+    return vectorstore.as_retriever(search_kwargs={'k': 5}), vectorstore
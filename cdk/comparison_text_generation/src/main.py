@@ -7,8 +7,10 @@ import psycopg2
 import httpx
 import uuid, datetime
 from langchain_aws import BedrockEmbeddings
-from helpers.vectorstore import get_vectorstore_retriever_ordinary
-from helpers.chat import get_bedrock_llm, get_response_evaluation
+from helpers.vectorstore import get_vectorstore_retriever_ephemeral, get_vectorstore_retriever_ordinary
+from helpers.chat import BEDROCK_CLIENT_CONFIG, get_bedrock_llm, get_response_evaluation
+from helpers.guideline_embeddings import get_guideline_embeddings
+from helpers.ephemeral_store import delete_session_files
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO)
@@ -24,10 +26,17 @@ BEDROCK_LLM_PARAM = os.environ["BEDROCK_LLM_PARAM"]
 EMBEDDING_MODEL_PARAM = os.environ["EMBEDDING_MODEL_PARAM"]
 TABLE_NAME_PARAM = os.environ["TABLE_NAME_PARAM"]
 API_KEY = os.environ["API_KEY"]
+# "ephemeral" loads session vectors from S3 and searches them in memory, "pgvector" queries the database
+COMPARISON_VECTORSTORE = os.environ.get("COMPARISON_VECTORSTORE", "pgvector")
+EMBEDDING_BUCKET_NAME = os.environ.get("EMBEDDING_BUCKET_NAME")
+# Number of guidelines evaluated concurrently
+EVALUATION_CONCURRENCY = int(os.environ.get("EVALUATION_CONCURRENCY", "4"))
+# Maximum number of guidelines sharing a header evaluated in one prompt; 1 evaluates each separately
+EVALUATION_GROUP_SIZE = int(os.environ.get("EVALUATION_GROUP_SIZE", "1"))
 # AWS Clients
 secrets_manager_client = boto3.client("secretsmanager")
 ssm_client = boto3.client("ssm", region_name=REGION)
-bedrock_runtime = boto3.client("bedrock-runtime", region_name=REGION)
+bedrock_runtime = boto3.client("bedrock-runtime", region_name=REGION, config=BEDROCK_CLIENT_CONFIG)
 # Cached resources
 connection = None
 connection_comparison = None
@@ -38,6 +47,8 @@ EMBEDDING_MODEL_ID = None
 TABLE_NAME = None
 # Cached embeddings instance
 embeddings = None
+# Embeddings instances for other models, keyed by model id
+embeddings_by_model = {}
 
 def invoke_event_notification(session_id, message):
     """
@@ -183,6 +194,51 @@ def connect_to_comparison_db():
             raise
     return connection_comparison
 
+def get_collection_model_id(collection_name):
+    """
+    Return the embedding model id recorded in a comparison session's collection, or None
+    for collections created before the model id was recorded.
+    """
+    connection = connect_to_comparison_db()
+    cur = None
+    try:
+        cur = connection.cursor()
+        cur.execute(
+            "SELECT cmetadata->>'embedding_model_id' FROM langchain_pg_collection WHERE name = %s;",
+            (collection_name,)
+        )
+        row = cur.fetchone()
+        connection.commit()
+    except Exception as e:
+        logger.error(f"Error fetching the embedding model of collection {collection_name}: {e}")
+        connection.rollback()
+        row = None
+    finally:
+        if cur:
+            cur.close()
+    return row[0] if row else None
+
+def get_collection_embeddings(collection_name):
+    """
+    Return the embeddings instance for the model a session's documents were embedded with,
+    so the evaluation keeps working for sessions uploaded before an embedding model switch.
+    """
+    return get_model_embeddings(get_collection_model_id(collection_name))
+
+def get_model_embeddings(model_id):
+    """
+    Return the embeddings instance for a model id, or the configured model's if it is None.
+    """
+    if not model_id or model_id == EMBEDDING_MODEL_ID:
+        return embeddings
+    if model_id not in embeddings_by_model:
+        embeddings_by_model[model_id] = BedrockEmbeddings(
+            model_id=model_id,
+            client=bedrock_runtime,
+            region_name=REGION,
+        )
+    return embeddings_by_model[model_id]
+
 def get_combined_guidelines(criteria_list):
     """
     Fetch and organize headers and bodies of all guidelines matching the given criteria names.
@@ -293,10 +349,17 @@ def handler(event, context):
         # Try obtaining the ordinary retriever given this vectorstore config dict
         try:
             logger.info("Creating ordinary retriever for user uploaded vectorstore.")
-            ordinary_retriever, user_uploaded_vectorstore = get_vectorstore_retriever_ordinary(
-                vectorstore_config_dict=vectorstore_config_dict,
-                embeddings=embeddings
-            )
+            if COMPARISON_VECTORSTORE == "ephemeral":
+                ordinary_retriever, user_uploaded_vectorstore = get_vectorstore_retriever_ephemeral(
+                    bucket=EMBEDDING_BUCKET_NAME,
+                    session_id=session_id,
+                    embeddings_for_model=get_model_embeddings
+                )
+            else:
+                ordinary_retriever, user_uploaded_vectorstore = get_vectorstore_retriever_ordinary(
+                    vectorstore_config_dict=vectorstore_config_dict,
+                    embeddings=get_collection_embeddings(session_id)
+                )
         except Exception as e:
             logger.error(f"Error creating ordinary retriever for user uploaded vectorstore: {e}")
             return {
@@ -321,7 +384,12 @@ def handler(event, context):
                 for individual_response in get_response_evaluation(
                     llm=llm,
                     retriever=ordinary_retriever,
-                    guidelines_file=guidelines
+                    guidelines_file=guidelines,
+                    max_concurrency=EVALUATION_CONCURRENCY,
+                    guideline_embedder=lambda model_embeddings, texts: get_guideline_embeddings(
+                        connect_to_db(), model_embeddings, texts, EVALUATION_CONCURRENCY
+                    ),
+                    group_size=EVALUATION_GROUP_SIZE
                 ):
                     # Extract the current header from the response (assuming it's stored in "header")
                     current_header = individual_response.get("header")
@@ -364,12 +432,15 @@ def handler(event, context):
             # Delete the collection from the user_uploaded_vectorstore after the embeddings have been used for evaluation
             if user_uploaded_vectorstore:
                 user_uploaded_vectorstore.delete_collection()
+                # The session's next upload must not find this upload's ingestion manifest
+                delete_session_files(EMBEDDING_BUCKET_NAME, session_id)
                 
             else:
                 print("User uploaded vector store collection not found! Could not delete it as a result.")
         except Exception as e:
              # Deleting this vectorstore collection if there was an error generating an LLM response.
              user_uploaded_vectorstore.delete_collection()
+             delete_session_files(EMBEDDING_BUCKET_NAME, session_id)
              logger.error(f"Error getting response: {e}")
              return {
                     'statusCode': 500,
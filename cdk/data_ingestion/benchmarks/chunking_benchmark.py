@@ -0,0 +1,135 @@
+"""
+Compare chunking strategies on a local set of documents.
+
+For each strategy this reports:
+  - pages/sec: pages chunked and embedded per second of wall-clock time
+  - embeddings: number of texts sent to the embeddings model (chunking + indexing)
+  - hit rate: fraction of questions whose expected answer appears in a top-k retrieved chunk
+
+The question set is a JSON list of objects with a "question" and an "answer" snippet, e.g.
+
+    [{"question": "What is the Digital Learning Strategy?", "answer": "system-wide approach"}]
+
+Usage (from cdk/data_ingestion):
+
+    python benchmarks/chunking_benchmark.py --documents ./docs --questions ./questions.json \
+        --model-id amazon.titan-embed-text-v2:0 --region ca-central-1
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List
+
+import boto3
+import numpy as np
+import pymupdf
+from langchain_aws import BedrockEmbeddings
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from processing.chunking import get_chunking_strategy  # noqa: E402
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that counts how many texts are sent to the underlying model.
+    """
+
+    def __init__(self, underlying_embeddings: Embeddings):
+        self.underlying_embeddings = underlying_embeddings
+        self.count = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.count += len(texts)
+        return self.underlying_embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self.count += 1
+        return self.underlying_embeddings.embed_query(text)
+
+
+def load_pages(documents_dir: str) -> List[str]:
+    pages = []
+    for filename in sorted(os.listdir(documents_dir)):
+        path = os.path.join(documents_dir, filename)
+        if not os.path.isfile(path):
+            continue
+        with pymupdf.open(path) as doc:
+            pages.extend(page.get_text() for page in doc)
+    return [page for page in pages if page.strip()]
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def hit_rate(chunks: List[str], chunk_vectors: np.ndarray, questions: List[dict], embeddings: Embeddings, top_k: int) -> float:
+    if not questions or not chunks:
+        return 0.0
+    normalized_chunks = [normalize(chunk) for chunk in chunks]
+    chunk_vectors = chunk_vectors / np.linalg.norm(chunk_vectors, axis=1, keepdims=True)
+    hits = 0
+    for item in questions:
+        query = np.array(embeddings.embed_query(item["question"]))
+        scores = chunk_vectors @ (query / np.linalg.norm(query))
+        top = np.argsort(-scores)[:top_k]
+        answer = normalize(item["answer"])
+        if any(answer in normalized_chunks[i] for i in top):
+            hits += 1
+    return hits / len(questions)
+
+
+def run(strategy_name: str, pages: List[str], questions: List[dict], base_embeddings: Embeddings, top_k: int) -> dict:
+    embeddings = CountingEmbeddings(base_embeddings)
+    strategy = get_chunking_strategy(strategy_name, embeddings)
+
+    start = time.perf_counter()
+    chunks = [doc.page_content for doc in strategy.create_documents(pages) if doc.page_content]
+    chunk_vectors = np.array(embeddings.embed_documents(chunks))
+    elapsed = time.perf_counter() - start
+    embeddings_issued = embeddings.count
+
+    return {
+        "strategy": strategy.name,
+        "pages": len(pages),
+        "chunks": len(chunks),
+        "pages_per_sec": len(pages) / elapsed if elapsed else float("inf"),
+        "embeddings": embeddings_issued,
+        "hit_rate": hit_rate(chunks, chunk_vectors, questions, base_embeddings, top_k),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", required=True, help="Directory of documents to chunk")
+    parser.add_argument("--questions", required=True, help="JSON file with the fixed question set")
+    parser.add_argument("--strategies", nargs="+", default=["recursive", "semantic", "hybrid"])
+    parser.add_argument("--model-id", default="amazon.titan-embed-text-v2:0")
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION"))
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    pages = load_pages(args.documents)
+    with open(args.questions) as f:
+        questions = json.load(f)
+
+    base_embeddings = BedrockEmbeddings(
+        model_id=args.model_id,
+        client=boto3.client("bedrock-runtime", region_name=args.region),
+        region_name=args.region
+    )
+
+    print(f"{'strategy':<10} {'pages':>6} {'chunks':>7} {'pages/sec':>10} {'embeddings':>11} {'hit rate':>9}")
+    for strategy_name in args.strategies:
+        result = run(strategy_name, pages, questions, base_embeddings, args.top_k)
+        print(
+            f"{result['strategy']:<10} {result['pages']:>6} {result['chunks']:>7} "
+            f"{result['pages_per_sec']:>10.2f} {result['embeddings']:>11} {result['hit_rate']:>9.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import logging
+import os
+import uuid
+from typing import Any, List, Optional, Sequence
+
+from langchain_postgres import PGVector
+from pgvector.psycopg import register_vector
+from psycopg.types.json import Jsonb
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Batches smaller than this go through the regular ORM insert
+BULK_COPY_MIN_ROWS = int(os.environ.get("BULK_COPY_MIN_ROWS", "500"))
+
+
+class BulkCopyPGVector(PGVector):
+    """
+    PGVector that writes large batches of embeddings with a binary COPY.
+
+    Rows are streamed into a temporary staging table with `COPY ... FROM STDIN (FORMAT BINARY)`
+    and then upserted into `langchain_pg_embedding` in the same transaction, preserving the
+    ON CONFLICT (id) semantics of `PGVector.add_embeddings`. Because only the write path changes,
+    `index()` keeps the SQLRecordManager records consistent exactly as before.
+    """
+
+    def add_embeddings(
+        self,
+        texts: Sequence[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """
+        Add embeddings to the vectorstore, using COPY for batches of at least BULK_COPY_MIN_ROWS rows.
+
+        Args:
+            texts (Sequence[str]): The texts to store.
+            embeddings (List[List[float]]): One embedding vector per text.
+            metadatas (List[dict], optional): Metadata for each text.
+            ids (List[str], optional): Ids for each text. Generated when not provided.
+
+        Returns:
+            List[str]: The ids of the stored rows.
+        """
+        if len(texts) < BULK_COPY_MIN_ROWS:
+            return super().add_embeddings(texts, embeddings, metadatas=metadatas, ids=ids, **kwargs)
+
+        if ids is None:
+            ids_ = [str(uuid.uuid4()) for _ in texts]
+        else:
+            ids_ = [id if id is not None else str(uuid.uuid4()) for id in ids]
+
+        if not metadatas:
+            metadatas = [{} for _ in texts]
+
+        with self._make_sync_session() as session:
+            collection = self.get_collection(session)
+            if not collection:
+                raise ValueError("Collection not found")
+
+            # The raw psycopg connection behind the session, so COPY runs in the session's transaction
+            driver_connection = session.connection().connection.driver_connection
+            register_vector(driver_connection)
+
+            table_name = self.EmbeddingStore.__tablename__
+            with driver_connection.cursor() as cur:
+                cur.execute(f"""
+                    CREATE TEMP TABLE "{table_name}_staging"
+                        (LIKE "{table_name}" INCLUDING DEFAULTS)
+                        ON COMMIT DROP;
+                """)
+                with cur.copy(f"""
+                    COPY "{table_name}_staging" (id, collection_id, embedding, document, cmetadata)
+                    FROM STDIN (FORMAT BINARY)
+                """) as copy:
+                    copy.set_types(["varchar", "uuid", "vector", "varchar", "jsonb"])
+                    for text, metadata, embedding, id in zip(texts, metadatas, embeddings, ids_):
+                        copy.write_row((id, collection.uuid, embedding, text, Jsonb(metadata or {})))
+
+                cur.execute(f"""
+                    INSERT INTO "{table_name}" (id, collection_id, embedding, document, cmetadata)
+                    SELECT id, collection_id, embedding, document, cmetadata FROM "{table_name}_staging"
+                    ON CONFLICT (id) DO UPDATE SET
+                        embedding = EXCLUDED.embedding,
+                        document = EXCLUDED.document,
+                        cmetadata = EXCLUDED.cmetadata;
+                """)
+            session.commit()
+
+        logger.info(f"Bulk copied {len(ids_)} embeddings into {table_name}.")
+        return ids_
@@ -0,0 +1,218 @@
+import hashlib
+import logging
+import os
+import random
+import threading
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from psycopg2.extras import execute_values
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_TABLE = "embedding_cache"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+# Share of ingestion runs that evict old cache entries; eviction scans the cache, so it is not run every time
+EMBEDDING_CACHE_EVICT_PROBABILITY = float(os.environ.get("EMBEDDING_CACHE_EVICT_PROBABILITY", "0.05"))
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text before hashing so that whitespace-only differences share a cache entry.
+    """
+    return " ".join(text.split())
+
+
+def content_hash(text: str) -> str:
+    """
+    Return the sha256 hex digest of the normalized text.
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class PostgresCachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that consults a content-addressed Postgres table before calling
+    the underlying embeddings model.
+
+    Entries are keyed by (model_id, sha256 of normalized text), where the model id includes the
+    output dimension for models embedding at a reduced dimension, so unchanged text is never
+    re-embedded when a category or comparison document is ingested again. Cache failures
+    are logged and fall back to the underlying model so ingestion never depends on the cache.
+    """
+
+    def __init__(
+        self,
+        underlying_embeddings: Embeddings,
+        model_id: str,
+        connection,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+        dimensions: Optional[int] = None
+    ):
+        """
+        Args:
+            underlying_embeddings (Embeddings): The embeddings instance used on cache misses.
+            model_id (str): The embedding model ID; part of the cache key.
+            connection: An open psycopg2 connection to the database holding the cache table.
+            max_entries (int, optional): Number of entries kept by `evict`, least recently used first out.
+            dimensions (int, optional): The output dimension requested from the model, if reduced.
+        """
+        self.underlying_embeddings = underlying_embeddings
+        self.model_id = model_id
+        self.dimensions = dimensions
+        self.cache_key = f"{model_id}/{dimensions}" if dimensions else model_id
+        self.connection = connection
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._thread_counts = threading.local()
+
+    def _lookup(self, hashes: List[str]) -> Dict[str, List[float]]:
+        """
+        Fetch cached vectors for the given hashes in one query and refresh their last used time.
+        """
+        with self._lock:
+            cur = self.connection.cursor()
+            try:
+                cur.execute(f"""
+                    UPDATE "{EMBEDDING_CACHE_TABLE}"
+                    SET last_used = now()
+                    WHERE model_id = %s AND content_hash = ANY(%s)
+                    RETURNING content_hash, embedding;
+                """, (self.cache_key, hashes))
+                rows = cur.fetchall()
+                self.connection.commit()
+                return {row[0]: row[1] for row in rows}
+            except Exception as e:
+                self.connection.rollback()
+                logger.error(f"Error reading embedding cache, embedding without it: {e}")
+                return {}
+            finally:
+                cur.close()
+
+    def _store(self, entries: Dict[str, List[float]]) -> None:
+        """
+        Insert newly computed vectors in one statement.
+        """
+        with self._lock:
+            cur = self.connection.cursor()
+            try:
+                execute_values(
+                    cur,
+                    f"""
+                    INSERT INTO "{EMBEDDING_CACHE_TABLE}" (model_id, content_hash, embedding)
+                    VALUES %s
+                    ON CONFLICT (model_id, content_hash) DO UPDATE SET last_used = now();
+                    """,
+                    [(self.cache_key, text_hash, vector) for text_hash, vector in entries.items()]
+                )
+                self.connection.commit()
+            except Exception as e:
+                self.connection.rollback()
+                logger.error(f"Error writing embedding cache: {e}")
+            finally:
+                cur.close()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of texts, only calling the underlying model for texts missing from the cache.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One vector per input text, in input order.
+        """
+        if not texts:
+            return []
+
+        hashes = [content_hash(text) for text in texts]
+        cached = self._lookup(list(set(hashes)))
+
+        # Embed each missing text only once, even if it appears several times in the batch
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+
+        if missing:
+            vectors = self.underlying_embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            cached.update(computed)
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        self._thread_counts.misses = self.thread_misses + len(missing)
+
+        return [list(cached[text_hash]) for text_hash in hashes]
+
+    @property
+    def thread_misses(self) -> int:
+        """
+        Number of texts the calling thread has sent to the underlying model.
+
+        Unlike `misses`, this is not affected by other threads sharing the instance, so it can
+        attribute model calls to the document being ingested by the current thread.
+        """
+        return getattr(self._thread_counts, "misses", 0)
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query. Queries are not cached because some models embed them differently from documents.
+        """
+        return self.underlying_embeddings.embed_query(text)
+
+    def maybe_evict(self, probability: float = EMBEDDING_CACHE_EVICT_PROBABILITY) -> int:
+        """
+        Run `evict` with the given probability, so frequent ingestion runs share its cost.
+
+        Returns:
+            int: The number of entries deleted.
+        """
+        if random.random() >= probability:
+            return 0
+        return self.evict()
+
+    def evict(self) -> int:
+        """
+        Delete the least recently used entries beyond `max_entries`.
+
+        Returns:
+            int: The number of entries deleted.
+        """
+        with self._lock:
+            cur = self.connection.cursor()
+            try:
+                # The planner's row estimate avoids walking the index while the cache is below its size
+                cur.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s);",
+                    (EMBEDDING_CACHE_TABLE,)
+                )
+                row = cur.fetchone()
+                if row and row[0] is not None and 0 <= row[0] <= self.max_entries:
+                    self.connection.commit()
+                    return 0
+
+                cur.execute(f"""
+                    DELETE FROM "{EMBEDDING_CACHE_TABLE}"
+                    WHERE ctid IN (
+                        SELECT ctid FROM "{EMBEDDING_CACHE_TABLE}"
+                        ORDER BY last_used DESC
+                        OFFSET %s
+                    );
+                """, (self.max_entries,))
+                deleted = cur.rowcount
+                self.connection.commit()
+                if deleted:
+                    logger.info(f"Evicted {deleted} least recently used embedding cache entries.")
+                return deleted
+            except Exception as e:
+                self.connection.rollback()
+                logger.error(f"Error evicting embedding cache entries: {e}")
+                return 0
+            finally:
+                cur.close()
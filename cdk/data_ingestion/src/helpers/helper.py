@@ -1,12 +1,26 @@
+import copy
 import logging
+import threading
 import boto3
 from typing import Dict, Optional, Tuple
 import psycopg2
 from langchain_aws import BedrockEmbeddings
 from langchain_postgres import PGVector
 from langchain.indexes import SQLRecordManager
+from sqlalchemy import text
 
-from processing.documents import process_documents
+from helpers.bulk_writer import BulkCopyPGVector
+from helpers.quantization import ensure_quantized_index
+from processing.checkpoint import IngestionCheckpoint
+from processing.deduplication import ChunkDeduplicator
+from processing.documents import (
+    deduplicate_category,
+    index_document,
+    process_documents,
+)
+from processing.chunking import get_chunking_strategy
+from processing.page_hashes import PageHashStore
+from processing.stats import IngestionStatsStore
 
 s3 = boto3.client('s3')
 
@@ -14,6 +28,15 @@ s3 = boto3.client('s3')
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SOURCE_INDEX = "langchain_pg_embedding_source_idx"
+# Set once the source index is known to exist, so later collections skip the check
+source_index_checked = False
+# Vectorstores and record managers by (collection name, connection string). Each holds its own
+# SQLAlchemy engine, so they are kept for the life of the container instead of being created
+# for every job and leaving their connection pools open behind RDS Proxy
+collections = {}
+collections_lock = threading.Lock()
+
 
 def get_vectorstore(
     collection_name: str, 
@@ -22,11 +45,14 @@ def get_vectorstore(
     user: str, 
     password: str, 
     host: str, 
-    port: int
+    port: int,
+    collection_metadata: Optional[dict] = None
 ) -> Optional[Tuple[PGVector, str]]:
     """
     Initialize and return a PGVector instance along with its connection string.
 
+    The instance writes large batches with a binary COPY (see `BulkCopyPGVector`).
+
     Args:
         collection_name (str): The name of the PGVector collection.
         embeddings (BedrockEmbeddings): An instance that provides vector embeddings.
@@ -35,6 +61,7 @@ def get_vectorstore(
         password (str): The database password.
         host (str): The database host address.
         port (int): The database port number.
+        collection_metadata (dict, optional): Metadata stored with the collection when it is created.
 
     Returns:
         Optional[Tuple[PGVector, str]]: 
@@ -49,11 +76,12 @@ def get_vectorstore(
         )
 
         logger.info("Initializing the VectorStore...")
-        vectorstore = PGVector(
+        vectorstore = BulkCopyPGVector(
             embeddings=embeddings,
             collection_name=collection_name,
             connection=connection_string,
-            use_jsonb=True
+            use_jsonb=True,
+            collection_metadata=collection_metadata
         )
 
         logger.info("VectorStore initialized successfully.")
@@ -64,11 +92,120 @@ def get_vectorstore(
         return None
 
 
+def ensure_source_index(record_manager: SQLRecordManager) -> None:
+    """
+    Create the expression index on the `source` metadata of stored chunks if it does not exist.
+
+    Deleting a document or category removes its chunks by `source` (exact match or category
+    prefix), so the index uses text_pattern_ops to serve both equality and LIKE 'prefix%' lookups.
+
+    CREATE INDEX IF NOT EXISTS takes a lock that blocks writes to the embedding table before it
+    checks whether the index exists, so the index is looked up first and only created when missing.
+
+    Args:
+        record_manager (SQLRecordManager): Record manager connected to the vectorstore database.
+    """
+    global source_index_checked
+    if source_index_checked:
+        return
+
+    with record_manager.engine.begin() as conn:
+        if conn.execute(text("SELECT to_regclass(:name);"), {"name": SOURCE_INDEX}).scalar() is None:
+            conn.execute(text(f"""
+                CREATE INDEX IF NOT EXISTS {SOURCE_INDEX}
+                ON langchain_pg_embedding ((cmetadata->>'source') text_pattern_ops);
+            """))
+            logger.info("Source metadata index created.")
+    source_index_checked = True
+
+
+def open_collection(
+    vectorstore_config_dict: Dict[str, str],
+    embeddings: BedrockEmbeddings,
+    index_type: Optional[str] = None
+) -> Optional[Tuple[PGVector, SQLRecordManager]]:
+    """
+    Initialize the vectorstore and record manager of a collection, creating their schema if needed.
+
+    They are created once per container and collection. Each call gets a shallow copy of the
+    vectorstore that embeds with `embeddings` and shares the cached instance's engine.
+
+    Args:
+        vectorstore_config_dict (Dict[str, str]): Configuration for the vectorstore, as for `store_category_data`.
+        embeddings (BedrockEmbeddings): The embeddings instance for vectorizing documents.
+        index_type (str, optional): Quantized index of the collection, recorded when it is created.
+
+    Returns:
+        Optional[Tuple[PGVector, SQLRecordManager]]: The vectorstore and record manager, or None
+            if the vectorstore could not be initialized.
+    """
+    connection_string = (
+        f"postgresql+psycopg://{vectorstore_config_dict['user']}:{vectorstore_config_dict['password']}"
+        f"@{vectorstore_config_dict['host']}:{vectorstore_config_dict['port']}/{vectorstore_config_dict['dbname']}"
+    )
+    cache_key = (vectorstore_config_dict['collection_name'], connection_string)
+    with collections_lock:
+        if cache_key not in collections:
+            collection = _create_collection(vectorstore_config_dict, embeddings, index_type)
+            if not collection:
+                return None
+            collections[cache_key] = collection
+        cached_vectorstore, record_manager = collections[cache_key]
+
+    vectorstore = copy.copy(cached_vectorstore)
+    vectorstore.embedding_function = embeddings
+    return vectorstore, record_manager
+
+
+def _create_collection(
+    vectorstore_config_dict: Dict[str, str],
+    embeddings: BedrockEmbeddings,
+    index_type: Optional[str] = None
+) -> Optional[Tuple[PGVector, SQLRecordManager]]:
+    """
+    Create the vectorstore and record manager of a collection, see `open_collection`.
+    """
+    vectorstore_and_conn = get_vectorstore(
+        collection_name=vectorstore_config_dict['collection_name'],
+        embeddings=embeddings,
+        dbname=vectorstore_config_dict['dbname'],
+        user=vectorstore_config_dict['user'],
+        password=vectorstore_config_dict['password'],
+        host=vectorstore_config_dict['host'],
+        port=int(vectorstore_config_dict['port']),
+        # Lets readers of the collection embed and search queries the way its documents were embedded
+        collection_metadata={
+            "embedding_model_id": getattr(embeddings, "model_id", None),
+            "embedding_dimensions": getattr(embeddings, "dimensions", None),
+            "index_type": index_type or "none",
+        }
+    )
+
+    if not vectorstore_and_conn:
+        logger.error("VectorStore could not be initialized. Exiting.")
+        return None
+
+    vectorstore, connection_string = vectorstore_and_conn
+
+    # Create and configure the record manager
+    namespace = f"pgvector/{vectorstore_config_dict['collection_name']}"
+    record_manager = SQLRecordManager(namespace, db_url=connection_string)
+    record_manager.create_schema()
+    logger.info("RecordManager schema ensured/created.")
+
+    ensure_source_index(record_manager)
+    return vectorstore, record_manager
+
+
 def store_category_data(
     bucket: str,
     category_id: str,
     vectorstore_config_dict: Dict[str, str], 
-    embeddings: BedrockEmbeddings
+    embeddings: BedrockEmbeddings,
+    chunking_strategy: Optional[str] = None,
+    page_hash_store: Optional[PageHashStore] = None,
+    checkpoint: Optional[IngestionCheckpoint] = None,
+    index_type: Optional[str] = None
 ) -> None:
     """
     Store data from an S3 bucket into a PGVector-backed vector store.
@@ -91,31 +228,19 @@ def store_category_data(
                 - 'host': Database host.
                 - 'port': Database port number.
         embeddings (BedrockEmbeddings): The embeddings instance for vectorizing documents.
+        chunking_strategy (str, optional): Name of the chunking strategy used to split documents.
+        page_hash_store (PageHashStore, optional): Store of per-page hashes used to skip unchanged pages.
+        checkpoint (IngestionCheckpoint, optional): Checkpoint of a resumable run, such as a rebuild.
+        index_type (str, optional): Quantized index of the collection ("none", "halfvec" or "binary").
+            Recorded with the collection when it is created, so readers search it the same way.
 
     Returns:
         None
     """
-    vectorstore_and_conn = get_vectorstore(
-        collection_name=vectorstore_config_dict['collection_name'],
-        embeddings=embeddings,
-        dbname=vectorstore_config_dict['dbname'],
-        user=vectorstore_config_dict['user'],
-        password=vectorstore_config_dict['password'],
-        host=vectorstore_config_dict['host'],
-        port=int(vectorstore_config_dict['port'])
-    )
-
-    if not vectorstore_and_conn:
-        logger.error("VectorStore could not be initialized. Exiting.")
+    collection = open_collection(vectorstore_config_dict, embeddings, index_type)
+    if not collection:
         return
-
-    vectorstore, connection_string = vectorstore_and_conn
-
-    # Create and configure the record manager
-    namespace = f"pgvector/{vectorstore_config_dict['collection_name']}"
-    record_manager = SQLRecordManager(namespace, db_url=connection_string)
-    record_manager.create_schema()
-    logger.info("RecordManager schema ensured/created.")
+    vectorstore, record_manager = collection
 
     # Process and ingest documents
     process_documents(
@@ -123,6 +248,110 @@ def store_category_data(
         category_id=category_id,
         vectorstore=vectorstore,
         embeddings=embeddings,
-        record_manager=record_manager
+        record_manager=record_manager,
+        chunking_strategy=chunking_strategy,
+        page_hash_store=page_hash_store,
+        checkpoint=checkpoint
     )
     logger.info("Documents processed and stored successfully.")
+
+    ensure_quantized_index(vectorstore, index_type, getattr(embeddings, "dimensions", None))
+
+
+def restore_duplicate_chunks(
+    source_prefix: str,
+    vectorstore_config_dict: Dict[str, str],
+    embeddings: BedrockEmbeddings
+) -> int:
+    """
+    Add near-duplicate chunks back to a collection when the chunk kept in their place was removed.
+
+    Called after a document's chunks are deleted, so passages that other documents of the
+    category share with it remain searchable without reindexing the category.
+
+    Args:
+        source_prefix (str): Prefix of the `source` metadata of the duplicates, e.g. a category.
+        vectorstore_config_dict (Dict[str, str]): Configuration for the vectorstore, as for `store_category_data`.
+        embeddings (BedrockEmbeddings): The embeddings instance of the collection.
+
+    Returns:
+        int: The number of chunks added back.
+    """
+    collection = open_collection(vectorstore_config_dict, embeddings)
+    if not collection:
+        return 0
+    vectorstore, record_manager = collection
+
+    deduplicator = ChunkDeduplicator(vectorstore, record_manager)
+    return deduplicator.restore_orphans(source_prefix)
+
+
+def store_document_data(
+    bucket: str,
+    document_key: str,
+    vectorstore_config_dict: Dict[str, str],
+    embeddings: BedrockEmbeddings,
+    chunking_strategy: Optional[str] = None,
+    index_type: Optional[str] = None
+) -> None:
+    """
+    Index a single document into a PGVector-backed vector store.
+
+    Used by ingestion workers, which index the changed documents of a category in parallel.
+    The category's cleanup runs separately in `finalize_category_data` once every document
+    of the batch is indexed.
+
+    Args:
+        bucket (str): Name of the S3 bucket containing the document.
+        document_key (str): The document's key, `<category_id>/<document_name>.<document_type>`.
+        vectorstore_config_dict (Dict[str, str]): Configuration for the vectorstore, as for `store_category_data`.
+        embeddings (BedrockEmbeddings): The embeddings instance for vectorizing documents.
+        chunking_strategy (str, optional): Name of the chunking strategy used to split documents.
+        index_type (str, optional): Quantized index of the collection ("none", "halfvec" or "binary").
+    """
+    collection = open_collection(vectorstore_config_dict, embeddings, index_type)
+    if not collection:
+        raise RuntimeError(f"VectorStore {vectorstore_config_dict['collection_name']} could not be initialized.")
+    vectorstore, record_manager = collection
+
+    page_hash_store = PageHashStore(record_manager.engine)
+    stats_store = IngestionStatsStore(record_manager.engine)
+
+    text_splitter = get_chunking_strategy(chunking_strategy, embeddings)
+    index_document(
+        bucket=bucket,
+        document_key=document_key,
+        vectorstore=vectorstore,
+        embeddings=embeddings,
+        record_manager=record_manager,
+        text_splitter=text_splitter,
+        page_hash_store=page_hash_store,
+        stats_store=stats_store
+    )
+
+
+def finalize_category_data(
+    category_id: str,
+    vectorstore_config_dict: Dict[str, str],
+    embeddings: BedrockEmbeddings,
+    index_type: Optional[str] = None
+) -> None:
+    """
+    Run the cleanup of a category after its documents were indexed by ingestion workers.
+
+    Collapses near-duplicate chunks and creates the collection's quantized index if it is missing.
+    The bucket is not listed: chunks of removed documents are deleted by their deletion event.
+
+    Args:
+        category_id (str): Identifier for the document category in the S3 bucket.
+        vectorstore_config_dict (Dict[str, str]): Configuration for the vectorstore, as for `store_category_data`.
+        embeddings (BedrockEmbeddings): The embeddings instance of the collection.
+        index_type (str, optional): Quantized index of the collection ("none", "halfvec" or "binary").
+    """
+    collection = open_collection(vectorstore_config_dict, embeddings, index_type)
+    if not collection:
+        raise RuntimeError(f"VectorStore {vectorstore_config_dict['collection_name']} could not be initialized.")
+    vectorstore, record_manager = collection
+
+    deduplicate_category(vectorstore, record_manager, category_id)
+    ensure_quantized_index(vectorstore, index_type, getattr(embeddings, "dimensions", None))
@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, Optional
 
 from helpers.helper import store_category_data
 
@@ -6,7 +6,9 @@ def update_vectorstore(
     bucket: str,
     category_id: str,
     vectorstore_config_dict: Dict[str, str],
-    embeddings#: BedrockEmbeddings
+    embeddings,#: BedrockEmbeddings
+    chunking_strategy: Optional[str] = None,
+    index_type: Optional[str] = None
 ) -> None:
     """
     Update the vectorstore with embeddings for all documents in the S3 bucket.
@@ -16,10 +18,14 @@ def update_vectorstore(
         category_id (str): The name of the folder within the S3 bucket.
         vectorstore_config_dict (Dict[str, str]): The configuration dictionary for the vectorstore, including parameters like collection name, database name, user, password, host, and port.
         embeddings (BedrockEmbeddings): The embeddings instance used to process the documents.
+        chunking_strategy (str, optional): Name of the chunking strategy used to split documents.
+        index_type (str, optional): Quantized index of the collection ("none", "halfvec" or "binary").
     """
     store_category_data(
         bucket=bucket,
         category_id=category_id,
         vectorstore_config_dict=vectorstore_config_dict,
-        embeddings=embeddings
+        embeddings=embeddings,
+        chunking_strategy=chunking_strategy,
+        index_type=index_type
     )
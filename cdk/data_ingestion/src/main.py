@@ -2,11 +2,17 @@ import os
 import json
 import boto3
 import psycopg2
+from psycopg2.extras import execute_values
 from datetime import datetime, timezone
+from urllib.parse import unquote_plus
 import logging
 
 from helpers.vectorstore import update_vectorstore
+from helpers.helper import restore_duplicate_chunks
+from processing.batches import IngestionBatchStore
+from helpers.embedding_cache import PostgresCachedEmbeddings
 from langchain_aws import BedrockEmbeddings
+from sqlalchemy import create_engine
 
 
 # Set up basic logging
@@ -20,16 +26,27 @@ RDS_PROXY_ENDPOINT = os.environ["RDS_PROXY_ENDPOINT"]
 
 EMBEDDING_BUCKET_NAME = os.environ["EMBEDDING_BUCKET_NAME"]
 EMBEDDING_MODEL_PARAM = os.environ["EMBEDDING_MODEL_PARAM"]
+CHUNKING_STRATEGY_PARAM = os.environ.get("CHUNKING_STRATEGY_PARAM")
+EMBEDDING_COLLECTION_PARAM = os.environ.get("EMBEDDING_COLLECTION_PARAM")
+EMBEDDING_MIGRATION_PARAM = os.environ.get("EMBEDDING_MIGRATION_PARAM")
+# When set, changed documents are indexed by ingestion workers consuming this queue
+INGESTION_WORKER_QUEUE_URL = os.environ.get("INGESTION_WORKER_QUEUE_URL")
+DEFAULT_COLLECTION = "all"
+DOCUMENTS_KEY_INDEX = "documents_category_name_type_idx"
 
 # AWS Clients
 secrets_manager_client = boto3.client("secretsmanager")
 ssm_client = boto3.client("ssm")
+sqs_client = boto3.client("sqs")
 bedrock_runtime = boto3.client("bedrock-runtime", region_name=REGION)
 
 # Cached resources
 connection = None
 db_secret = None
+vectorstore_engine = None
+documents_key_checked = False
 EMBEDDING_MODEL_ID = None
+CHUNKING_STRATEGY = None
 
 
 def get_parameter():
@@ -46,7 +63,99 @@ def get_parameter():
             raise
     return EMBEDDING_MODEL_ID
 
+def get_chunking_strategy():
+    """
+    Fetch the chunking strategy name from Systems Manager Parameter Store.
+    The CHUNKING_STRATEGY environment variable takes precedence when set.
+    """
+    global CHUNKING_STRATEGY
+    if CHUNKING_STRATEGY is None:
+        CHUNKING_STRATEGY = os.environ.get("CHUNKING_STRATEGY")
+        if not CHUNKING_STRATEGY and CHUNKING_STRATEGY_PARAM:
+            try:
+                response = ssm_client.get_parameter(Name=CHUNKING_STRATEGY_PARAM, WithDecryption=True)
+                CHUNKING_STRATEGY = response["Parameter"]["Value"]
+            except Exception as e:
+                logger.error(f"Error fetching parameter {CHUNKING_STRATEGY_PARAM}: {e}")
+                raise
+    return CHUNKING_STRATEGY
+
+def get_collection_metadata(collection_name):
+    """
+    Return the metadata of a collection: the embedding model id, the embedding dimension and
+    the index type it was created with. Empty for missing collections and for collections
+    created before the metadata was recorded.
+    """
+    connection = connect_to_db()
+    try:
+        cur = connection.cursor()
+        cur.execute("SELECT to_regclass('langchain_pg_collection');")
+        if cur.fetchone()[0] is None:
+            row = None
+        else:
+            cur.execute("SELECT cmetadata FROM langchain_pg_collection WHERE name = %s;", (collection_name,))
+            row = cur.fetchone()
+        connection.commit()
+        cur.close()
+    except Exception as e:
+        if cur:
+            cur.close()
+        connection.rollback()
+        logger.error(f"Error fetching the metadata of collection {collection_name}: {e}")
+        raise
+    return (row[0] if row else None) or {}
 
+def get_collection_model_id(collection_name):
+    """
+    Return the embedding model id recorded in a collection's metadata, or None.
+    """
+    return get_collection_metadata(collection_name).get("embedding_model_id")
+
+def get_embedding_targets():
+    """
+    Return the collections that ingestion writes to, as dicts with the keys "collection",
+    "model_id", "dimensions" and "index_type".
+
+    The active collection is named by the EmbeddingCollection parameter and is embedded
+    with the model and dimension recorded in its metadata, falling back to the EmbeddingModelId
+    parameter at the model's full dimension. While an embedding model migration is in progress,
+    the EmbeddingMigration parameter holds {"collection": ..., "model_id": ...} (optionally with
+    "dimensions" and "index_type") and documents are also written to that collection,
+    so it stays current while it is backfilled. The parameters are read on every invocation
+    so that starting or finishing a migration takes effect without a redeploy.
+    """
+    names = [name for name in (EMBEDDING_MODEL_PARAM, EMBEDDING_COLLECTION_PARAM, EMBEDDING_MIGRATION_PARAM) if name]
+    try:
+        response = ssm_client.get_parameters(Names=names, WithDecryption=True)
+    except Exception as e:
+        logger.error(f"Error fetching parameters {names}: {e}")
+        raise
+    values = {parameter["Name"]: parameter["Value"] for parameter in response["Parameters"]}
+
+    collection_name = values.get(EMBEDDING_COLLECTION_PARAM) or DEFAULT_COLLECTION
+    collection_metadata = get_collection_metadata(collection_name)
+    targets = [{
+        "collection": collection_name,
+        "model_id": collection_metadata.get("embedding_model_id") or values[EMBEDDING_MODEL_PARAM],
+        "dimensions": collection_metadata.get("embedding_dimensions"),
+        "index_type": collection_metadata.get("index_type") or "none",
+    }]
+
+    migration = values.get(EMBEDDING_MIGRATION_PARAM, "none")
+    if migration and migration != "none":
+        try:
+            migration = json.loads(migration)
+            if migration["collection"] != collection_name:
+                targets.append({
+                    "collection": migration["collection"],
+                    "model_id": migration["model_id"],
+                    "dimensions": migration.get("dimensions"),
+                    "index_type": migration.get("index_type") or "none",
+                })
+        except (ValueError, KeyError) as e:
+            logger.error(f"Ignoring malformed {EMBEDDING_MIGRATION_PARAM} value {migration!r}: {e}")
+
+    return targets
 
 
 def get_secret():
@@ -83,6 +192,25 @@ def connect_to_db():
             raise
     return connection
 
+def create_vectorstore_engine():
+    """
+    Create a SQLAlchemy engine for the vectorstore database from the database secret.
+    """
+    secret = get_secret()
+    return create_engine(
+        f"postgresql+psycopg://{secret['username']}:{secret['password']}"
+        f"@{RDS_PROXY_ENDPOINT}:{secret['port']}/{secret['dbname']}"
+    )
+
+def get_vectorstore_engine():
+    """
+    Return the SQLAlchemy engine for the vectorstore database, reused across invocations.
+    """
+    global vectorstore_engine
+    if vectorstore_engine is None:
+        vectorstore_engine = create_vectorstore_engine()
+    return vectorstore_engine
+
 def parse_s3_file_path(document_key):
     # Assuming the file path is of the format: {category_id}/{document_name}.{document_type}
     try:
@@ -91,110 +219,311 @@ def parse_s3_file_path(document_key):
         return category_id, document_name, document_type
     except Exception as e:
         logger.error(f"Error parsing S3 document path: {e}")
-        return {
-                    "statusCode": 400,
-                    "body": json.dumps("Error parsing S3 document path.")
-                }
+        return None, None, None
+
+def documents_key_exists(cur):
+    """
+    Return whether the unique index on the documents' natural key exists.
+
+    The index is created by the initializer, which also removes duplicate rows first. Until it
+    has run, documents are registered one at a time without ON CONFLICT.
+    """
+    global documents_key_checked
+    if documents_key_checked:
+        return True
+
+    cur.execute("SELECT to_regclass(%s);", (DOCUMENTS_KEY_INDEX,))
+    if not cur.fetchone()[0]:
+        logger.warning(
+            f"Unique index {DOCUMENTS_KEY_INDEX} on documents is missing; "
+            "registering documents without an upsert until the initializer has run."
+        )
+        return False
+    documents_key_checked = True
+    return True
+
+def register_documents_without_key(cur, rows):
+    """
+    Register documents with a lookup followed by an UPDATE or INSERT, for databases that do
+    not have the unique index yet.
+
+    Returns:
+        list: (document_name, document_type, document_id) tuples.
+    """
+    registered = []
+    for category_id, document_s3_file_path, document_name, document_type, metadata, timestamp in rows:
+        cur.execute(
+            """
+            UPDATE "documents"
+            SET document_s3_file_path = %s, time_created = %s
+            WHERE category_id = %s AND document_name = %s AND document_type = %s
+            RETURNING document_id;
+            """,
+            (document_s3_file_path, timestamp, category_id, document_name, document_type)
+        )
+        existing = cur.fetchone()
+        if existing:
+            registered.append((document_name, document_type, existing[0]))
+            continue
+        cur.execute(
+            """
+            INSERT INTO "documents"
+            (category_id, document_s3_file_path, document_name, document_type, metadata, time_created)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING document_id;
+            """,
+            (category_id, document_s3_file_path, document_name, document_type, metadata, timestamp)
+        )
+        registered.append((document_name, document_type, cur.fetchone()[0]))
+    return registered
+
+def register_documents(category_id, documents):
+    """
+    Insert or update the catalog rows of uploaded documents, in one statement once the
+    initializer has created the unique index on their natural key.
+
+    Existing rows keep their id and metadata; only the S3 path and upload time are updated.
+
+    Args:
+        category_id (str): The category the documents were uploaded to.
+        documents (list): (document_name, document_type, document_s3_file_path) tuples.
+
+    Returns:
+        dict: (document_name, document_type) mapped to the document's id.
+    """
+    if not documents:
+        return {}
 
-def insert_file_into_db(category_id, document_name, document_type, document_s3_file_path):
     connection = connect_to_db()
-    if connection is None:
-        logger.error("No database connection available.")
-        return {
-            "statusCode": 500,
-            "body": json.dumps("Database connection failed.")
-        }
-    
+    cur = None
     try:
         cur = connection.cursor()
 
-        # Check if a record already exists
-        select_query = """
-        SELECT * FROM "documents"
-        WHERE category_id = %s
-        AND document_name = %s
-        AND document_type = %s;
-        """
-        cur.execute(select_query, (category_id, document_name, document_type))
-
-        existing_document = cur.fetchone()
-
-        if existing_document:
-            # Update the existing record
-            update_query = """
-                UPDATE "documents"
-                SET document_s3_file_path = %s,
-                time_created = %s
-                WHERE category_id = %s
-                AND document_name = %s
-                AND document_type = %s;
-            """
-            timestamp = datetime.now(timezone.utc)
-            cur.execute(update_query, (
-                document_s3_file_path,  # filepath
-                timestamp,  # time_uploaded
-                category_id,  # module_id
-                document_name,  # filename
-                document_type  # filetype
-            ))
-            logger.info(f"Successfully updated file {document_name}.{document_type} in database for module {category_id}.")
+        timestamp = datetime.now(timezone.utc)
+        # One row per key, since a statement cannot update the same row twice
+        rows = {
+            (document_name, document_type): (category_id, document_s3_file_path, document_name, document_type, "", timestamp)
+            for document_name, document_type, document_s3_file_path in documents
+        }
+        if not documents_key_exists(cur):
+            registered = register_documents_without_key(cur, rows.values())
         else:
-            # Insert a new record
-            insert_query = """
-                INSERT INTO "documents" 
+            registered = execute_values(
+                cur,
+                """
+                INSERT INTO "documents"
                 (category_id, document_s3_file_path, document_name, document_type, metadata, time_created)
-                VALUES (%s, %s, %s, %s, %s, %s);
-            """
-            timestamp = datetime.now(timezone.utc)
-            cur.execute(insert_query, (
-                category_id,  # module_id
-                document_s3_file_path,
-                document_name,  # filename
-                document_type, # filetype
-                "",
-                timestamp
-
-        ))
-        logger.info(f"Successfully inserted document {document_name}.{document_type} into database for module {category_id}.")
+                VALUES %s
+                ON CONFLICT (category_id, document_name, document_type) DO UPDATE SET
+                    document_s3_file_path = EXCLUDED.document_s3_file_path,
+                    time_created = EXCLUDED.time_created
+                RETURNING document_name, document_type, document_id;
+                """,
+                list(rows.values()),
+                fetch=True
+            )
 
         connection.commit()
         cur.close()
+        logger.info(f"Registered {len(registered)} documents in database for category {category_id}.")
+        return {(document_name, document_type): document_id for document_name, document_type, document_id in registered}
     except Exception as e:
         if cur:
             cur.close()
         connection.rollback()
-        logger.error(f"Error inserting document {document_name}.{document_type} into database: {e}")
+        logger.error(f"Error registering documents in database for category {category_id}: {e}")
         raise
 
-def update_vectorstore_from_s3(bucket, category_id):
-    
-    embeddings = BedrockEmbeddings(
-        model_id=get_parameter(), 
-        client=bedrock_runtime,
-        region_name=REGION
+def insert_file_into_db(category_id, document_name, document_type, document_s3_file_path):
+    """
+    Insert or update the catalog row of one uploaded document.
+
+    Returns:
+        str: The document's id.
+    """
+    registered = register_documents(category_id, [(document_name, document_type, document_s3_file_path)])
+    return registered[(document_name, document_type)]
+
+def delete_document_embeddings(category_id, document_name, document_type):
+    """
+    Delete a removed document's chunks and record manager entries by their `source`,
+    instead of reindexing the whole category.
+    """
+    connection = connect_to_db()
+    source = f"s3://{EMBEDDING_BUCKET_NAME}/{category_id}/{document_name}.{document_type}"
+
+    try:
+        cur = connection.cursor()
+
+        # The vector tables are created by the first ingestion run
+        cur.execute(
+            "SELECT to_regclass('langchain_pg_embedding'), to_regclass('upsertion_record'), "
+            "to_regclass('document_page_hashes'), to_regclass('chunk_duplicates'), "
+            "to_regclass('chunk_fingerprints');"
+        )
+        embedding_table, record_table, page_hash_table, duplicate_table, fingerprint_table = cur.fetchone()
+
+        deleted = 0
+        if embedding_table:
+            cur.execute("DELETE FROM langchain_pg_embedding WHERE cmetadata->>'source' = %s;", (source,))
+            deleted = cur.rowcount
+        if record_table:
+            cur.execute("DELETE FROM upsertion_record WHERE group_id = %s;", (source,))
+        if page_hash_table:
+            cur.execute("DELETE FROM document_page_hashes WHERE source = %s;", (source,))
+        if duplicate_table:
+            cur.execute("DELETE FROM chunk_duplicates WHERE source = %s;", (source,))
+        if fingerprint_table:
+            cur.execute("DELETE FROM chunk_fingerprints WHERE source = %s;", (source,))
+
+        connection.commit()
+        cur.close()
+        logger.info(f"Deleted {deleted} embeddings for {source}.")
+    except Exception as e:
+        if cur:
+            cur.close()
+        connection.rollback()
+        logger.error(f"Error deleting embeddings for {source}: {e}")
+        raise
+
+def get_cached_embeddings(model_id=None, dimensions=None):
+    """
+    Build the Bedrock embeddings instance wrapped in the Postgres embedding cache,
+    so text that was embedded by a previous ingestion run is not sent to Bedrock again.
+    Defaults to the model in the EmbeddingModelId parameter at its full dimension;
+    `dimensions` requests a reduced output dimension from models that support it.
+    """
+    model_id = model_id or get_parameter()
+    embeddings = PostgresCachedEmbeddings(
+        underlying_embeddings=BedrockEmbeddings(
+            model_id=model_id,
+            client=bedrock_runtime,
+            region_name=REGION,
+            model_kwargs={"dimensions": dimensions} if dimensions else None
+        ),
+        model_id=model_id,
+        connection=connect_to_db(),
+        dimensions=dimensions
     )
+    return embeddings
+
+def update_vectorstore_from_s3(bucket, category_id):
     
     secret  = get_secret()
 
-    vectorstore_config_dict = {
-        'collection_name': "all",
-        'dbname': secret["dbname"],
-        'user': secret["username"],
-        'password': secret["password"],
-        'host': RDS_PROXY_ENDPOINT,
-        'port': secret["port"]
-    }
+    # During an embedding model migration the category is written to both collections
+    for target in get_embedding_targets():
+        collection_name, model_id = target["collection"], target["model_id"]
+        embeddings = get_cached_embeddings(model_id, target["dimensions"])
+
+        vectorstore_config_dict = {
+            'collection_name': collection_name,
+            'dbname': secret["dbname"],
+            'user': secret["username"],
+            'password': secret["password"],
+            'host': RDS_PROXY_ENDPOINT,
+            'port': secret["port"]
+        }
 
-    try:
-        update_vectorstore(
-            bucket=bucket,
-            category_id=category_id,
+        try:
+            update_vectorstore(
+                bucket=bucket,
+                category_id=category_id,
+                vectorstore_config_dict=vectorstore_config_dict,
+                embeddings=embeddings,
+                chunking_strategy=get_chunking_strategy(),
+                index_type=target["index_type"]
+            )
+            logger.info(
+                f"Collection {collection_name} ({model_id}) embedding cache hits: {embeddings.hits}, "
+                f"misses: {embeddings.misses}."
+            )
+            embeddings.maybe_evict()
+        except Exception as e:
+            logger.error(f"Error updating vectorstore {collection_name} for course {category_id}: {e}")
+            raise
+
+def enqueue_document_jobs(bucket, category_id, document_keys):
+    """
+    Create an ingestion batch for the changed documents of a category and enqueue one job per document.
+
+    Ingestion workers index the documents in parallel, and the worker that finishes the last
+    job runs the category's cleanup (see worker.py).
+    """
+    batch_store = IngestionBatchStore(get_vectorstore_engine())
+    batch_id = batch_store.create_batch(category_id, bucket, document_keys)
+
+    messages = [
+        {
+            "Id": str(i),
+            "MessageBody": json.dumps({
+                "batchId": batch_id,
+                "bucketName": bucket,
+                "categoryId": category_id,
+                "filePath": document_key
+            })
+        }
+        for i, document_key in enumerate(sorted(set(document_keys)))
+    ]
+    # SendMessageBatch accepts at most 10 messages
+    for i in range(0, len(messages), 10):
+        response = sqs_client.send_message_batch(QueueUrl=INGESTION_WORKER_QUEUE_URL, Entries=messages[i:i + 10])
+        if response.get("Failed"):
+            raise RuntimeError(f"Failed to enqueue {len(response['Failed'])} ingestion jobs for batch {batch_id}.")
+
+    logger.info(f"Enqueued {len(messages)} ingestion jobs for category {category_id} in batch {batch_id}.")
+    return batch_id
+
+def restore_duplicates_from_s3(category_id):
+    """
+    Add back the near-duplicate chunks of a category whose kept chunk belonged to a removed document.
+    """
+    secret = get_secret()
+
+    for target in get_embedding_targets():
+        collection_name = target["collection"]
+        embeddings = get_cached_embeddings(target["model_id"], target["dimensions"])
+        vectorstore_config_dict = {
+            'collection_name': collection_name,
+            'dbname': secret["dbname"],
+            'user': secret["username"],
+            'password': secret["password"],
+            'host': RDS_PROXY_ENDPOINT,
+            'port': secret["port"]
+        }
+
+        restored = restore_duplicate_chunks(
+            source_prefix=f"s3://{EMBEDDING_BUCKET_NAME}/{category_id}/",
             vectorstore_config_dict=vectorstore_config_dict,
             embeddings=embeddings
         )
-    except Exception as e:
-        logger.error(f"Error updating vectorstore for course {category_id}: {e}")
-        raise
+        logger.info(f"Restored {restored} duplicate chunks in collection {collection_name} for category {category_id}.")
+
+def parse_record(record):
+    """
+    Extract the S3 event details from a record.
+
+    Records normally arrive as SQS messages whose body is the forwarded S3 event,
+    but raw S3 notification records are accepted as well.
+
+    Returns:
+        tuple: (item_identifier, event_name, bucket_name, document_key)
+    """
+    if 'body' in record:
+        message_body = json.loads(record['body'])
+        return (
+            record.get('messageId'),
+            message_body.get('eventName', ''),
+            message_body.get('bucketName'),
+            message_body.get('filePath')
+        )
+
+    return (
+        None,
+        record.get('eventName', ''),
+        record['s3']['bucket']['name'],
+        unquote_plus(record['s3']['object']['key'])
+    )
 
 def handler(event, context):
     records = event.get('Records', [])
@@ -204,64 +533,110 @@ def handler(event, context):
             "body": json.dumps("No valid S3 event found.")
         }
 
-    for record in records:
-        event_name = record['eventName']
-        bucket_name = record['s3']['bucket']['name']
-
-        # Only process files from the DSA_DATA_INGESTION_BUCKET
-        if bucket_name != DSA_DATA_INGESTION_BUCKET:
-            
-            continue  # Ignore this event and move to the next one
-        document_key = record['s3']['object']['key']
-
+    # S3 events arrive through a FIFO queue grouped by category, so a burst of
+    # uploads to one category is delivered together. Collect the affected
+    # categories first and reindex each of them once for the whole batch.
+    categories_to_update = {}
+    # Categories with removed documents, and the positions of their removal records; near-duplicate
+    # chunks are restored once per category after the loop rather than once per removed file
+    categories_to_restore = {}
+    # Positions of the failed records; a FIFO message group stops at its first failure so that
+    # later events of the group are never applied before a retried earlier one
+    failed_positions = set()
+    failed_groups = set()
+    groups = [record.get('attributes', {}).get('MessageGroupId') for record in records]
+
+    def fail_from(position):
+        """
+        Mark a record and every later record of its message group as failed.
+        """
+        failed_positions.add(position)
+        group_id = groups[position]
+        if group_id is not None:
+            failed_groups.add(group_id)
+            failed_positions.update(
+                later for later in range(position + 1, len(records)) if groups[later] == group_id
+            )
+
+    for position, record in enumerate(records):
+        if groups[position] in failed_groups:
+            continue
+        item_identifier = None
+        try:
+            item_identifier, event_name, bucket_name, document_key = parse_record(record)
+
+            # Only process files from the DSA_DATA_INGESTION_BUCKET
+            if bucket_name != DSA_DATA_INGESTION_BUCKET or not document_key:
+                continue  # Ignore this event and move to the next one
+
+            # Parse the file path
+            category_id, document_name, document_type = parse_s3_file_path(document_key)
+            if not category_id or not document_name or not document_type:
+                # A malformed key will never succeed, so it is not reported for retry
+                logger.error(f"Skipping record with unparseable S3 file path: {document_key}")
+                continue
+
+            if event_name.startswith('ObjectRemoved:'):
+                # Removed documents only need their own chunks deleted, which never re-embeds anything
+                logger.info(f"File {document_name}.{document_type} is being deleted. Deleting files from database does not occur here.")
+                delete_document_embeddings(category_id, document_name, document_type)
+                categories_to_restore.setdefault(category_id, []).append(position)
+                continue
+
+            bucket_name, positions, document_keys, uploads = categories_to_update.setdefault(
+                category_id, (bucket_name, [], set(), [])
+            )
+            positions.append(position)
+            document_keys.add(document_key)
+            if event_name.startswith('ObjectCreated:'):
+                uploads.append((document_name, document_type, document_key))
+        except Exception as e:
+            logger.error(f"Error processing record {item_identifier}: {e}")
+            fail_from(position)
 
-        # Parse the file path
-        category_id, document_name, document_type = parse_s3_file_path(document_key)
-        if not category_id or not document_name or not document_type:
-            return {
-                    "statusCode": 400,
-                    "body": json.dumps("Error parsing S3 file path.")
-            }
+    # Passages a removed document shared with others were stored once, possibly as its chunks
+    for category_id, positions in categories_to_restore.items():
+        try:
+            restore_duplicates_from_s3(category_id)
+        except Exception as e:
+            logger.error(f"Error restoring duplicate chunks for category {category_id}: {e}")
+            for position in positions:
+                fail_from(position)
 
-        if event_name.startswith('ObjectCreated:'):
-            # Insert the file into the PostgreSQL database
-            try:
-                insert_file_into_db(
-                    category_id=category_id,
-                    document_name=document_name,
-                    document_type=document_type,
-                    document_s3_file_path=document_key
-                )
-                logger.info(f"File {document_name}.{document_type} inserted successfully.")
-            except Exception as e:
-                logger.error(f"Error inserting file {document_name}.{document_type} into database: {e}")
-                return {
-                    "statusCode": 500,
-                    "body": json.dumps(f"Error inserting file {document_name}.{document_type}: {e}")
-                }
-            
-        else:
-            logger.info(f"File {document_name}.{document_type} is being deleted. Deleting files from database does not occur here.")
-        # Update embeddings for course after the file is successfully inserted into the database
+    # Register each category's uploads in the database with one statement, then update its embeddings once
+    updated_categories = []
+    for category_id, (bucket_name, positions, document_keys, uploads) in categories_to_update.items():
         try:
+            register_documents(category_id, uploads)
+            if INGESTION_WORKER_QUEUE_URL:
+                # Documents are indexed in parallel by workers, so the batch only waits for the queue
+                enqueue_document_jobs(bucket_name, category_id, document_keys)
+            else:
                 update_vectorstore_from_s3(bucket_name, category_id)
-                logger.info(f"Vectorstore updated successfully for course {category_id}.")
+                logger.info(f"Vectorstore updated successfully for category {category_id}.")
+            updated_categories.append(category_id)
         except Exception as e:
-                logger.error(f"Error updating vectorstore for course {category_id}: {e}")
-                return {
-                    "statusCode": 500,
-                    "body": json.dumps(f"Document inserted, but error updating vectorstore: {e}")
-                }
-
-        return {
-                "statusCode": 200,
-                "body": json.dumps({
-                    "message": "New file inserted into database.",
-                    "location": f"s3://{bucket_name}/{document_key}"
-                })
-            }
+            # Every record that contributed to this category is retried together, with the
+            # records of its message group that followed them
+            logger.error(f"Error updating vectorstore for category {category_id}: {e}")
+            for position in positions:
+                fail_from(position)
+
+    failed_items = [
+        record.get('messageId') if 'body' in record else None
+        for position, record in enumerate(records)
+        if position in failed_positions
+    ]
+    if None in failed_items:
+        # Raw S3 invocations have no per-record identifiers, so fail the whole invocation to have it retried
+        raise RuntimeError(f"Failed to process {len(failed_items)} S3 event records.")
+
+    logger.info(
+        f"Processed {len(records)} records: {len(updated_categories)} categories updated, "
+        f"{len(failed_items)} records failed."
+    )
 
+    # Report partial failures so that only the failed messages are redelivered by SQS
     return {
-        "statusCode": 400,
-        "body": json.dumps("No new document upload or deletion event found.")
-    }
\ No newline at end of file
+        "batchItemFailures": [{"itemIdentifier": item} for item in failed_items]
+    }
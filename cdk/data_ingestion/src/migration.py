@@ -0,0 +1,323 @@
+"""
+Migrate the DLS vector collection to a new embedding model without a maintenance window.
+
+A migration moves through these commands:
+
+    python migration.py start --model-id amazon.titan-embed-text-v2:0 [--dimensions 256] [--index-type binary]
+        Records the target model and collection in the EmbeddingMigration parameter,
+        optionally with a reduced embedding dimension and a quantized index.
+        From then on every data ingestion run writes to both the live and the target
+        collection, while the live collection keeps serving queries.
+
+    python migration.py backfill --workers 4
+        Embeds every existing document into the target collection (see rebuild.py).
+        Interrupted backfills are resumed by passing the printed --run-id again.
+
+    python migration.py status
+        Shows, per category, how many of the documents in the live collection are
+        already in the target collection.
+
+    python migration.py cutover
+        Once every document is migrated, switches the EmbeddingCollection parameter to the
+        target collection, which flips text generation over, and makes the target model the
+        EmbeddingModelId used for comparison uploads.
+
+    python migration.py abort [--drop]
+        Stops dual writes and optionally deletes the target collection.
+
+    python migration.py drop --collection all
+        Deletes a previous collection that is no longer live.
+
+Each collection records the model it was embedded with in its metadata, and readers embed
+queries with that model, so the parameters can be changed one at a time safely.
+
+The script uses the same environment variables as the data ingestion Lambda function, and
+the caller needs ssm:PutParameter on the embedding parameters.
+"""
+import argparse
+import json
+import logging
+import re
+import sys
+from collections import defaultdict
+from typing import Dict, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+import rebuild
+from helpers.quantization import INDEX_TYPES
+from main import (
+    DEFAULT_COLLECTION,
+    EMBEDDING_BUCKET_NAME,
+    EMBEDDING_COLLECTION_PARAM,
+    EMBEDDING_MIGRATION_PARAM,
+    EMBEDDING_MODEL_PARAM,
+    get_collection_model_id,
+    get_parameter,
+    ssm_client,
+)
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def get_migration_state() -> Dict[str, str]:
+    """
+    Return the live collection, its model and the migration target, if any.
+    """
+    response = ssm_client.get_parameters(
+        Names=[EMBEDDING_COLLECTION_PARAM, EMBEDDING_MIGRATION_PARAM],
+        WithDecryption=True
+    )
+    values = {parameter["Name"]: parameter["Value"] for parameter in response["Parameters"]}
+    live_collection = values.get(EMBEDDING_COLLECTION_PARAM) or DEFAULT_COLLECTION
+    migration = values.get(EMBEDDING_MIGRATION_PARAM, "none")
+
+    state = {
+        "live_collection": live_collection,
+        "live_model_id": get_collection_model_id(live_collection) or get_parameter(),
+    }
+    if migration and migration != "none":
+        migration = json.loads(migration)
+        state["target_collection"] = migration["collection"]
+        state["target_model_id"] = migration["model_id"]
+        state["target_dimensions"] = migration.get("dimensions")
+        state["target_index_type"] = migration.get("index_type") or "none"
+    return state
+
+
+def put_parameter(name: str, value: str) -> None:
+    ssm_client.put_parameter(Name=name, Value=value, Type="String", Overwrite=True)
+    logger.info(f"Set {name} to {value}.")
+
+
+def set_collection_model_id(engine: Engine, collection_name: str, model_id: str) -> None:
+    """
+    Record the embedding model of a collection in its metadata if none is recorded yet.
+    """
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+                UPDATE langchain_pg_collection
+                SET cmetadata = CAST(
+                    COALESCE(CAST(cmetadata AS jsonb), '{}'::jsonb)
+                    || jsonb_build_object('embedding_model_id', CAST(:model_id AS text))
+                AS json)
+                WHERE name = :name
+                AND (cmetadata IS NULL OR cmetadata->>'embedding_model_id' IS NULL);
+            """),
+            {"name": collection_name, "model_id": model_id}
+        )
+
+
+def collection_sources(engine: Engine, collection_name: str) -> Set[str]:
+    """
+    Return the distinct document sources stored in a collection.
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("""
+                SELECT DISTINCT e.cmetadata->>'source'
+                FROM langchain_pg_embedding e
+                JOIN langchain_pg_collection c ON e.collection_id = c.uuid
+                WHERE c.name = :name;
+            """),
+            {"name": collection_name}
+        ).fetchall()
+    return {row[0] for row in rows if row[0]}
+
+
+def migration_progress(engine: Engine, live_collection: str, target_collection: str) -> Dict[str, tuple]:
+    """
+    Count, per category, the live documents and how many of them are in the target collection.
+
+    Returns:
+        Dict[str, tuple]: Category id mapped to (migrated documents, live documents).
+    """
+    prefix = f"s3://{EMBEDDING_BUCKET_NAME}/"
+    live_sources = collection_sources(engine, live_collection)
+    target_sources = collection_sources(engine, target_collection)
+
+    progress = defaultdict(lambda: [0, 0])
+    for source in live_sources:
+        category_id = source[len(prefix):].split("/", 1)[0]
+        progress[category_id][1] += 1
+        if source in target_sources:
+            progress[category_id][0] += 1
+    return {category_id: tuple(counts) for category_id, counts in progress.items()}
+
+
+def print_progress(progress: Dict[str, tuple]) -> float:
+    """
+    Print the per-category progress table and return the overall fraction migrated.
+    """
+    migrated_total = sum(migrated for migrated, _ in progress.values())
+    live_total = sum(total for _, total in progress.values())
+    print(f"{'category':<38} {'migrated':>9} {'documents':>10}")
+    for category_id, (migrated, total) in sorted(progress.items()):
+        print(f"{category_id:<38} {migrated:>9} {total:>10}")
+
+    fraction = migrated_total / live_total if live_total else 1.0
+    bar = "#" * int(fraction * 40)
+    print(f"\n[{bar:<40}] {fraction:.1%} ({migrated_total}/{live_total} documents)")
+    return fraction
+
+
+def default_collection_name(model_id: str, dimensions: int = None) -> str:
+    # e.g. amazon.titan-embed-text-v2:0 at 256 dimensions -> all_amazon_titan_embed_text_v2_0_256
+    suffix = f"{model_id}_{dimensions}" if dimensions else model_id
+    return f"{DEFAULT_COLLECTION}_{re.sub(r'[^a-z0-9]+', '_', suffix.lower()).strip('_')}"
+
+
+def start(args, engine: Engine) -> int:
+    state = get_migration_state()
+    if "target_collection" in state:
+        logger.error(f"A migration to {state['target_collection']} is already in progress.")
+        return 1
+
+    target_collection = args.collection or default_collection_name(args.model_id, args.dimensions)
+    if target_collection == state["live_collection"]:
+        logger.error(f"Collection '{target_collection}' is the live collection.")
+        return 1
+
+    # Pin the live collection's model before any parameter changes, so that readers keep
+    # embedding queries with it after EmbeddingModelId is switched at cutover
+    set_collection_model_id(engine, state["live_collection"], state["live_model_id"])
+    put_parameter(
+        EMBEDDING_MIGRATION_PARAM,
+        json.dumps({
+            "collection": target_collection,
+            "model_id": args.model_id,
+            "dimensions": args.dimensions,
+            "index_type": args.index_type,
+        })
+    )
+    print(f"Migrating '{state['live_collection']}' ({state['live_model_id']}) to '{target_collection}' ({args.model_id}).")
+    print("New uploads are now written to both collections. Run `migration.py backfill` next.")
+    return 0
+
+
+def backfill(args, engine: Engine) -> int:
+    state = get_migration_state()
+    if "target_collection" not in state:
+        logger.error("No migration is in progress.")
+        return 1
+
+    rebuild_args = [
+        "--all",
+        "--collection", state["target_collection"],
+        "--model-id", state["target_model_id"],
+        "--index-type", state["target_index_type"],
+        "--workers", str(args.workers),
+    ]
+    if state["target_dimensions"]:
+        rebuild_args += ["--dimensions", str(state["target_dimensions"])]
+    if args.run_id:
+        rebuild_args += ["--run-id", args.run_id]
+    return rebuild.main(rebuild_args)
+
+
+def status(args, engine: Engine) -> int:
+    state = get_migration_state()
+    print(f"Live collection: {state['live_collection']} ({state['live_model_id']})")
+    if "target_collection" not in state:
+        print("No migration is in progress.")
+        return 0
+
+    print(f"Target collection: {state['target_collection']} ({state['target_model_id']})\n")
+    print_progress(migration_progress(engine, state["live_collection"], state["target_collection"]))
+    return 0
+
+
+def cutover(args, engine: Engine) -> int:
+    state = get_migration_state()
+    if "target_collection" not in state:
+        logger.error("No migration is in progress.")
+        return 1
+
+    fraction = print_progress(migration_progress(engine, state["live_collection"], state["target_collection"]))
+    if fraction < 1.0 and not args.force:
+        logger.error("The target collection is missing documents; finish the backfill or pass --force.")
+        return 1
+
+    set_collection_model_id(engine, state["target_collection"], state["target_model_id"])
+    # Text generation and ingestion follow the collection parameter and the model recorded
+    # in the collection, so this flips them over in one step
+    put_parameter(EMBEDDING_COLLECTION_PARAM, state["target_collection"])
+    put_parameter(EMBEDDING_MODEL_PARAM, state["target_model_id"])
+    put_parameter(EMBEDDING_MIGRATION_PARAM, "none")
+    print(
+        f"'{state['target_collection']}' is now live. The previous collection '{state['live_collection']}' "
+        f"is no longer updated and can be deleted with `migration.py drop --collection {state['live_collection']}`."
+    )
+    return 0
+
+
+def abort(args, engine: Engine) -> int:
+    state = get_migration_state()
+    if "target_collection" not in state:
+        logger.error("No migration is in progress.")
+        return 1
+
+    put_parameter(EMBEDDING_MIGRATION_PARAM, "none")
+    if args.drop:
+        rebuild.drop_collection(engine, state["target_collection"])
+    return 0
+
+
+def drop(args, engine: Engine) -> int:
+    state = get_migration_state()
+    if args.collection in (state["live_collection"], state.get("target_collection")):
+        logger.error(f"Collection '{args.collection}' is still in use.")
+        return 1
+
+    rebuild.drop_collection(engine, args.collection)
+    return 0
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    start_parser = subparsers.add_parser("start", help="Start dual writes to a collection for a new model")
+    start_parser.add_argument("--model-id", required=True, help="The new embedding model id")
+    start_parser.add_argument("--collection", help="Name of the new collection; derived from the model id by default")
+    start_parser.add_argument("--dimensions", type=int, help="Reduced embedding dimension, for models that support it")
+    start_parser.add_argument("--index-type", choices=INDEX_TYPES, default="none", help="Quantized index of the new collection")
+    start_parser.set_defaults(func=start)
+
+    backfill_parser = subparsers.add_parser("backfill", help="Embed existing documents into the new collection")
+    backfill_parser.add_argument("--workers", type=int, default=4, help="Number of categories embedded concurrently")
+    backfill_parser.add_argument("--run-id", help="Id of an interrupted backfill to resume")
+    backfill_parser.set_defaults(func=backfill)
+
+    status_parser = subparsers.add_parser("status", help="Show the progress of the migration")
+    status_parser.set_defaults(func=status)
+
+    cutover_parser = subparsers.add_parser("cutover", help="Switch readers to the new collection")
+    cutover_parser.add_argument("--force", action="store_true", help="Switch even if documents are missing")
+    cutover_parser.set_defaults(func=cutover)
+
+    abort_parser = subparsers.add_parser("abort", help="Stop the migration")
+    abort_parser.add_argument("--drop", action="store_true", help="Delete the new collection")
+    abort_parser.set_defaults(func=abort)
+
+    drop_parser = subparsers.add_parser("drop", help="Delete a collection that is no longer live")
+    drop_parser.add_argument("--collection", required=True, help="Name of the collection to delete")
+    drop_parser.set_defaults(func=drop)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if not EMBEDDING_COLLECTION_PARAM or not EMBEDDING_MIGRATION_PARAM:
+        logger.error("EMBEDDING_COLLECTION_PARAM and EMBEDDING_MIGRATION_PARAM must be set.")
+        return 1
+    return args.func(args, rebuild.create_vectorstore_engine())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import logging
+import uuid
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_TABLE = "ingestion_batches"
+BATCH_JOB_TABLE = "ingestion_batch_jobs"
+# A worker that claimed a batch's finalization longer ago than this is assumed to have died
+FINALIZE_LEASE_SECONDS = 900
+
+
+class IngestionBatchStore:
+    """
+    Tracks the documents of a category that are indexed by ingestion workers as one batch.
+
+    The coordinator creates a batch with one job per changed document and enqueues the jobs.
+    Each worker marks its job done or failed, and the worker that finishes the last job of a
+    batch claims it and runs the category's cleanup, so cleanup runs exactly once per batch
+    after every document of the batch has been indexed. Claims are counted, so a cleanup that
+    keeps failing can be recorded as failed instead of being retried forever.
+    """
+
+    def __init__(self, engine: Engine):
+        """
+        Args:
+            engine (Engine): SQLAlchemy engine connected to the vectorstore database.
+        """
+        self.engine = engine
+
+    def create_batch(self, category_id: str, bucket: str, document_keys: Iterable[str]) -> str:
+        """
+        Create a batch with one pending job per document.
+
+        Returns:
+            str: The id of the new batch.
+        """
+        batch_id = str(uuid.uuid4())
+        document_keys = sorted(set(document_keys))
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(f"""
+                    INSERT INTO "{BATCH_TABLE}" (batch_id, category_id, bucket, total_jobs)
+                    VALUES (:batch_id, :category_id, :bucket, :total_jobs);
+                """),
+                {"batch_id": batch_id, "category_id": category_id, "bucket": bucket, "total_jobs": len(document_keys)}
+            )
+            conn.execute(
+                text(f'INSERT INTO "{BATCH_JOB_TABLE}" (batch_id, document_key) VALUES (:batch_id, :document_key);'),
+                [{"batch_id": batch_id, "document_key": document_key} for document_key in document_keys]
+            )
+        return batch_id
+
+    def finish_job(self, batch_id: str, document_key: str, failed: bool = False, error: Optional[str] = None) -> None:
+        """
+        Mark a pending job as done or failed. Jobs that are already finished are left unchanged,
+        so redelivered messages are not counted twice.
+        """
+        status = "failed" if failed else "done"
+        counter = "failed_jobs" if failed else "completed_jobs"
+        with self.engine.begin() as conn:
+            finished = conn.execute(
+                text(f"""
+                    UPDATE "{BATCH_JOB_TABLE}"
+                    SET status = :status, error = :error, time_updated = now() AT TIME ZONE 'UTC'
+                    WHERE batch_id = :batch_id AND document_key = :document_key AND status = 'pending'
+                    RETURNING document_key;
+                """),
+                {"batch_id": batch_id, "document_key": document_key, "status": status, "error": error}
+            ).first()
+            if finished:
+                conn.execute(
+                    text(f'UPDATE "{BATCH_TABLE}" SET {counter} = {counter} + 1 WHERE batch_id = :batch_id;'),
+                    {"batch_id": batch_id}
+                )
+
+    def claim_finalize(self, batch_id: str) -> Optional[int]:
+        """
+        Claim the cleanup of a batch whose jobs are all finished.
+
+        Returns:
+            Optional[int]: The number of this finalization attempt if the caller must finalize
+                the batch. None while jobs are pending, once the batch is finalized, or while
+                another worker holds an unexpired claim.
+        """
+        with self.engine.begin() as conn:
+            claimed = conn.execute(
+                text(f"""
+                    UPDATE "{BATCH_TABLE}"
+                    SET time_finalize_claimed = now() AT TIME ZONE 'UTC',
+                        finalize_attempts = finalize_attempts + 1
+                    WHERE batch_id = :batch_id
+                    AND completed_jobs + failed_jobs >= total_jobs
+                    AND time_finalized IS NULL
+                    AND (time_finalize_claimed IS NULL
+                         OR time_finalize_claimed < (now() AT TIME ZONE 'UTC') - make_interval(secs => :lease))
+                    RETURNING finalize_attempts;
+                """),
+                {"batch_id": batch_id, "lease": FINALIZE_LEASE_SECONDS}
+            ).first()
+        return claimed.finalize_attempts if claimed else None
+
+    def mark_finalized(self, batch_id: str) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(f"""
+                    UPDATE "{BATCH_TABLE}" SET time_finalized = now() AT TIME ZONE 'UTC'
+                    WHERE batch_id = :batch_id;
+                """),
+                {"batch_id": batch_id}
+            )
+
+    def fail_finalize(self, batch_id: str, error: str) -> None:
+        """
+        Record that the cleanup of a batch failed for good, so it is no longer claimed.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(f"""
+                    UPDATE "{BATCH_TABLE}"
+                    SET time_finalized = now() AT TIME ZONE 'UTC', finalize_error = :error
+                    WHERE batch_id = :batch_id;
+                """),
+                {"batch_id": batch_id, "error": error}
+            )
+
+    def release_finalize(self, batch_id: str) -> None:
+        """
+        Give up a finalization claim after a failure, so a redelivered job can retry it at once.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(f'UPDATE "{BATCH_TABLE}" SET time_finalize_claimed = NULL WHERE batch_id = :batch_id;'),
+                {"batch_id": batch_id}
+            )
@@ -0,0 +1,120 @@
+import logging
+from typing import Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_TABLE = "ingestion_checkpoints"
+RUN_TABLE = "ingestion_runs"
+
+
+class IngestionCheckpoint:
+    """
+    Records which documents of a long-running ingestion run have been fully indexed.
+
+    A run is identified by `run_id`. Each indexed document gets a (run_id, category_id, document)
+    row with its page count, so a run that is interrupted and started again with the same
+    `run_id` skips the documents it already indexed. Progress is not recorded per page: a
+    partially indexed document is extracted again, but pages whose chunks were already written
+    are replayed from the page hash table instead of being chunked again, embedded from the
+    embedding cache and skipped by the record manager.
+
+    The run's start time is stored with the run and reused on resume, so the stale record
+    sweep at the end of each category does not delete documents indexed before the interruption.
+    """
+
+    def __init__(self, engine: Engine, run_id: str):
+        """
+        Args:
+            engine (Engine): SQLAlchemy engine connected to the vectorstore database.
+            run_id (str): Identifier of the run.
+        """
+        self.engine = engine
+        self.run_id = run_id
+        self.started_at: Optional[float] = None
+        self._completed: Set[str] = set()
+
+    def start(self, target_collection: str, started_at: float, options: str = "{}") -> bool:
+        """
+        Register the run, or load it if it already exists.
+
+        Args:
+            target_collection (str): The collection the run writes to.
+            started_at (float): Record manager timestamp of the start of this attempt.
+            options (str): JSON-encoded options of the run, kept for reference.
+
+        Returns:
+            bool: True if an existing run is being resumed.
+        """
+        with self.engine.begin() as conn:
+            inserted = conn.execute(
+                text(f"""
+                    INSERT INTO "{RUN_TABLE}" (run_id, target_collection, started_at, options)
+                    VALUES (:run_id, :target_collection, :started_at, CAST(:options AS jsonb))
+                    ON CONFLICT (run_id) DO NOTHING;
+                """),
+                {
+                    "run_id": self.run_id,
+                    "target_collection": target_collection,
+                    "started_at": started_at,
+                    "options": options
+                }
+            ).rowcount
+            row = conn.execute(
+                text(f'SELECT target_collection, started_at FROM "{RUN_TABLE}" WHERE run_id = :run_id;'),
+                {"run_id": self.run_id}
+            ).one()
+            completed = conn.execute(
+                text(f'SELECT category_id, document FROM "{CHECKPOINT_TABLE}" WHERE run_id = :run_id;'),
+                {"run_id": self.run_id}
+            ).fetchall()
+
+        if row.target_collection != target_collection:
+            raise ValueError(
+                f"Run {self.run_id} writes to collection '{row.target_collection}', not '{target_collection}'."
+            )
+
+        self.started_at = row.started_at
+        self._completed = {f"{category_id}/{document}" for category_id, document in completed}
+        resumed = inserted == 0
+        if resumed:
+            logger.info(f"Resuming run {self.run_id}: {len(self._completed)} documents already indexed.")
+        return resumed
+
+    def is_complete(self, document_key: str) -> bool:
+        """
+        Return whether the document (`<category_id>/<document>`) was indexed by this run.
+        """
+        return document_key in self._completed
+
+    def complete(self, document_key: str, pages: int) -> None:
+        """
+        Record that the document (`<category_id>/<document>`) has been indexed.
+        """
+        category_id, _, document = document_key.partition("/")
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(f"""
+                    INSERT INTO "{CHECKPOINT_TABLE}" (run_id, category_id, document, pages)
+                    VALUES (:run_id, :category_id, :document, :pages)
+                    ON CONFLICT (run_id, category_id, document) DO UPDATE SET
+                        pages = EXCLUDED.pages,
+                        time_completed = EXCLUDED.time_completed;
+                """),
+                {"run_id": self.run_id, "category_id": category_id, "document": document, "pages": pages}
+            )
+        self._completed.add(document_key)
+
+    def finish(self, completed_at: float) -> None:
+        """
+        Mark the run as completed.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(f'UPDATE "{RUN_TABLE}" SET completed_at = :completed_at WHERE run_id = :run_id;'),
+                {"run_id": self.run_id, "completed_at": completed_at}
+            )
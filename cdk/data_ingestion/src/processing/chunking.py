@@ -0,0 +1,149 @@
+import logging
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_experimental.text_splitter import SemanticChunker
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNKING_STRATEGY = "semantic"
+CHUNK_SIZE_TOKENS = int(os.environ.get("CHUNK_SIZE_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "64"))
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate the number of model tokens in a text without calling a tokenizer.
+
+    Words and punctuation marks are counted separately, which tracks subword tokenizers
+    closely enough for sizing chunks and never requires a network call.
+    """
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+class ChunkingStrategy(ABC):
+    """
+    Interface for splitting page texts into chunks before they are embedded and indexed.
+    """
+
+    name: str
+
+    @abstractmethod
+    def split_text(self, text: str) -> List[str]:
+        """
+        Split a single text into chunk strings.
+        """
+
+    def create_documents(self, texts: List[str]) -> List[Document]:
+        """
+        Split each text and wrap the resulting chunks in Documents.
+
+        Args:
+            texts (List[str]): The texts to split.
+
+        Returns:
+            List[Document]: One Document per chunk, in order.
+        """
+        return [
+            Document(page_content=chunk)
+            for text in texts
+            for chunk in self.split_text(text)
+        ]
+
+
+class RecursiveChunkingStrategy(ChunkingStrategy):
+    """
+    Token-aware recursive splitting on paragraph, line and sentence boundaries.
+    Makes no network calls.
+    """
+
+    name = "recursive"
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE_TOKENS, chunk_overlap: int = CHUNK_OVERLAP_TOKENS):
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=estimate_tokens,
+            separators=["\n\n", "\n", ". ", " ", ""]
+        )
+
+    def split_text(self, text: str) -> List[str]:
+        return self.text_splitter.split_text(text)
+
+
+class SemanticChunkingStrategy(ChunkingStrategy):
+    """
+    Embedding-based semantic splitting. Embeds every sentence of the text to find topic breaks.
+    """
+
+    name = "semantic"
+
+    def __init__(self, embeddings: Embeddings):
+        self.text_splitter = SemanticChunker(embeddings)
+
+    def split_text(self, text: str) -> List[str]:
+        return self.text_splitter.split_text(text)
+
+
+class HybridChunkingStrategy(ChunkingStrategy):
+    """
+    Merges paragraphs into token-bounded sections and only applies semantic splitting
+    to sections that are still longer than the chunk size.
+    """
+
+    name = "hybrid"
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        chunk_size: int = CHUNK_SIZE_TOKENS,
+        chunk_overlap: int = CHUNK_OVERLAP_TOKENS
+    ):
+        self.chunk_size = chunk_size
+        # Splitting only on blank lines leaves paragraphs longer than the chunk size intact
+        self.section_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=estimate_tokens,
+            separators=["\n\n"]
+        )
+        self.semantic_splitter = SemanticChunker(embeddings)
+
+    def split_text(self, text: str) -> List[str]:
+        chunks = []
+        for section in self.section_splitter.split_text(text):
+            if estimate_tokens(section) > self.chunk_size:
+                chunks.extend(self.semantic_splitter.split_text(section))
+            else:
+                chunks.append(section)
+        return chunks
+
+
+def get_chunking_strategy(name: str, embeddings: Embeddings) -> ChunkingStrategy:
+    """
+    Build the chunking strategy with the given name.
+
+    Args:
+        name (str): One of "recursive", "semantic" or "hybrid".
+        embeddings (Embeddings): The embeddings instance used by the semantic strategies.
+
+    Returns:
+        ChunkingStrategy: The configured strategy. Unknown names fall back to the semantic strategy.
+    """
+    name = (name or DEFAULT_CHUNKING_STRATEGY).strip().lower()
+    if name == RecursiveChunkingStrategy.name:
+        return RecursiveChunkingStrategy()
+    if name == HybridChunkingStrategy.name:
+        return HybridChunkingStrategy(embeddings)
+    if name != SemanticChunkingStrategy.name:
+        logger.warning(f"Unknown chunking strategy '{name}', using '{DEFAULT_CHUNKING_STRATEGY}'.")
+    return SemanticChunkingStrategy(embeddings)
@@ -0,0 +1,509 @@
+import hashlib
+import logging
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain.indexes import SQLRecordManager
+from langchain_core.documents import Document
+from langchain_postgres import PGVector
+from sqlalchemy import text
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DUPLICATE_TABLE = "chunk_duplicates"
+FINGERPRINT_TABLE = "chunk_fingerprints"
+# Chunks whose SimHash fingerprints differ in at most this many of 64 bits are near-duplicates.
+# A negative value disables deduplication.
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.environ.get("NEAR_DUPLICATE_MAX_DISTANCE", "6"))
+# Shorter chunks, such as headings, are never collapsed
+NEAR_DUPLICATE_MIN_WORDS = int(os.environ.get("NEAR_DUPLICATE_MIN_WORDS", "20"))
+SHINGLE_SIZE = 3
+
+_WORD_PATTERN = re.compile(r"\w+")
+_MASK_64 = (1 << 64) - 1
+
+
+def _to_signed(value: int) -> int:
+    # Fingerprints and band tokens are stored in bigint columns
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def simhash(page_text: str, shingle_size: int = SHINGLE_SIZE) -> Optional[int]:
+    """
+    Return the 64-bit SimHash fingerprint of a text over its word shingles.
+
+    Texts that differ only in a few words, whitespace, casing or punctuation get fingerprints
+    that differ in only a few bits. Returns None for texts shorter than NEAR_DUPLICATE_MIN_WORDS.
+    """
+    words = _WORD_PATTERN.findall(page_text.lower())
+    if len(words) < max(NEAR_DUPLICATE_MIN_WORDS, shingle_size):
+        return None
+
+    weights = [0] * 64
+    for i in range(len(words) - shingle_size + 1):
+        shingle = " ".join(words[i:i + shingle_size])
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+class NearDuplicateIndex:
+    """
+    Finds a previously added fingerprint within a Hamming distance of a new one.
+
+    Fingerprints are split into `max_distance + 1` bands. Two fingerprints within the distance
+    must agree on at least one whole band, so only fingerprints sharing a band are compared.
+    Chunks of the same source are never matched, so a passage repeated inside one document is
+    left alone.
+    """
+
+    def __init__(self, max_distance: int = NEAR_DUPLICATE_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.band_count = max_distance + 1
+        self.band_width = 64 // self.band_count
+        self.buckets: List[Dict[int, List[tuple]]] = [{} for _ in range(self.band_count)]
+
+    def _bands(self, fingerprint: int):
+        mask = (1 << self.band_width) - 1
+        for band in range(self.band_count):
+            yield band, fingerprint >> (band * self.band_width) & mask
+
+    def tokens(self, fingerprint: int) -> List[int]:
+        """
+        Return the bands of a fingerprint as bigint tokens that also encode the band number,
+        so the stored bands of two fingerprints can be compared with an array overlap.
+        """
+        return [_to_signed(band << 57 | value) for band, value in self._bands(fingerprint)]
+
+    def within_distance(self, fingerprint: int, other: int) -> bool:
+        return bin((fingerprint ^ other) & _MASK_64).count("1") <= self.max_distance
+
+    def find(self, fingerprint: int, source: str) -> Optional[str]:
+        """
+        Return the key of an added fingerprint of another source within the distance, or None.
+        """
+        for band, value in self._bands(fingerprint):
+            for other, key, other_source in self.buckets[band].get(value, ()):
+                if other_source != source and self.within_distance(fingerprint, other):
+                    return key
+        return None
+
+    def add(self, fingerprint: int, key: str, source: str) -> None:
+        for band, value in self._bands(fingerprint):
+            self.buckets[band].setdefault(value, []).append((fingerprint, key, source))
+
+
+def delete_fingerprints(engine, keys: Sequence[str]) -> None:
+    """
+    Delete the stored fingerprints of chunks removed from the embedding table.
+    """
+    if not keys:
+        return
+    with engine.begin() as conn:
+        conn.execute(text(f'DELETE FROM "{FINGERPRINT_TABLE}" WHERE key = ANY(:keys);'), {"keys": list(keys)})
+
+
+class ChunkDeduplicator:
+    """
+    Collapses near-duplicate chunks of a category into a single stored chunk.
+
+    Categories often contain the same passage in several documents (drafts, summaries, repeated
+    guideline text). Every chunk but one of each group of near-duplicates from different
+    documents is moved from the embedding table to the `chunk_duplicates` table, and the chunk
+    that is kept lists the other documents in its `duplicate_sources` metadata.
+
+    The SimHash fingerprint of each chunk is stored in the `chunk_fingerprints` table by
+    `fingerprint_new` when its document is indexed, with its bands as an indexed array. A run of
+    `deduplicate` then only compares the chunks not yet checked against the stored bands, so its
+    cost follows the size of the upload rather than of the category. Chunks indexed before
+    fingerprints were stored are fingerprinted the next time their document is indexed, e.g. by
+    rebuild.py.
+
+    Moved chunks keep their record manager entries, so `index()` treats them as stored and does
+    not embed them again. When the kept chunk disappears because its document changed or was
+    deleted, its duplicates are added back to the collection by `restore_orphans`.
+    """
+
+    def __init__(
+        self,
+        vectorstore: PGVector,
+        record_manager: SQLRecordManager,
+        max_distance: int = NEAR_DUPLICATE_MAX_DISTANCE
+    ):
+        """
+        Args:
+            vectorstore (PGVector): The vectorstore of the collection.
+            record_manager (SQLRecordManager): The record manager of the collection.
+            max_distance (int): Maximum Hamming distance between near-duplicate fingerprints.
+        """
+        self.vectorstore = vectorstore
+        self.record_manager = record_manager
+        self.engine = record_manager.engine
+        self.max_distance = max_distance
+
+    def _collection_uuid(self):
+        with self.vectorstore._make_sync_session() as session:
+            collection = self.vectorstore.get_collection(session)
+            return collection.uuid if collection else None
+
+    def _store_fingerprints(self, collection_uuid, chunks: Iterable[Tuple[str, str, str]]) -> int:
+        """
+        Fingerprint (key, source, document) chunks and store them as not yet checked.
+
+        Chunks too short to fingerprint are stored without one and marked as checked.
+        """
+        index = NearDuplicateIndex(self.max_distance)
+        rows = []
+        for key, source, document in chunks:
+            fingerprint = simhash(document or "")
+            rows.append({
+                "collection_id": collection_uuid,
+                "key": key,
+                "source": source or "",
+                "fingerprint": None if fingerprint is None else _to_signed(fingerprint),
+                "max_distance": self.max_distance,
+                "bands": [] if fingerprint is None else index.tokens(fingerprint),
+                "checked": fingerprint is None,
+            })
+
+        if rows:
+            with self.engine.begin() as conn:
+                conn.execute(
+                    text(f"""
+                        INSERT INTO "{FINGERPRINT_TABLE}"
+                            (collection_id, key, source, fingerprint, max_distance, bands, checked)
+                        VALUES (:collection_id, :key, :source, :fingerprint, :max_distance,
+                                CAST(:bands AS bigint[]), :checked)
+                        ON CONFLICT (collection_id, key) DO UPDATE SET
+                            source = EXCLUDED.source,
+                            fingerprint = EXCLUDED.fingerprint,
+                            max_distance = EXCLUDED.max_distance,
+                            bands = EXCLUDED.bands,
+                            checked = EXCLUDED.checked;
+                    """),
+                    rows
+                )
+        return len(rows)
+
+    def fingerprint_new(self, source_prefix: str) -> int:
+        """
+        Store the fingerprints of the chunks under a source prefix that do not have one yet.
+
+        Called after a document is indexed, so only its new or changed chunks are read and
+        hashed. Fingerprints of its chunks that were replaced are deleted.
+
+        Args:
+            source_prefix (str): Prefix of the `source` metadata of the chunks, e.g. a document.
+
+        Returns:
+            int: The number of chunks fingerprinted.
+        """
+        collection_uuid = self._collection_uuid()
+        if not collection_uuid:
+            return 0
+
+        params = {"collection_id": collection_uuid, "source_prefix": f"{source_prefix}%"}
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(f"""
+                    DELETE FROM "{FINGERPRINT_TABLE}" f
+                    WHERE f.collection_id = :collection_id AND f.source LIKE :source_prefix
+                    AND NOT EXISTS (
+                        SELECT 1 FROM langchain_pg_embedding e
+                        WHERE e.collection_id = f.collection_id AND e.id = f.key
+                    );
+                """),
+                params
+            )
+            chunks = conn.execute(
+                text(f"""
+                    SELECT e.id, e.cmetadata->>'source', e.document FROM langchain_pg_embedding e
+                    WHERE e.collection_id = :collection_id AND e.cmetadata->>'source' LIKE :source_prefix
+                    AND NOT EXISTS (
+                        SELECT 1 FROM "{FINGERPRINT_TABLE}" f
+                        WHERE f.collection_id = e.collection_id AND f.key = e.id
+                    );
+                """),
+                params
+            ).fetchall()
+
+        return self._store_fingerprints(collection_uuid, chunks)
+
+    def _reband(self, collection_uuid, source_prefix: str) -> None:
+        """
+        Recompute the stored bands of fingerprints banded with another maximum distance.
+        """
+        index = NearDuplicateIndex(self.max_distance)
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                text(f"""
+                    SELECT key, fingerprint FROM "{FINGERPRINT_TABLE}"
+                    WHERE collection_id = :collection_id AND source LIKE :source_prefix
+                    AND fingerprint IS NOT NULL AND max_distance <> :max_distance;
+                """),
+                {"collection_id": collection_uuid, "source_prefix": f"{source_prefix}%", "max_distance": self.max_distance}
+            ).fetchall()
+            if rows:
+                conn.execute(
+                    text(f"""
+                        UPDATE "{FINGERPRINT_TABLE}" SET bands = CAST(:bands AS bigint[]), max_distance = :max_distance
+                        WHERE collection_id = :collection_id AND key = :key;
+                    """),
+                    [
+                        {
+                            "collection_id": collection_uuid,
+                            "key": key,
+                            "bands": index.tokens(fingerprint & _MASK_64),
+                            "max_distance": self.max_distance
+                        }
+                        for key, fingerprint in rows
+                    ]
+                )
+
+    def restore_orphans(self, source_prefix: str) -> int:
+        """
+        Add duplicates whose kept chunk no longer exists back to the collection.
+
+        Duplicates of documents that changed or were deleted since they were moved have lost
+        their record manager entry and are dropped instead. Restored chunks are fingerprinted
+        again, so they are checked by the next `deduplicate`.
+
+        Args:
+            source_prefix (str): Prefix of the `source` metadata of the duplicates to consider.
+
+        Returns:
+            int: The number of chunks added back.
+        """
+        collection_uuid = self._collection_uuid()
+        if not collection_uuid:
+            return 0
+
+        params = {
+            "collection_id": collection_uuid,
+            "namespace": self.record_manager.namespace,
+            "source_prefix": f"{source_prefix}%"
+        }
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(f"""
+                    DELETE FROM "{DUPLICATE_TABLE}" d
+                    WHERE d.collection_id = :collection_id AND d.source LIKE :source_prefix
+                    AND NOT EXISTS (
+                        SELECT 1 FROM upsertion_record r WHERE r.namespace = :namespace AND r.key = d.key
+                    );
+                """),
+                params
+            )
+            orphans = conn.execute(
+                text(f"""
+                    SELECT d.key, d.document, d.cmetadata FROM "{DUPLICATE_TABLE}" d
+                    WHERE d.collection_id = :collection_id AND d.source LIKE :source_prefix
+                    AND NOT EXISTS (
+                        SELECT 1 FROM langchain_pg_embedding e
+                        WHERE e.collection_id = d.collection_id AND e.id = d.canonical_key
+                    );
+                """),
+                params
+            ).fetchall()
+
+        if not orphans:
+            return 0
+
+        keys = [key for key, _, _ in orphans]
+        # Restored chunks were embedded before, so the embedding cache usually serves them
+        self.vectorstore.add_documents(
+            [Document(page_content=document, metadata=cmetadata or {}) for _, document, cmetadata in orphans],
+            ids=keys
+        )
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(f'DELETE FROM "{DUPLICATE_TABLE}" WHERE collection_id = :collection_id AND key = ANY(:keys);'),
+                {"collection_id": collection_uuid, "keys": keys}
+            )
+        self._store_fingerprints(
+            collection_uuid,
+            [(key, (cmetadata or {}).get("source"), document) for key, document, cmetadata in orphans]
+        )
+        logger.info(f"Restored {len(keys)} duplicate chunks whose kept chunk was removed.")
+        return len(keys)
+
+    def deduplicate(self, source_prefix: str) -> Dict[str, int]:
+        """
+        Collapse the chunks under a source prefix that were fingerprinted since the last run.
+
+        Each new chunk is compared with the checked chunks that share one of its bands, found
+        through the bands index, and with the other new chunks. Checked chunks are kept in
+        preference to new ones, so results are stable from one run to the next; otherwise the
+        chunk of the first document by name is kept.
+
+        Args:
+            source_prefix (str): Prefix of the `source` metadata of the chunks, e.g. a category.
+
+        Returns:
+            Dict[str, int]: Report with the number of `stored_before` and `stored_after` chunks
+                under the prefix, new chunks `checked` and `collapsed` by this run, chunks
+                `restored` and the `total_duplicates` held back from the collection under the prefix.
+        """
+        restored = self.restore_orphans(source_prefix)
+        collection_uuid = self._collection_uuid()
+        if not collection_uuid:
+            return {
+                "stored_before": 0, "stored_after": 0, "checked": 0, "collapsed": 0,
+                "restored": restored, "total_duplicates": 0
+            }
+
+        self._reband(collection_uuid, source_prefix)
+        params = {"collection_id": collection_uuid, "source_prefix": f"{source_prefix}%"}
+        with self.engine.connect() as conn:
+            new_chunks = conn.execute(
+                text(f"""
+                    SELECT key, source, fingerprint FROM "{FINGERPRINT_TABLE}"
+                    WHERE collection_id = :collection_id AND NOT checked AND source LIKE :source_prefix
+                    ORDER BY source, key;
+                """),
+                params
+            ).fetchall()
+            candidates = conn.execute(
+                text(f"""
+                    SELECT n.key, c.key, c.fingerprint
+                    FROM "{FINGERPRINT_TABLE}" n
+                    JOIN "{FINGERPRINT_TABLE}" c
+                        ON c.bands && n.bands AND c.collection_id = n.collection_id
+                        AND c.checked AND c.source <> n.source
+                    WHERE n.collection_id = :collection_id AND NOT n.checked
+                    AND n.source LIKE :source_prefix AND c.source LIKE :source_prefix
+                    AND EXISTS (
+                        SELECT 1 FROM langchain_pg_embedding e
+                        WHERE e.collection_id = c.collection_id AND e.id = c.key
+                    )
+                    ORDER BY c.source, c.key;
+                """),
+                params
+            ).fetchall() if new_chunks else []
+            conn.commit()
+
+        stored_candidates: Dict[str, List[Tuple[str, int]]] = {}
+        for key, canonical_key, fingerprint in candidates:
+            stored_candidates.setdefault(key, []).append((canonical_key, fingerprint & _MASK_64))
+
+        index = NearDuplicateIndex(self.max_distance)
+        duplicates: Dict[str, str] = {}
+        for key, source, fingerprint in new_chunks:
+            fingerprint &= _MASK_64
+            canonical_key = next(
+                (
+                    other_key for other_key, other in stored_candidates.get(key, ())
+                    if index.within_distance(fingerprint, other)
+                ),
+                None
+            ) or index.find(fingerprint, source)
+            if canonical_key:
+                duplicates[key] = canonical_key
+            else:
+                index.add(fingerprint, key, source)
+
+        keys = list(duplicates)
+        canonical_keys = [duplicates[key] for key in keys]
+        kept_keys = [key for key, _, _ in new_chunks if key not in duplicates]
+        with self.engine.begin() as conn:
+            if keys:
+                duplicate_params = {"collection_id": collection_uuid, "keys": keys, "canonical_keys": canonical_keys}
+                conn.execute(
+                    text(f"""
+                        INSERT INTO "{DUPLICATE_TABLE}" (collection_id, key, canonical_key, source, document, cmetadata)
+                        SELECT e.collection_id, e.id, d.canonical_key, e.cmetadata->>'source', e.document,
+                               e.cmetadata - 'duplicate_sources'
+                        FROM unnest(CAST(:keys AS varchar[]), CAST(:canonical_keys AS varchar[])) AS d(key, canonical_key)
+                        JOIN langchain_pg_embedding e ON e.collection_id = :collection_id AND e.id = d.key
+                        ON CONFLICT (collection_id, key) DO UPDATE SET canonical_key = EXCLUDED.canonical_key;
+                    """),
+                    duplicate_params
+                )
+                # Duplicates of a chunk that is itself a duplicate now belong to its kept chunk
+                conn.execute(
+                    text(f"""
+                        UPDATE "{DUPLICATE_TABLE}" t SET canonical_key = d.canonical_key
+                        FROM unnest(CAST(:keys AS varchar[]), CAST(:canonical_keys AS varchar[])) AS d(key, canonical_key)
+                        WHERE t.collection_id = :collection_id AND t.canonical_key = d.key;
+                    """),
+                    duplicate_params
+                )
+                conn.execute(
+                    text("DELETE FROM langchain_pg_embedding WHERE collection_id = :collection_id AND id = ANY(:keys);"),
+                    duplicate_params
+                )
+                conn.execute(
+                    text(f'DELETE FROM "{FINGERPRINT_TABLE}" WHERE collection_id = :collection_id AND key = ANY(:keys);'),
+                    duplicate_params
+                )
+            if kept_keys:
+                conn.execute(
+                    text(f"""
+                        UPDATE "{FINGERPRINT_TABLE}" SET checked = true
+                        WHERE collection_id = :collection_id AND key = ANY(:keys);
+                    """),
+                    {"collection_id": collection_uuid, "keys": kept_keys}
+                )
+
+            # Only kept chunks that have or had duplicates are considered, and only those whose
+            # list of duplicate documents changed are rewritten
+            conn.execute(
+                text(f"""
+                    UPDATE langchain_pg_embedding e
+                    SET cmetadata = CASE
+                        WHEN s.sources IS NULL THEN e.cmetadata - 'duplicate_sources'
+                        ELSE jsonb_set(e.cmetadata, '{{duplicate_sources}}', s.sources)
+                    END
+                    FROM (
+                        SELECT k.id, (
+                            SELECT jsonb_agg(DISTINCT d.source ORDER BY d.source) FROM "{DUPLICATE_TABLE}" d
+                            WHERE d.collection_id = k.collection_id AND d.canonical_key = k.id
+                            AND d.source <> k.cmetadata->>'source'
+                        ) AS sources
+                        FROM langchain_pg_embedding k
+                        WHERE k.collection_id = :collection_id AND k.cmetadata->>'source' LIKE :source_prefix
+                        AND (k.id = ANY(:canonical_keys) OR (k.cmetadata->'duplicate_sources') IS NOT NULL)
+                    ) s
+                    WHERE e.id = s.id AND e.collection_id = :collection_id
+                    AND (e.cmetadata->'duplicate_sources') IS DISTINCT FROM s.sources;
+                """),
+                {**params, "canonical_keys": canonical_keys}
+            )
+            stored_after, total_duplicates = conn.execute(
+                text(f"""
+                    SELECT
+                        (SELECT count(*) FROM langchain_pg_embedding
+                         WHERE collection_id = :collection_id AND cmetadata->>'source' LIKE :source_prefix),
+                        (SELECT count(*) FROM "{DUPLICATE_TABLE}"
+                         WHERE collection_id = :collection_id AND source LIKE :source_prefix);
+                """),
+                params
+            ).one()
+
+        return {
+            "stored_before": stored_after + len(keys),
+            "stored_after": stored_after,
+            "checked": len(new_chunks),
+            "collapsed": len(keys),
+            "restored": restored,
+            "total_duplicates": total_duplicates,
+        }
+
+
+def format_report(report: Dict[str, int]) -> str:
+    """
+    Describe how much deduplication shrank the stored chunks of a category.
+    """
+    stored = report["stored_after"]
+    without_dedup = stored + report["total_duplicates"]
+    shrink = report["total_duplicates"] / without_dedup if without_dedup else 0.0
+    return (
+        f"{report['collapsed']} of {report['checked']} new chunks collapsed as near-duplicates and "
+        f"{report['restored']} restored this run; "
+        f"{stored} chunks stored instead of {without_dedup} ({shrink:.1%} smaller)."
+    )
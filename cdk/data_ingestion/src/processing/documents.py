@@ -1,13 +1,25 @@
-import os, logging, uuid
+import os, logging, uuid, resource, tempfile, hashlib, time, copy
+from contextlib import nullcontext
 from io import BytesIO
-from typing import List
+from typing import Iterator, List, Optional
 import boto3, pymupdf
+from sqlalchemy import text
 from langchain_aws import BedrockEmbeddings
 from langchain_postgres import PGVector
 from langchain_core.documents import Document
-from langchain_experimental.text_splitter import SemanticChunker
 from langchain.indexes import SQLRecordManager, index
 
+from processing.chunking import ChunkingStrategy, SemanticChunkingStrategy, get_chunking_strategy
+from processing.page_hashes import PageHashStore, page_hash
+from processing.checkpoint import IngestionCheckpoint
+from processing.deduplication import (
+    NEAR_DUPLICATE_MAX_DISTANCE,
+    ChunkDeduplicator,
+    delete_fingerprints,
+    format_report,
+)
+from processing.stats import DocumentStats, IngestionStatsStore, StatsRecordingEmbeddings
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,20 +27,24 @@ logger = logging.getLogger(__name__)
 # Initialize the S3 client
 s3 = boto3.client('s3')
 EMBEDDING_BUCKET_NAME = os.environ["EMBEDDING_BUCKET_NAME"]
+# Large index batches let the vectorstore write chunks with a bulk COPY
+INDEX_BATCH_SIZE = int(os.environ.get("INDEX_BATCH_SIZE", "1000"))
 
 
 def store_doc_texts(
     bucket: str,
     category_id: str, 
     document_name: str, 
-    output_bucket: str
+    output_bucket: str,
+    stats: Optional[DocumentStats] = None
 ) -> List[str]:
     """
     Extract and store the text from each document page in an S3 bucket.
 
     This function constructs the S3 key from the given prefix (`category_id`) and 
-    file name (`document_name`), then uses PyMuPDF to extract the text from each 
-    page of the document. Each page's text is uploaded to the `output_bucket` as a 
+    file name (`document_name`), spools the object to a temporary file in /tmp and
+    uses PyMuPDF to extract the text from each page of the document, so the file
+    is never held in memory as a whole. Each page's text is uploaded to the `output_bucket` as a 
     separate file. The resulting objects follow the pattern:
     
         <category_id>/<document_name>_page_<page_num>.txt
@@ -45,27 +61,40 @@ def store_doc_texts(
         category_id (str): The folder or category ID in the S3 bucket where the document is stored.
         document_name (str): The name of the document file.
         output_bucket (str): The name of the S3 bucket where the extracted text files will be stored.
+        stats (DocumentStats, optional): Statistics of the document's ingestion; receives the
+            extraction time, page count and content hash.
 
     Returns:
         List[str]: A list of keys corresponding to the stored text files for each page.
     """
-    # Get document bytes directly from S3
-    response = s3.get_object(Bucket=bucket, Key=f"{category_id}/{document_name}")
-    file_data = response['Body'].read()
-    
-    # Process document in memory
     document_filetype = document_name.split('.')[-1].lower()
-    doc = pymupdf.open(stream=file_data, filetype=document_filetype)
 
-    # Upload each page's text to S3
-    for page_num, page in enumerate(doc, start=1):
-        text = page.get_text().encode("utf8")
-        page_output_key = f'{category_id}/{document_name}_page_{page_num}.txt'
-        
-        with BytesIO(text) as page_output_buffer:
-            s3.upload_fileobj(page_output_buffer, output_bucket, page_output_key)
+    with stats.timer("extraction") if stats else nullcontext(), \
+            tempfile.NamedTemporaryFile(suffix=f".{document_filetype}") as local_file:
+        # Stream the document from S3 to /tmp instead of reading it into memory
+        s3.download_fileobj(bucket, f"{category_id}/{document_name}", local_file)
+        local_file.flush()
+
+        if stats:
+            if stats.values["size_bytes"] is None:
+                stats.set("size_bytes", os.path.getsize(local_file.name))
+            with open(local_file.name, "rb") as spooled_file:
+                stats.set("content_hash", hashlib.file_digest(spooled_file, "sha256").hexdigest())
+
+        with pymupdf.open(local_file.name, filetype=document_filetype) as doc:
+            page_count = len(doc)
 
-    return [f'{category_id}/{document_name}_page_{page_num}.txt' for page_num in range(1, len(doc) + 1)]
+            # Upload each page's text to S3
+            for page_num, page in enumerate(doc, start=1):
+                page_text = page.get_text().encode("utf8")
+                page_output_key = f'{category_id}/{document_name}_page_{page_num}.txt'
+
+                with BytesIO(page_text) as page_output_buffer:
+                    s3.upload_fileobj(page_output_buffer, output_bucket, page_output_key)
+
+    if stats:
+        stats.set("page_count", page_count)
+    return [f'{category_id}/{document_name}_page_{page_num}.txt' for page_num in range(1, page_count + 1)]
 
 def add_document(
     bucket: str,
@@ -73,14 +102,17 @@ def add_document(
     document_name: str,
     vectorstore: PGVector, 
     embeddings: BedrockEmbeddings,
-    output_bucket: str = EMBEDDING_BUCKET_NAME
-) -> List[Document]:
+    output_bucket: str = EMBEDDING_BUCKET_NAME,
+    text_splitter: Optional[ChunkingStrategy] = None,
+    page_hash_store: Optional[PageHashStore] = None,
+    stats: Optional[DocumentStats] = None
+) -> Iterator[Document]:
     """
-    Add a document to the vectorstore by extracting its text and creating semantic chunks.
+    Add a document to the vectorstore by extracting its text and splitting it into chunks.
 
     This function processes a document by:
       1. Extracting each page's text using `store_doc_texts`.
-      2. Splitting the text into semantic chunks via `store_doc_chunks`.
+      2. Splitting the text into chunks via `store_doc_chunks`.
       3. Adding metadata (such as the source S3 URL and a unique document ID) to each chunk.
       4. Ingesting the chunks into the provided vectorstore.
 
@@ -92,21 +124,29 @@ def add_document(
         embeddings (BedrockEmbeddings): The embeddings instance used to generate document embeddings.
         output_bucket (str, optional): The S3 bucket for storing intermediate extracted text files.
                                        Defaults to the EMBEDDING_BUCKET_NAME environment variable.
+        text_splitter (ChunkingStrategy, optional): The chunking strategy used to split page texts.
+                                       Defaults to semantic chunking with `embeddings`.
+        page_hash_store (PageHashStore, optional): Store of per-page hashes used to skip unchanged pages.
+        stats (DocumentStats, optional): Statistics of the document's ingestion.
 
     Returns:
-        List[Document]: A list of document chunks that were added to the vectorstore.
+        Iterator[Document]: The document chunks to add to the vectorstore, produced page by page.
     """
     output_filenames = store_doc_texts(
         bucket=bucket,
         category_id=category_id,
         document_name=document_name,
-        output_bucket=output_bucket
+        output_bucket=output_bucket,
+        stats=stats
     )
     this_doc_chunks = store_doc_chunks(
         bucket=output_bucket,
         documentnames=output_filenames,
         vectorstore=vectorstore,
-        embeddings=embeddings
+        embeddings=embeddings,
+        text_splitter=text_splitter,
+        page_hash_store=page_hash_store,
+        stats=stats
     )
     
     return this_doc_chunks
@@ -115,34 +155,75 @@ def store_doc_chunks(
     bucket: str, 
     documentnames: List[str],
     vectorstore: PGVector, 
-    embeddings: BedrockEmbeddings
-) -> List[Document]:
+    embeddings: BedrockEmbeddings,
+    text_splitter: Optional[ChunkingStrategy] = None,
+    page_hash_store: Optional[PageHashStore] = None,
+    stats: Optional[DocumentStats] = None
+) -> Iterator[Document]:
     """
-    Process text files by splitting them into semantic chunks and adding them to the vectorstore.
+    Process text files by splitting them into chunks and adding them to the vectorstore.
 
     This function downloads each text file (each representing a page of a document) from the specified S3 bucket,
-    uses a semantic text splitter to create chunks, attaches metadata including the source S3 URL and a unique document ID,
-    and then adds these chunks to the vectorstore. After processing, the original text file is deleted from the bucket.
+    uses the configured chunking strategy to create chunks, attaches metadata including the source S3 URL and a unique document ID,
+    and yields these chunks for the vectorstore. After processing, the original text file is deleted from the bucket.
+    Chunks are yielded page by page so that only one page's chunks are held in memory at a time.
+
+    When a `page_hash_store` is given, pages whose text hash matches any page of the previous version of
+    the document yield its stored chunks instead of being chunked again, even if the page moved. Those chunks are unchanged, so `index()`
+    skips them without embedding, and only changed pages are chunked and embedded.
 
     Args:
         bucket (str): The name of the S3 bucket containing the text files.
         documentnames (List[str]): A list of keys for the text files in the bucket.
         vectorstore (PGVector): The vectorstore instance to which document chunks will be added.
         embeddings (BedrockEmbeddings): The embeddings instance used for generating semantic chunks.
+        text_splitter (ChunkingStrategy, optional): The chunking strategy used to split page texts.
+            Defaults to semantic chunking with `embeddings`.
+        page_hash_store (PageHashStore, optional): Store of per-page hashes used to skip unchanged pages.
+        stats (DocumentStats, optional): Statistics of the document's ingestion; receives the time
+            spent reading and chunking pages, and the chunk and reused page counts.
 
-    Returns:
-        List[Document]: A list of document chunks created and added to the vectorstore.
+    Yields:
+        Document: The document chunks created for the vectorstore.
     """
-    text_splitter = SemanticChunker(embeddings)
-    this_doc_chunks = []
+    if text_splitter is None:
+        text_splitter = SemanticChunkingStrategy(embeddings)
+
+    stored_pages = {}
+    source = None
+    if page_hash_store is not None and documentnames:
+        head, _, _ = documentnames[0].partition("_page")
+        source = f"s3://{bucket}/{head}"
+        stored_pages = page_hash_store.get_pages(source)
+    # Chunks are looked up by page text, so pages shifted by an inserted or removed page are reused too
+    stored_chunks = {content_hash: chunks for content_hash, chunks in stored_pages.values()}
+    reused_pages = 0
 
-    for documentname in documentnames:
+    for page_number, documentname in enumerate(documentnames, start=1):
         this_uuid = str(uuid.uuid4())  # Generating one UUID for all chunks from a specific page in the document
-        output_buffer = BytesIO()
-        s3.download_fileobj(bucket, documentname, output_buffer)
-        output_buffer.seek(0)
-        doc_texts = output_buffer.read().decode('utf-8')
-        doc_chunks = text_splitter.create_documents([doc_texts])
+        with stats.timer("extraction") if stats else nullcontext():
+            output_buffer = BytesIO()
+            s3.download_fileobj(bucket, documentname, output_buffer)
+            output_buffer.seek(0)
+            doc_texts = output_buffer.read().decode('utf-8')
+            s3.delete_object(Bucket=bucket, Key=documentname)
+
+        # Reuse the stored chunks of a page whose text has not changed, wherever it moved to
+        this_page_hash = page_hash(doc_texts)
+        if this_page_hash in stored_chunks:
+            reused_chunks = stored_chunks[this_page_hash]
+            if stored_pages.get(page_number, (None,))[0] != this_page_hash:
+                # Pages inserted or removed before it shifted the page, so its entry moves along
+                page_hash_store.put_page(source, page_number, this_page_hash, reused_chunks)
+            reused_pages += 1
+            if stats:
+                stats.add("reused_pages")
+                stats.add("chunk_count", len(reused_chunks))
+            yield from reused_chunks
+            continue
+
+        with stats.timer("chunking") if stats else nullcontext():
+            doc_chunks = text_splitter.create_documents([doc_texts])
         
         head, _, _ = documentname.partition("_page")
         true_filename = head  # Converts 'CourseCode_XXX_-_Course-Name.pdf_page_1.txt' to 'CourseCode_XXX_-_Course-Name.pdf'
@@ -155,27 +236,174 @@ def store_doc_chunks(
                 doc_chunk.metadata["doc_id"] = this_uuid
             else:
                 logger.warning(f"Empty chunk for {documentname}")
+
+        if page_hash_store is not None:
+            page_hash_store.put_page(source, page_number, this_page_hash, doc_chunks)
         
-        s3.delete_object(Bucket=bucket, Key=documentname)
-        
-        this_doc_chunks.extend(doc_chunks)
-       
-    return this_doc_chunks
+        if stats:
+            stats.add("chunk_count", len(doc_chunks))
+        yield from doc_chunks
+
+    if page_hash_store is not None and source:
+        page_hash_store.delete_pages_after(source, len(documentnames))
+        logger.info(f"Reused {reused_pages} of {len(documentnames)} unchanged pages for {source}.")
+
+def delete_stale_records(
+    record_manager: SQLRecordManager,
+    vectorstore: PGVector,
+    source_prefix: str,
+    before: float
+) -> int:
+    """
+    Delete vectors and record manager entries under a source prefix that were not refreshed since `before`.
+
+    This is the category-scoped equivalent of `index(..., cleanup="full")`: after every document in a
+    category has been indexed, records for documents that no longer exist are still older than the
+    start of the run and are removed here.
+
+    Args:
+        record_manager (SQLRecordManager): Manager for maintaining records of documents in the vectorstore.
+        vectorstore (PGVector): The vectorstore instance holding the document chunks.
+        source_prefix (str): Prefix of the `source` metadata of the records to consider, e.g. a category.
+        before (float): Record manager timestamp taken at the start of the run.
+
+    Returns:
+        int: The number of records deleted.
+    """
+    with record_manager.engine.connect() as conn:
+        result = conn.execute(
+            text("""
+                SELECT key FROM upsertion_record
+                WHERE namespace = :namespace
+                AND group_id LIKE :source_prefix
+                AND updated_at < :before;
+            """),
+            {"namespace": record_manager.namespace, "source_prefix": f"{source_prefix}%", "before": before}
+        )
+        stale_keys = [row[0] for row in result]
+
+    if stale_keys:
+        vectorstore.delete(stale_keys)
+        record_manager.delete_keys(stale_keys)
+        delete_fingerprints(record_manager.engine, stale_keys)
+
+    return len(stale_keys)
+
+def index_document(
+    bucket: str,
+    document_key: str,
+    vectorstore: PGVector,
+    embeddings: BedrockEmbeddings,
+    record_manager: SQLRecordManager,
+    text_splitter: ChunkingStrategy,
+    page_hash_store: PageHashStore,
+    stats_store: IngestionStatsStore,
+    size_bytes: Optional[int] = None
+) -> dict:
+    """
+    Extract, chunk, embed and index one document, and record its ingestion statistics.
+
+    The document's chunks are streamed into the vectorstore with an incremental `index()` call,
+    which replaces its previous chunks without touching other documents. The SimHash fingerprints
+    of its new chunks are then stored for the category's deduplication.
+
+    Args:
+        bucket (str): The name of the S3 bucket containing the document.
+        document_key (str): The document's key, `<category_id>/<document_name>.<document_type>`.
+        vectorstore (PGVector): The vectorstore instance for storing document chunks.
+        embeddings (BedrockEmbeddings): The embeddings instance used to generate document embeddings.
+        record_manager (SQLRecordManager): Manager for maintaining records of documents in the vectorstore.
+        text_splitter (ChunkingStrategy): The chunking strategy used to split page texts.
+        page_hash_store (PageHashStore): Store of per-page hashes used to skip unchanged pages.
+        stats_store (IngestionStatsStore): Store of per-document ingestion statistics.
+        size_bytes (int, optional): The size of the document, if known from the bucket listing.
+
+    Returns:
+        dict: The counts of added, updated, skipped and deleted chunks returned by `index()`.
+    """
+    category_id, _, document_name = document_key.partition('/')
+    stats = DocumentStats(document_key, size_bytes)
+    # Chunks are embedded through a wrapper that attributes embedding calls to this document.
+    # It is set on a shallow copy of the vectorstore, which shares its engine, so the vectorstore
+    # shared by concurrent documents is never modified
+    recording_embeddings = StatsRecordingEmbeddings(vectorstore.embedding_function)
+    recording_embeddings.stats = stats
+    document_vectorstore = copy.copy(vectorstore)
+    document_vectorstore.embedding_function = recording_embeddings
+    document_start = time.perf_counter()
+
+    this_doc_chunks = add_document(
+        bucket=bucket,
+        category_id=category_id,
+        document_name=document_name,
+        vectorstore=document_vectorstore,
+        embeddings=embeddings,
+        text_splitter=text_splitter,
+        page_hash_store=page_hash_store,
+        stats=stats
+    )
+
+    # The chunks are consumed lazily, INDEX_BATCH_SIZE at a time
+    idx = index(
+        this_doc_chunks,
+        record_manager,
+        document_vectorstore,
+        cleanup="incremental",
+        source_id_key="source",
+        batch_size=INDEX_BATCH_SIZE
+    )
+    logger.info(f"Indexing updates for {document_key}: \n {idx}")
+
+    if NEAR_DUPLICATE_MAX_DISTANCE >= 0:
+        # Only the document's new chunks are fingerprinted; they are compared by deduplicate_category
+        ChunkDeduplicator(vectorstore, record_manager).fingerprint_new(f"s3://{EMBEDDING_BUCKET_NAME}/{document_key}")
+
+    # Pages are read, chunked and embedded inside index() as the chunks are consumed,
+    # so the index time is what remains of the total
+    total_seconds = time.perf_counter() - document_start
+    stats.set("index_seconds", max(0.0, total_seconds - sum(
+        stats.values[f"{phase}_seconds"] for phase in ("extraction", "chunking", "embedding")
+    )))
+    stats.set("total_seconds", total_seconds)
+    stats.set("model_id", getattr(embeddings, "model_id", None))
+    stats.set("embedding_dimensions", getattr(embeddings, "dimensions", None))
+    stats.set("chunking_strategy", text_splitter.name)
+    for name, count in idx.items():
+        stats.set(name, count)
+    stats_store.put(vectorstore.collection_name, stats)
+    return idx
+
+def deduplicate_category(vectorstore: PGVector, record_manager: SQLRecordManager, category_id: str) -> None:
+    """
+    Collapse passages repeated across a category's documents into one stored chunk.
+
+    Does nothing when NEAR_DUPLICATE_MAX_DISTANCE is negative.
+    """
+    if NEAR_DUPLICATE_MAX_DISTANCE < 0:
+        return
+    deduplicator = ChunkDeduplicator(vectorstore, record_manager)
+    report = deduplicator.deduplicate(f"s3://{EMBEDDING_BUCKET_NAME}/{category_id}/")
+    logger.info(f"Deduplication for category {category_id}: {format_report(report)}")
 
 def process_documents(
     bucket: str,
     category_id: str, 
     vectorstore: PGVector, 
     embeddings: BedrockEmbeddings,
-    record_manager: SQLRecordManager
+    record_manager: SQLRecordManager,
+    chunking_strategy: Optional[str] = None,
+    page_hash_store: Optional[PageHashStore] = None,
+    checkpoint: Optional[IngestionCheckpoint] = None,
+    stats_store: Optional[IngestionStatsStore] = None
 ) -> None:
     """
     Process all documents in a specified category from an S3 bucket and update the vectorstore index.
 
-    This function uses an S3 paginator to iterate through all documents in the given category folder,
-    processes each document by extracting its text and splitting it into chunks (via `add_document`),
-    and then indexes all document chunks in the vectorstore using the provided record manager.
-    If no document chunks are found, a cleanup indexing operation is still performed.
+    This function uses an S3 paginator to iterate through all documents in the given category folder
+    and indexes each of them with `index_document`, so memory use is bounded by one document's index
+    batch rather than the whole category. Records of documents that are no longer in the category are
+    removed at the end of the run, and near-duplicate chunks of different documents are collapsed into
+    one (see `ChunkDeduplicator`) unless NEAR_DUPLICATE_MAX_DISTANCE is negative.
 
     Args:
         bucket (str): The name of the S3 bucket containing the documents.
@@ -183,11 +411,30 @@ def process_documents(
         vectorstore (PGVector): The vectorstore instance for storing document chunks.
         embeddings (BedrockEmbeddings): The embeddings instance used to generate document embeddings.
         record_manager (SQLRecordManager): Manager for maintaining records of documents in the vectorstore.
+        chunking_strategy (str, optional): Name of the chunking strategy ("recursive", "semantic" or "hybrid").
+            Defaults to semantic chunking.
+        page_hash_store (PageHashStore, optional): Store of per-page hashes used to skip unchanged pages.
+            Defaults to a store that reuses every unchanged page.
+        checkpoint (IngestionCheckpoint, optional): Checkpoint of a resumable run. Documents it already
+            indexed are skipped, and the run's original start time bounds the stale record sweep.
+        stats_store (IngestionStatsStore, optional): Store of per-document ingestion statistics.
+            Defaults to the `document_ingestion_stats` table of the vectorstore database.
     """
+    text_splitter = get_chunking_strategy(chunking_strategy, embeddings)
+    logger.info(f"Using '{text_splitter.name}' chunking strategy.")
+    if page_hash_store is None:
+        page_hash_store = PageHashStore(record_manager.engine)
+    if stats_store is None:
+        stats_store = IngestionStatsStore(record_manager.engine)
     
     paginator = s3.get_paginator('list_objects_v2')
     page_iterator = paginator.paginate(Bucket=bucket, Prefix=f"{category_id}/")
-    all_doc_chunks = []
+    run_start = checkpoint.started_at if checkpoint else record_manager.get_time()
+    # ru_maxrss is the high-water mark of the whole container, so in a warm Lambda it can
+    # come from an earlier run; the value at the start of this run is logged beside it.
+    # It is reported in kilobytes on Linux
+    baseline_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    document_count = 0
     
     try:
         for page in page_iterator:
@@ -196,35 +443,47 @@ def process_documents(
             for document in page['Contents']:
                 documentname = document['Key']
 
-                this_doc_chunks = add_document(
+                if checkpoint and checkpoint.is_complete(documentname):
+                    logger.info(f"Skipping {documentname}, already indexed by run {checkpoint.run_id}.")
+                    continue
+
+                index_document(
                     bucket=bucket,
-                    category_id=category_id,
-                    document_name=documentname.split('/')[-1],
+                    document_key=documentname,
                     vectorstore=vectorstore,
-                    embeddings=embeddings
+                    embeddings=embeddings,
+                    record_manager=record_manager,
+                    text_splitter=text_splitter,
+                    page_hash_store=page_hash_store,
+                    stats_store=stats_store,
+                    size_bytes=document.get('Size')
                 )
+                document_count += 1
 
-                all_doc_chunks.extend(this_doc_chunks)
+                if checkpoint:
+                    checkpoint.complete(
+                        documentname,
+                        page_hash_store.count_pages(f"s3://{EMBEDDING_BUCKET_NAME}/{documentname}")
+                    )
 
     except Exception as e:
         logger.error(f"Error processing documents: {e}")
         raise
-    
-    if all_doc_chunks:  # Check if there are any documents to index
-        idx = index(
-            all_doc_chunks, 
-            record_manager, 
-            vectorstore, 
-            cleanup="full",
-            source_id_key="source"
-        )
-        logger.info(f"Indexing updates: \n {idx}")
-    else:
-        idx = index(
-            [],
-            record_manager, 
-            vectorstore, 
-            cleanup="full",
-            source_id_key="source"
-        )
-        logger.info("No documents found for indexing.")
+
+    # Remove chunks of documents that were deleted from this category
+    num_deleted = delete_stale_records(
+        record_manager=record_manager,
+        vectorstore=vectorstore,
+        source_prefix=f"s3://{EMBEDDING_BUCKET_NAME}/{category_id}/",
+        before=run_start
+    )
+
+    deduplicate_category(vectorstore, record_manager, category_id)
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    peak_source = "raised by this run" if peak_rss_mb > baseline_rss_mb else "reached before this run"
+    logger.info(
+        f"Indexed {document_count} documents for category {category_id}, "
+        f"deleted {num_deleted} stale chunks. Container peak RSS: {peak_rss_mb:.1f} MB, "
+        f"{peak_source} (was {baseline_rss_mb:.1f} MB at its start)."
+    )
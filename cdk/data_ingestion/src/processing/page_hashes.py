@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PAGE_HASH_TABLE = "document_page_hashes"
+
+
+def page_hash(page_text: str) -> str:
+    """
+    Return the sha256 hex digest of a page's extracted text.
+    """
+    return hashlib.sha256(page_text.encode("utf-8")).hexdigest()
+
+
+class PageHashStore:
+    """
+    Stores a content hash and the resulting chunks for every page of every ingested document.
+
+    When a document is replaced, pages whose text hash matches a stored page of the document reuse
+    its chunks instead of being chunked and embedded again, so inserting or removing a page only
+    re-embeds that page. The chunks carry no page number, so they are reused unchanged and the
+    stored entry is moved to the page's new number. Replayed chunks hash identically in the record
+    manager, so `index()` skips them, while chunks of changed or removed pages are cleaned up by
+    the incremental index of that document.
+    """
+
+    def __init__(self, engine: Engine, reuse_since: Optional[float] = None):
+        """
+        Args:
+            engine (Engine): SQLAlchemy engine connected to the vectorstore database.
+            reuse_since (float, optional): Only reuse pages stored at or after this epoch timestamp.
+                A rebuild that changes how pages are chunked passes its start time, so pages are
+                re-chunked once per rebuild but not again when an interrupted rebuild resumes.
+        """
+        self.engine = engine
+        self.reuse_since = reuse_since
+
+    def get_pages(self, source: str) -> Dict[int, Tuple[str, List[Document]]]:
+        """
+        Load the stored hash and chunks of every page of a document.
+
+        Args:
+            source (str): The `source` metadata value of the document's chunks.
+
+        Returns:
+            Dict[int, Tuple[str, List[Document]]]: Page number mapped to (content hash, chunks).
+        """
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                text(f"""
+                    SELECT page_number, content_hash, chunks FROM "{PAGE_HASH_TABLE}"
+                    WHERE source = :source
+                    AND (CAST(:reuse_since AS double precision) IS NULL
+                         OR time_updated >= to_timestamp(:reuse_since) AT TIME ZONE 'UTC');
+                """),
+                {"source": source, "reuse_since": self.reuse_since}
+            ).fetchall()
+
+        return {
+            page_number: (
+                content_hash,
+                [Document(page_content=chunk["page_content"], metadata=chunk["metadata"]) for chunk in chunks]
+            )
+            for page_number, content_hash, chunks in rows
+        }
+
+    def put_page(self, source: str, page_number: int, content_hash: str, chunks: List[Document]) -> None:
+        """
+        Store or replace the hash and chunks of one page.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(f"""
+                    INSERT INTO "{PAGE_HASH_TABLE}" (source, page_number, content_hash, chunks, time_updated)
+                    VALUES (:source, :page_number, :content_hash, CAST(:chunks AS jsonb),
+                            now() AT TIME ZONE 'UTC')
+                    ON CONFLICT (source, page_number) DO UPDATE SET
+                        content_hash = EXCLUDED.content_hash,
+                        chunks = EXCLUDED.chunks,
+                        time_updated = EXCLUDED.time_updated;
+                """),
+                {
+                    "source": source,
+                    "page_number": page_number,
+                    "content_hash": content_hash,
+                    "chunks": json.dumps([
+                        {"page_content": chunk.page_content, "metadata": chunk.metadata} for chunk in chunks
+                    ])
+                }
+            )
+
+    def delete_pages_after(self, source: str, page_count: int) -> None:
+        """
+        Delete stored pages beyond the end of a document that got shorter.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(f"""
+                    DELETE FROM "{PAGE_HASH_TABLE}"
+                    WHERE source = :source AND page_number > :page_count;
+                """),
+                {"source": source, "page_count": page_count}
+            )
+
+    def count_pages(self, source: str) -> int:
+        """
+        Return the number of stored pages of a document.
+        """
+        with self.engine.connect() as conn:
+            return conn.execute(
+                text(f'SELECT count(*) FROM "{PAGE_HASH_TABLE}" WHERE source = :source;'),
+                {"source": source}
+            ).scalar()
@@ -0,0 +1,150 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STATS_TABLE = "document_ingestion_stats"
+
+
+class DocumentStats:
+    """
+    Counters and phase durations of the ingestion of one document.
+
+    Durations are wall-clock seconds per phase:
+      - extraction: downloading the document and its page texts and extracting the text
+      - chunking: splitting changed pages, including the embedding calls of semantic chunking
+      - embedding: embedding the chunks that are written to the collection
+      - index: the rest of `index()`, i.e. record manager bookkeeping and database writes
+    """
+
+    def __init__(self, document_key: str, size_bytes: Optional[int] = None):
+        self.document_key = document_key
+        self.values: Dict[str, Any] = {
+            "size_bytes": size_bytes,
+            "content_hash": None,
+            "page_count": 0,
+            "reused_pages": 0,
+            "chunk_count": 0,
+            "embedded_chunks": 0,
+            "embedding_calls": 0,
+            "extraction_seconds": 0.0,
+            "chunking_seconds": 0.0,
+            "embedding_seconds": 0.0,
+            "index_seconds": 0.0,
+        }
+
+    @contextmanager
+    def timer(self, phase: str):
+        """
+        Add the time spent in the block to the phase's duration.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.values[f"{phase}_seconds"] += time.perf_counter() - start
+
+    def add(self, name: str, count: int = 1) -> None:
+        self.values[name] = (self.values.get(name) or 0) + count
+
+    def set(self, name: str, value: Any) -> None:
+        self.values[name] = value
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            name: round(value, 3) if isinstance(value, float) else value
+            for name, value in self.values.items()
+        }
+
+
+class StatsRecordingEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that records the embedding calls of the document being indexed.
+
+    The vectorstore embeds chunks through this wrapper while `stats` points at the current
+    document. Model calls are counted from the cache misses of the calling thread when the
+    underlying embeddings are cached, so cache hits are not reported as calls.
+    """
+
+    def __init__(self, underlying_embeddings: Embeddings):
+        self.underlying_embeddings = underlying_embeddings
+        self.stats: Optional[DocumentStats] = None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.stats is None:
+            return self.underlying_embeddings.embed_documents(texts)
+
+        misses_before = getattr(self.underlying_embeddings, "thread_misses", None)
+        with self.stats.timer("embedding"):
+            vectors = self.underlying_embeddings.embed_documents(texts)
+        self.stats.add("embedded_chunks", len(texts))
+        if misses_before is None:
+            self.stats.add("embedding_calls", len(texts))
+        else:
+            self.stats.add("embedding_calls", self.underlying_embeddings.thread_misses - misses_before)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying_embeddings.embed_query(text)
+
+
+class IngestionStatsStore:
+    """
+    Stores the statistics of the latest ingestion of each document, per vector collection.
+
+    Rows reference the `documents` table and are deleted with their document. They are kept
+    apart from `documents.metadata`, which holds the description entered by administrators.
+    """
+
+    def __init__(self, engine: Engine):
+        """
+        Args:
+            engine (Engine): SQLAlchemy engine connected to the application database.
+        """
+        self.engine = engine
+
+    def put(self, collection_name: str, stats: DocumentStats) -> None:
+        """
+        Store or replace the statistics of a document's latest ingestion into a collection.
+
+        Documents that are not registered in the `documents` table are skipped.
+
+        Args:
+            collection_name (str): The vector collection the document was indexed into.
+            stats (DocumentStats): The statistics, keyed by the document's `<category_id>/<name>.<type>` key.
+        """
+        category_id, _, filename = stats.document_key.partition("/")
+        document_name, _, document_type = filename.rpartition(".")
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(
+                    text(f"""
+                        INSERT INTO "{STATS_TABLE}" (document_id, collection_name, stats, time_updated)
+                        SELECT document_id, :collection_name, CAST(:stats AS jsonb), now() AT TIME ZONE 'UTC'
+                        FROM "documents"
+                        WHERE category_id = CAST(:category_id AS uuid)
+                        AND document_name = :document_name AND document_type = :document_type
+                        ON CONFLICT (document_id, collection_name) DO UPDATE SET
+                            stats = EXCLUDED.stats,
+                            time_updated = EXCLUDED.time_updated;
+                    """),
+                    {
+                        "collection_name": collection_name,
+                        "stats": json.dumps(stats.as_dict()),
+                        "category_id": category_id,
+                        "document_name": document_name,
+                        "document_type": document_type,
+                    }
+                )
+        except Exception as e:
+            # Statistics are informational, so a failure to store them never fails ingestion
+            logger.error(f"Error storing ingestion statistics for {stats.document_key}: {e}")
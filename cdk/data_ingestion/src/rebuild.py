@@ -0,0 +1,250 @@
+"""
+Rebuild the DLS vector collection from the documents in the data ingestion bucket.
+
+One, several or all categories are re-ingested with `store_category_data` by a pool of
+workers. Progress is checkpointed per document in the `ingestion_checkpoints` table, so a
+run that is interrupted can be started again with the same `--run-id` and continues where
+it stopped. There are no separate category or page checkpoints: a category is done when
+all of its documents are, and a document that was interrupted is extracted again from the
+start. Its pages that were already indexed are not embedded or written again, because the
+page hash table replays their chunks, the embedding cache serves their vectors and the
+record manager skips chunks it already holds.
+
+With `--shadow`, every category is written to a new collection while the live collection
+keeps serving queries. When all categories are indexed, the shadow collection is swapped
+in under the live name in a single transaction, and the previous collection is kept under
+a `_retired_<run_id>` name unless `--drop-retired` is given. This is how the embedding
+model is switched without downtime: rebuild into a shadow collection with `--model-id`.
+Each collection records the model it was embedded with, so ingestion and text generation
+follow the swap; update the EmbeddingModelId parameter afterwards for comparison uploads.
+See migration.py for switching models with dual-written collections instead of a swap.
+
+The script uses the same environment variables as the data ingestion Lambda function and
+must be able to reach the database, e.g. by running the data ingestion image inside the VPC:
+
+    python rebuild.py --all --shadow --model-id amazon.titan-embed-text-v2:0 --workers 4
+    python rebuild.py --categories <category_id> <category_id>
+    python rebuild.py --all --shadow --run-id 20250101120000   # resume an interrupted run
+"""
+import argparse
+import json
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import List
+
+from langchain.indexes import SQLRecordManager
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from helpers.helper import store_category_data
+from helpers.quantization import INDEX_TYPES
+from main import (
+    DSA_DATA_INGESTION_BUCKET,
+    RDS_PROXY_ENDPOINT,
+    connect_to_db,
+    create_vectorstore_engine,
+    get_cached_embeddings,
+    get_chunking_strategy,
+    get_collection_metadata,
+    get_parameter,
+    get_secret,
+)
+from processing.checkpoint import IngestionCheckpoint
+from processing.page_hashes import PageHashStore
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LIVE_COLLECTION = "all"
+
+
+def list_categories() -> List[str]:
+    """
+    Return the id of every category in the database.
+    """
+    connection = connect_to_db()
+    with connection.cursor() as cur:
+        cur.execute('SELECT category_id FROM "categories" ORDER BY category_number;')
+        categories = [str(row[0]) for row in cur.fetchall()]
+    connection.commit()
+    return categories
+
+
+def swap_collections(engine: Engine, live: str, shadow: str, retired: str) -> None:
+    """
+    Atomically replace the live collection with the shadow collection.
+
+    Collections are looked up by name on every query, so renaming them in one transaction
+    switches readers and writers over at once. The record manager namespaces are renamed
+    along with them, so later incremental ingestion keeps working against the new collection.
+
+    Args:
+        engine (Engine): SQLAlchemy engine connected to the vectorstore database.
+        live (str): Name of the collection currently serving queries.
+        shadow (str): Name of the rebuilt collection.
+        retired (str): New name for the previous live collection.
+    """
+    with engine.begin() as conn:
+        shadow_exists = conn.execute(
+            text("SELECT 1 FROM langchain_pg_collection WHERE name = :name;"),
+            {"name": shadow}
+        ).first()
+        if not shadow_exists:
+            raise ValueError(f"Shadow collection '{shadow}' does not exist; nothing to swap in.")
+
+        for old_name, new_name in ((live, retired), (shadow, live)):
+            conn.execute(
+                text("UPDATE langchain_pg_collection SET name = :new_name WHERE name = :old_name;"),
+                {"old_name": old_name, "new_name": new_name}
+            )
+            conn.execute(
+                text("UPDATE upsertion_record SET namespace = :new_namespace WHERE namespace = :old_namespace;"),
+                {"old_namespace": f"pgvector/{old_name}", "new_namespace": f"pgvector/{new_name}"}
+            )
+    logger.info(f"Swapped collection '{shadow}' in as '{live}'; previous collection kept as '{retired}'.")
+
+
+def drop_collection(engine: Engine, name: str) -> None:
+    """
+    Delete a collection, its embeddings and its record manager entries.
+    """
+    with engine.begin() as conn:
+        # Embeddings are deleted by the ON DELETE CASCADE of their collection
+        conn.execute(text("DELETE FROM langchain_pg_collection WHERE name = :name;"), {"name": name})
+        conn.execute(text("DELETE FROM upsertion_record WHERE namespace = :namespace;"), {"namespace": f"pgvector/{name}"})
+    logger.info(f"Dropped collection '{name}'.")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--categories", nargs="+", help="Ids of the categories to rebuild")
+    target.add_argument("--all", action="store_true", help="Rebuild every category")
+    parser.add_argument("--workers", type=int, default=4, help="Number of categories rebuilt concurrently")
+    parser.add_argument("--run-id", help="Id of the run; pass the id of an interrupted run to resume it")
+    parser.add_argument("--collection", default=LIVE_COLLECTION, help="Name of the live collection")
+    parser.add_argument("--shadow", action="store_true", help="Build a shadow collection and swap it in when complete")
+    parser.add_argument("--drop-retired", action="store_true", help="Delete the previous collection after the swap")
+    parser.add_argument("--model-id", help="Embedding model id; defaults to the collection's model")
+    parser.add_argument("--dimensions", type=int, help="Reduced embedding dimension; defaults to the collection's")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, help="Quantized index; defaults to the collection's")
+    parser.add_argument("--chunking-strategy", help="Chunking strategy; defaults to the ChunkingStrategy parameter")
+    parser.add_argument("--rechunk", action="store_true", help="Chunk every page again instead of reusing stored chunks")
+    args = parser.parse_args(argv)
+
+    if args.shadow and not args.all:
+        # Categories that are not rebuilt would be missing from the swapped-in collection
+        parser.error("--shadow requires --all")
+    if args.drop_retired and not args.shadow:
+        parser.error("--drop-retired requires --shadow")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    run_id = args.run_id or datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    target_collection = f"{args.collection}_rebuild_{run_id}" if args.shadow else args.collection
+    collection_metadata = get_collection_metadata(args.collection)
+    requested = {
+        "embedding_model_id": args.model_id,
+        "embedding_dimensions": args.dimensions,
+        "index_type": args.index_type,
+    }
+    for key, value in requested.items():
+        recorded = collection_metadata.get(key)
+        if value and recorded and value != recorded and not args.shadow:
+            # Mixing models or dimensions in one collection makes its vectors incomparable
+            logger.error(
+                f"Collection '{args.collection}' has {key} {recorded}; use --shadow to rebuild it with {value}."
+            )
+            return 2
+    model_id = args.model_id or collection_metadata.get("embedding_model_id") or get_parameter()
+    dimensions = args.dimensions or collection_metadata.get("embedding_dimensions")
+    index_type = args.index_type or collection_metadata.get("index_type") or "none"
+    chunking_strategy = args.chunking_strategy or get_chunking_strategy()
+
+    secret = get_secret()
+    vectorstore_config_dict = {
+        'collection_name': target_collection,
+        'dbname': secret["dbname"],
+        'user': secret["username"],
+        'password': secret["password"],
+        'host': RDS_PROXY_ENDPOINT,
+        'port': secret["port"]
+    }
+    engine = create_vectorstore_engine()
+
+    record_manager = SQLRecordManager(f"pgvector/{target_collection}", engine=engine)
+    record_manager.create_schema()
+
+    checkpoint = IngestionCheckpoint(engine, run_id)
+    checkpoint.start(
+        target_collection=target_collection,
+        started_at=record_manager.get_time(),
+        options=json.dumps({
+            "model_id": model_id,
+            "dimensions": dimensions,
+            "index_type": index_type,
+            "chunking_strategy": chunking_strategy,
+            "rechunk": args.rechunk
+        })
+    )
+    logger.info(f"Rebuild run {run_id} writing to collection '{target_collection}'.")
+
+    # Pages chunked by this run are reused when it resumes, even with --rechunk
+    page_hash_store = PageHashStore(engine, reuse_since=checkpoint.started_at if args.rechunk else None)
+
+    embeddings = get_cached_embeddings(model_id, dimensions)
+
+    categories = list_categories() if args.all else args.categories
+    failed_categories = []
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(
+                store_category_data,
+                bucket=DSA_DATA_INGESTION_BUCKET,
+                category_id=category_id,
+                vectorstore_config_dict=vectorstore_config_dict,
+                embeddings=embeddings,
+                chunking_strategy=chunking_strategy,
+                page_hash_store=page_hash_store,
+                checkpoint=checkpoint,
+                index_type=index_type
+            ): category_id
+            for category_id in categories
+        }
+        for future in as_completed(futures):
+            category_id = futures[future]
+            try:
+                future.result()
+                logger.info(f"Rebuilt category {category_id}.")
+            except Exception as e:
+                logger.error(f"Error rebuilding category {category_id}: {e}")
+                failed_categories.append(category_id)
+
+    logger.info(f"Embedding cache hits: {embeddings.hits}, misses: {embeddings.misses}.")
+    embeddings.evict()
+
+    if failed_categories:
+        logger.error(
+            f"{len(failed_categories)} of {len(categories)} categories failed. "
+            f"Run again with --run-id {run_id} to resume."
+        )
+        return 1
+
+    if args.shadow:
+        retired_collection = f"{args.collection}_retired_{run_id}"
+        swap_collections(engine, args.collection, target_collection, retired_collection)
+        if args.drop_retired:
+            drop_collection(engine, retired_collection)
+
+    checkpoint.finish(record_manager.get_time())
+    logger.info(f"Rebuild run {run_id} completed for {len(categories)} categories.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Ingestion worker: indexes one document per job from the ingestion worker queue.
+
+The data ingestion handler in main.py acts as the coordinator. For each category in a batch
+of S3 events it creates an ingestion batch and enqueues one job per changed document. Workers
+run in parallel across Lambda instances, so the time to ingest a large category is bounded by
+its largest document rather than the sum of its documents, and a document that cannot be
+ingested fails on its own.
+
+The worker that finishes the last job of a batch runs the category's cleanup: near-duplicate
+chunks are collapsed and the quantized index is created if it is missing. Documents removed
+from the bucket are not looked for, since their chunks are deleted by the deletion event.
+Jobs that fail INGESTION_MAX_ATTEMPTS times are recorded as failed in the batch and do not
+hold back the cleanup, and a cleanup that fails FINALIZE_MAX_ATTEMPTS times is recorded as
+failed in the batch. Messages that keep failing after that are moved to the worker queue's
+dead-letter queue.
+"""
+import json
+import logging
+import os
+import zlib
+from contextlib import contextmanager
+
+import boto3
+from botocore.exceptions import ClientError
+from sqlalchemy import text
+
+from helpers.helper import finalize_category_data, store_document_data
+from main import (
+    RDS_PROXY_ENDPOINT,
+    get_cached_embeddings,
+    get_chunking_strategy,
+    get_embedding_targets,
+    get_secret,
+    get_vectorstore_engine,
+)
+from processing.batches import IngestionBatchStore
+
+# Set up basic logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger()
+
+INGESTION_MAX_ATTEMPTS = int(os.environ.get("INGESTION_MAX_ATTEMPTS", "3"))
+FINALIZE_MAX_ATTEMPTS = int(os.environ.get("FINALIZE_MAX_ATTEMPTS", "3"))
+
+s3 = boto3.client('s3')
+
+
+def get_vectorstore_config(collection_name):
+    secret = get_secret()
+    return {
+        'collection_name': collection_name,
+        'dbname': secret["dbname"],
+        'user': secret["username"],
+        'password': secret["password"],
+        'host': RDS_PROXY_ENDPOINT,
+        'port': secret["port"]
+    }
+
+
+@contextmanager
+def document_lock(document_key):
+    """
+    Hold a database advisory lock on a document while it is indexed.
+
+    Jobs of successive batches can index the same document at the same time when it is
+    uploaded again quickly; the lock makes them run one after the other.
+    """
+    with get_vectorstore_engine().connect() as conn:
+        lock_id = zlib.crc32(document_key.encode("utf-8"))
+        conn.execute(text("SELECT pg_advisory_lock(:lock_id);"), {"lock_id": lock_id})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:lock_id);"), {"lock_id": lock_id})
+            conn.commit()
+
+
+def document_exists(bucket, document_key):
+    try:
+        s3.head_object(Bucket=bucket, Key=document_key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return False
+        raise
+
+
+def index_document_job(bucket, document_key):
+    """
+    Index a document into every collection currently written by data ingestion.
+    """
+    chunking_strategy = get_chunking_strategy()
+    with document_lock(document_key):
+        if not document_exists(bucket, document_key):
+            # Deleted after the job was enqueued; its chunks were removed by the deletion event
+            logger.info(f"Skipping {document_key}, which is no longer in the bucket.")
+            return
+        for target in get_embedding_targets():
+            embeddings = get_cached_embeddings(target["model_id"], target["dimensions"])
+            store_document_data(
+                bucket=bucket,
+                document_key=document_key,
+                vectorstore_config_dict=get_vectorstore_config(target["collection"]),
+                embeddings=embeddings,
+                chunking_strategy=chunking_strategy,
+                index_type=target["index_type"]
+            )
+            logger.info(
+                f"Indexed {document_key} into {target['collection']}; embedding cache hits: "
+                f"{embeddings.hits}, misses: {embeddings.misses}."
+            )
+
+
+def finalize_batch(batch_store, batch_id, category_id):
+    """
+    Run the category's cleanup if this worker finished the last job of the batch.
+    """
+    attempt = batch_store.claim_finalize(batch_id)
+    if not attempt:
+        return
+    if attempt > FINALIZE_MAX_ATTEMPTS:
+        # The previous attempt did not finish, e.g. the function timed out
+        batch_store.fail_finalize(batch_id, "Maximum attempts exceeded.")
+        logger.error(f"Giving up on finalizing ingestion batch {batch_id} for category {category_id}.")
+        return
+
+    try:
+        for target in get_embedding_targets():
+            embeddings = get_cached_embeddings(target["model_id"], target["dimensions"])
+            finalize_category_data(
+                category_id=category_id,
+                vectorstore_config_dict=get_vectorstore_config(target["collection"]),
+                embeddings=embeddings,
+                index_type=target["index_type"]
+            )
+            embeddings.maybe_evict()
+    except Exception as e:
+        if attempt < FINALIZE_MAX_ATTEMPTS:
+            batch_store.release_finalize(batch_id)
+            raise
+        logger.error(f"Giving up on finalizing ingestion batch {batch_id} after {attempt} attempts: {e}")
+        batch_store.fail_finalize(batch_id, str(e))
+        return
+
+    batch_store.mark_finalized(batch_id)
+    logger.info(f"Finalized ingestion batch {batch_id} for category {category_id}.")
+
+
+def handler(event, context):
+    batch_store = IngestionBatchStore(get_vectorstore_engine())
+    failed_items = []
+
+    for record in event.get('Records', []):
+        item_identifier = record.get('messageId')
+        job = json.loads(record['body'])
+        batch_id, bucket, category_id, document_key = (
+            job["batchId"], job["bucketName"], job["categoryId"], job["filePath"]
+        )
+        attempt = int(record.get('attributes', {}).get('ApproximateReceiveCount', 1))
+
+        try:
+            if attempt > INGESTION_MAX_ATTEMPTS:
+                # The previous attempt did not finish, e.g. the function timed out
+                batch_store.finish_job(batch_id, document_key, failed=True, error="Maximum attempts exceeded.")
+            else:
+                try:
+                    index_document_job(bucket, document_key)
+                    batch_store.finish_job(batch_id, document_key)
+                except Exception as e:
+                    if attempt < INGESTION_MAX_ATTEMPTS:
+                        raise
+                    logger.error(f"Giving up on {document_key} after {attempt} attempts: {e}")
+                    batch_store.finish_job(batch_id, document_key, failed=True, error=str(e))
+
+            finalize_batch(batch_store, batch_id, category_id)
+        except Exception as e:
+            logger.error(f"Error processing ingestion job {item_identifier} for {document_key}: {e}")
+            failed_items.append(item_identifier)
+
+    # Report failures so that only the failed jobs are redelivered by SQS
+    return {
+        "batchItemFailures": [{"itemIdentifier": item} for item in failed_items]
+    }
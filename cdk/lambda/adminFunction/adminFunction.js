@@ -423,49 +423,29 @@ exports.handler = async (event) => {
           const { metadata } = JSON.parse(event.body);
 
           try {
-            // Query to find the document with the given category_id, document_name, and document_type
-            const existingDocument = await sqlConnectionTableCreator`
-        SELECT * FROM documents
-        WHERE category_id = ${categoryId}
-        AND document_name = ${documentName}
-        AND document_type = ${documentType};
+            // Insert the document's row or update its metadata in one statement
+            const result = await sqlConnectionTableCreator`
+        INSERT INTO documents (document_id, category_id, document_s3_file_path, document_name, document_type, metadata, time_created)
+        VALUES (uuid_generate_v4(), ${categoryId}, NULL, ${documentName}, ${documentType}, ${metadata}, CURRENT_TIMESTAMP)
+        ON CONFLICT (category_id, document_name, document_type)
+        DO UPDATE SET metadata = EXCLUDED.metadata
+        RETURNING *, (xmax = 0) AS inserted;
       `;
 
-            if (existingDocument.length === 0) {
-              // If document does not exist, insert a new entry
-              const result = await sqlConnectionTableCreator`
-          INSERT INTO documents (document_id, category_id, document_s3_file_path, document_name, document_type, metadata, time_created)
-          VALUES (uuid_generate_v4(), ${categoryId}, NULL, ${documentName}, ${documentType}, ${metadata}, CURRENT_TIMESTAMP)
-          RETURNING *;
-        `;
-              response.statusCode = 201;
+            if (result.length > 0) {
+              const { inserted, ...document } = result[0];
+              response.statusCode = inserted ? 201 : 200;
               response.body = JSON.stringify({
-                message: "Document metadata added successfully",
-                document: result[0],
+                message: inserted
+                  ? "Document metadata added successfully"
+                  : "Document metadata updated successfully",
+                document: document,
               });
             } else {
-              // Update the metadata field for an existing document
-              const result = await sqlConnectionTableCreator`
-          UPDATE documents
-          SET metadata = ${metadata}
-          WHERE category_id = ${categoryId}
-          AND document_name = ${documentName}
-          AND document_type = ${documentType}
-          RETURNING *;
-        `;
-
-              if (result.length > 0) {
-                response.statusCode = 200;
-                response.body = JSON.stringify({
-                  message: "Document metadata updated successfully",
-                  document: result[0],
-                });
-              } else {
-                response.statusCode = 500;
-                response.body = JSON.stringify({
-                  error: "Failed to update metadata.",
-                });
-              }
+              response.statusCode = 500;
+              response.body = JSON.stringify({
+                error: "Failed to update metadata.",
+              });
             }
           } catch (err) {
             response.statusCode = 500;
@@ -5,6 +5,8 @@ from aws_lambda_powertools import Logger
 
 BUCKET = os.environ["BUCKET"]
 REGION = os.environ["REGION"]
+# Bucket holding the comparison session manifests read by comparison data ingestion
+EMBEDDING_BUCKET_NAME = os.environ.get("EMBEDDING_BUCKET_NAME")
 
 s3 = boto3.client(
     "s3",
@@ -35,6 +37,7 @@ def lambda_handler(event, context):
     session_id = query_params.get("session_id", "")
     document_type = query_params.get("document_type", "")
     document_name = query_params.get("document_name", "")
+    expected_files = query_params.get("expected_files", "")
 
     if not session_id:
         return {
@@ -76,6 +79,13 @@ def lambda_handler(event, context):
     })
 
     try:
+        if EMBEDDING_BUCKET_NAME:
+            # Lets ingestion send a single notification once every file of the upload is ready
+            s3.put_object(
+                Bucket=EMBEDDING_BUCKET_NAME,
+                Key=f"comparison-sessions/{session_id}/expected/{document_name}.{document_type}",
+                Body=expected_files if expected_files.isdigit() else ""
+            )
 
         presigned_url = s3.generate_presigned_url(
             ClientMethod="put_object",
@@ -10,6 +10,7 @@ s3 = boto3.client('s3')
 BUCKET = os.environ["BUCKET"]
 DB_SECRET_NAME = os.environ["SM_DB_CREDENTIALS"]
 RDS_PROXY_ENDPOINT = os.environ["RDS_PROXY_ENDPOINT"]
+EMBEDDING_BUCKET_NAME = os.environ["EMBEDDING_BUCKET_NAME"]
 
 # AWS Clients
 secrets_manager_client = boto3.client('secretsmanager')
@@ -76,6 +77,51 @@ def delete_document_from_db(category_id):
         raise
 
 
+def delete_category_embeddings(category_id):
+    """
+    Delete the chunks of every document in the category from every vector collection,
+    along with their record manager entries. Chunks are matched on the `source` metadata
+    prefix, which is backed by a text_pattern_ops expression index.
+    """
+    connection = connect_to_db()
+    source_prefix = f"s3://{EMBEDDING_BUCKET_NAME}/{category_id}/%"
+
+    try:
+        cur = connection.cursor()
+
+        # The vector tables are created by the first data ingestion run
+        cur.execute(
+            "SELECT to_regclass('langchain_pg_embedding'), to_regclass('upsertion_record'), "
+            "to_regclass('document_page_hashes'), to_regclass('chunk_duplicates'), "
+            "to_regclass('chunk_fingerprints');"
+        )
+        embedding_table, record_table, page_hash_table, duplicate_table, fingerprint_table = cur.fetchone()
+
+        deleted = 0
+        if embedding_table:
+            cur.execute("DELETE FROM langchain_pg_embedding WHERE cmetadata->>'source' LIKE %s;", (source_prefix,))
+            deleted = cur.rowcount
+        if record_table:
+            cur.execute("DELETE FROM upsertion_record WHERE group_id LIKE %s;", (source_prefix,))
+        if page_hash_table:
+            cur.execute("DELETE FROM document_page_hashes WHERE source LIKE %s;", (source_prefix,))
+        if duplicate_table:
+            cur.execute("DELETE FROM chunk_duplicates WHERE source LIKE %s;", (source_prefix,))
+        if fingerprint_table:
+            cur.execute("DELETE FROM chunk_fingerprints WHERE source LIKE %s;", (source_prefix,))
+
+        connection.commit()
+        logger.info(f"Deleted {deleted} embeddings for category {category_id}.")
+
+        cur.close()
+    except Exception as e:
+        if cur:
+            cur.close()
+        connection.rollback()
+        logger.error(f"Error deleting embeddings for category {category_id}: {e}")
+        raise
+
+
 @logger.inject_lambda_context
 def lambda_handler(event, context):
     query_params = event.get("queryStringParameters", {})
@@ -98,6 +144,7 @@ def lambda_handler(event, context):
     try:
         delete_document_from_db(category_id)
         logger.info(f"category {category_id} deleted from the database.")
+        delete_category_embeddings(category_id)
     except Exception as e:
         logger.error(f"Error deletingcategory {category_id} from the database: {e}")
         return {
@@ -10,6 +10,7 @@ s3 = boto3.client('s3')
 BUCKET = os.environ["BUCKET"]
 DB_SECRET_NAME = os.environ["SM_DB_CREDENTIALS"]
 RDS_PROXY_ENDPOINT = os.environ["RDS_PROXY_ENDPOINT"]
+EMBEDDING_BUCKET_NAME = os.environ["EMBEDDING_BUCKET_NAME"]
 
 # AWS Clients
 secrets_manager_client = boto3.client('secretsmanager')
@@ -79,6 +80,50 @@ def delete_document_from_db(category_id, document_name, document_type):
         raise
 
 
+def delete_document_embeddings(category_id, document_name, document_type):
+    """
+    Delete the document's chunks from every vector collection and its record manager entries.
+    Chunks are matched on their `source` metadata, which is backed by an expression index.
+    """
+    connection = connect_to_db()
+    source = f"s3://{EMBEDDING_BUCKET_NAME}/{category_id}/{document_name}.{document_type}"
+
+    try:
+        cur = connection.cursor()
+
+        # The vector tables are created by the first data ingestion run
+        cur.execute(
+            "SELECT to_regclass('langchain_pg_embedding'), to_regclass('upsertion_record'), "
+            "to_regclass('document_page_hashes'), to_regclass('chunk_duplicates'), "
+            "to_regclass('chunk_fingerprints');"
+        )
+        embedding_table, record_table, page_hash_table, duplicate_table, fingerprint_table = cur.fetchone()
+
+        deleted = 0
+        if embedding_table:
+            cur.execute("DELETE FROM langchain_pg_embedding WHERE cmetadata->>'source' = %s;", (source,))
+            deleted = cur.rowcount
+        if record_table:
+            cur.execute("DELETE FROM upsertion_record WHERE group_id = %s;", (source,))
+        if page_hash_table:
+            cur.execute("DELETE FROM document_page_hashes WHERE source = %s;", (source,))
+        if duplicate_table:
+            cur.execute("DELETE FROM chunk_duplicates WHERE source = %s;", (source,))
+        if fingerprint_table:
+            cur.execute("DELETE FROM chunk_fingerprints WHERE source = %s;", (source,))
+
+        connection.commit()
+        logger.info(f"Deleted {deleted} embeddings for {source}.")
+
+        cur.close()
+    except Exception as e:
+        if cur:
+            cur.close()
+        connection.rollback()
+        logger.error(f"Error deleting embeddings for {source}: {e}")
+        raise
+
+
 @logger.inject_lambda_context
 def lambda_handler(event, context):
     query_params = event.get("queryStringParameters", {})
@@ -142,6 +187,7 @@ def lambda_handler(event, context):
         try:
             delete_document_from_db(category_id, document_name, document_type)
             logger.info(f"File {document_name}.{document_type} deleted from the database.")
+            delete_document_embeddings(category_id, document_name, document_type)
         except Exception as e:
             logger.error(f"Error deleting file {document_name}.{document_type} from the database: {e}")
             return {
@@ -105,34 +105,82 @@ def generate_presigned_url(bucket, key):
         logger.exception(f"Error generating presigned URL for {key}: {e}")
         return None
 
-def get_document_metadata_from_db(category_id, document_name, document_type):
+def get_documents_metadata_from_db(category_id):
+    """
+    Return the metadata of every document in a category with one query.
+
+    Returns:
+        dict: "<document_name>.<document_type>" mapped to the document's metadata.
+    """
     connection = connect_to_db()
     if connection is None:
         logger.error("No database connection available.")
-        return None
+        return {}
 
+    cur = None
     try:
         cur = connection.cursor()
         query = """
-            SELECT metadata 
-            FROM "documents" 
-            WHERE category_id = %s AND document_name = %s AND document_type = %s;
+            SELECT document_name, document_type, metadata
+            FROM "documents"
+            WHERE category_id = %s;
         """
-        cur.execute(query, (category_id, document_name, document_type))
-        result = cur.fetchone()
+        cur.execute(query, (category_id,))
+        documents_metadata = {
+            f"{document_name}.{document_type}": metadata
+            for document_name, document_type, metadata in cur.fetchall()
+        }
         cur.close()
-        if result:
-            return result[0]
-        else:
-            logger.warning(f"No metadata found for {document_name}.{document_type}.")
-            return None
+        connection.commit()
+        return documents_metadata
 
     except Exception as e:
-        logger.error(f"Error retrieving metadata for {document_name}.{document_type}: {e}")
+        logger.error(f"Error retrieving metadata for category {category_id}: {e}")
         if cur:
             cur.close()
         connection.rollback()
-        return None
+        return {}
+
+def get_ingestion_stats_from_db(category_id):
+    """
+    Return the statistics of the latest ingestion of each document in a category.
+
+    Returns:
+        dict: "<document_name>.<document_type>" mapped to the statistics of each vector
+              collection the document was ingested into, with the time they were recorded.
+    """
+    connection = connect_to_db()
+    if connection is None:
+        logger.error("No database connection available.")
+        return {}
+
+    cur = None
+    try:
+        cur = connection.cursor()
+        # The statistics table is created by the initializer, with the documents table
+        query = """
+            SELECT d.document_name, d.document_type, s.collection_name, s.stats, s.time_updated
+            FROM "document_ingestion_stats" s
+            JOIN "documents" d ON d.document_id = s.document_id
+            WHERE d.category_id = %s;
+        """
+        cur.execute(query, (category_id,))
+        ingestion_stats = {}
+        for document_name, document_type, collection_name, stats, time_updated in cur.fetchall():
+            ingestion_stats.setdefault(f"{document_name}.{document_type}", {})[collection_name] = {
+                **stats,
+                "time_updated": time_updated.isoformat()
+            }
+        cur.close()
+        connection.commit()
+        return ingestion_stats
+
+    except Exception as e:
+        logger.error(f"Error retrieving ingestion statistics for category {category_id}: {e}")
+        if cur:
+            cur.close()
+        connection.rollback()
+        return {}
 
 @logger.inject_lambda_context
 def lambda_handler(event, context):
@@ -156,13 +204,17 @@ def lambda_handler(event, context):
         document_list = list_documents_in_s3_prefix(BUCKET, document_prefix)
 
         document_list_urls = {}
+        documents_metadata = get_documents_metadata_from_db(category_id)
+        ingestion_stats = get_ingestion_stats_from_db(category_id)
         for document_name in document_list:
-            document_type = document_name.split('.')[-1]
             presigned_url = generate_presigned_url(BUCKET, f"{document_prefix}{document_name}")
-            metadata = get_document_metadata_from_db(category_id, document_name.split('.')[0], document_type)
+            metadata = documents_metadata.get(document_name)
+            if metadata is None:
+                logger.warning(f"No metadata found for {document_name}.")
             document_list_urls[f"{document_name}"] = {
                 "url": presigned_url,
-                "metadata": metadata
+                "metadata": metadata,
+                "ingestion_stats": ingestion_stats.get(document_name)
             }
 
         logger.info("Presigned URLs and metadata generated successfully", extra={
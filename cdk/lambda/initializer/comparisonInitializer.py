@@ -50,6 +50,16 @@ def handler(event, context):
         sqlTableCreation = """
             CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
             CREATE EXTENSION IF NOT EXISTS "vector";
+
+            CREATE TABLE IF NOT EXISTS "embedding_cache" (
+                "model_id" varchar NOT NULL,
+                "content_hash" char(64) NOT NULL,
+                "embedding" float4[] NOT NULL,
+                "last_used" timestamp NOT NULL DEFAULT now(),
+                PRIMARY KEY ("model_id", "content_hash")
+            );
+            CREATE INDEX IF NOT EXISTS "embedding_cache_last_used_idx"
+                ON "embedding_cache" ("last_used");
         """
 
         #
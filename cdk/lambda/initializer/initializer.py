@@ -81,6 +81,13 @@ def handler(event, context):
                 body text,
                 timestamp timestamp
             );
+            CREATE TABLE IF NOT EXISTS "guideline_embeddings" (
+                "model_id" varchar NOT NULL,
+                "content_hash" char(64) NOT NULL,
+                "embedding" float4[] NOT NULL,
+                "created_at" timestamp NOT NULL DEFAULT now(),
+                PRIMARY KEY ("model_id", "content_hash")
+            );
             CREATE TABLE IF NOT EXISTS "users" (
                 "user_id" uuid PRIMARY KEY DEFAULT uuid_generate_v4(),
                 "user_email" varchar,
@@ -148,8 +155,120 @@ def handler(event, context):
 
             ALTER TABLE "documents" 
                 ADD FOREIGN KEY ("category_id") 
-                REFERENCES "categories" ("category_id") 
+                REFERENCES "categories" ("category_id")
                 ON DELETE CASCADE ON UPDATE CASCADE;
+
+            -- Keep one row per document before enforcing uniqueness, preferring rows
+            -- with metadata entered by an administrator and then the latest upload
+            DELETE FROM "documents"
+            WHERE document_id IN (
+                SELECT document_id FROM (
+                    SELECT document_id, row_number() OVER (
+                        PARTITION BY category_id, document_name, document_type
+                        ORDER BY COALESCE(metadata, '') <> '' DESC, time_created DESC NULLS LAST
+                    ) AS row_number
+                    FROM "documents"
+                ) ranked
+                WHERE ranked.row_number > 1
+            );
+
+            CREATE UNIQUE INDEX IF NOT EXISTS "documents_category_name_type_idx"
+                ON "documents" ("category_id", "document_name", "document_type");
+
+            -- Data ingestion state. The langchain_pg_* tables are created by the first
+            -- ingestion run, so collections are referenced by uuid without a foreign key.
+            CREATE TABLE IF NOT EXISTS "embedding_cache" (
+                "model_id" varchar NOT NULL,
+                "content_hash" char(64) NOT NULL,
+                "embedding" float4[] NOT NULL,
+                "last_used" timestamp NOT NULL DEFAULT now(),
+                PRIMARY KEY ("model_id", "content_hash")
+            );
+            CREATE INDEX IF NOT EXISTS "embedding_cache_last_used_idx"
+                ON "embedding_cache" ("last_used");
+
+            CREATE TABLE IF NOT EXISTS "document_page_hashes" (
+                "source" varchar NOT NULL,
+                "page_number" integer NOT NULL,
+                "content_hash" char(64) NOT NULL,
+                "chunks" jsonb NOT NULL,
+                "time_updated" timestamp NOT NULL DEFAULT (now() AT TIME ZONE 'UTC'),
+                PRIMARY KEY ("source", "page_number")
+            );
+
+            CREATE TABLE IF NOT EXISTS "ingestion_runs" (
+                "run_id" varchar PRIMARY KEY,
+                "target_collection" varchar NOT NULL,
+                "started_at" double precision NOT NULL,
+                "completed_at" double precision,
+                "options" jsonb NOT NULL DEFAULT '{}'::jsonb
+            );
+            CREATE TABLE IF NOT EXISTS "ingestion_checkpoints" (
+                "run_id" varchar NOT NULL REFERENCES "ingestion_runs" ("run_id") ON DELETE CASCADE,
+                "category_id" varchar NOT NULL,
+                "document" varchar NOT NULL,
+                "pages" integer NOT NULL,
+                "time_completed" timestamp NOT NULL DEFAULT (now() AT TIME ZONE 'UTC'),
+                PRIMARY KEY ("run_id", "category_id", "document")
+            );
+
+            CREATE TABLE IF NOT EXISTS "chunk_duplicates" (
+                "collection_id" uuid NOT NULL,
+                "key" varchar NOT NULL,
+                "canonical_key" varchar NOT NULL,
+                "source" varchar NOT NULL,
+                "document" varchar,
+                "cmetadata" jsonb,
+                PRIMARY KEY ("collection_id", "key")
+            );
+            CREATE INDEX IF NOT EXISTS "chunk_duplicates_canonical_idx"
+                ON "chunk_duplicates" ("collection_id", "canonical_key");
+            CREATE INDEX IF NOT EXISTS "chunk_duplicates_source_idx"
+                ON "chunk_duplicates" ("source" text_pattern_ops);
+            CREATE TABLE IF NOT EXISTS "chunk_fingerprints" (
+                "collection_id" uuid NOT NULL,
+                "key" varchar NOT NULL,
+                "source" varchar NOT NULL,
+                "fingerprint" bigint,
+                "max_distance" smallint NOT NULL,
+                "bands" bigint[] NOT NULL,
+                "checked" boolean NOT NULL DEFAULT false,
+                PRIMARY KEY ("collection_id", "key")
+            );
+            CREATE INDEX IF NOT EXISTS "chunk_fingerprints_bands_idx"
+                ON "chunk_fingerprints" USING gin ("bands");
+            CREATE INDEX IF NOT EXISTS "chunk_fingerprints_source_idx"
+                ON "chunk_fingerprints" ("source" text_pattern_ops);
+
+            CREATE TABLE IF NOT EXISTS "document_ingestion_stats" (
+                "document_id" uuid NOT NULL REFERENCES "documents" ("document_id") ON DELETE CASCADE,
+                "collection_name" varchar NOT NULL,
+                "stats" jsonb NOT NULL,
+                "time_updated" timestamp NOT NULL DEFAULT (now() AT TIME ZONE 'UTC'),
+                PRIMARY KEY ("document_id", "collection_name")
+            );
+
+            CREATE TABLE IF NOT EXISTS "ingestion_batches" (
+                "batch_id" uuid PRIMARY KEY,
+                "category_id" varchar NOT NULL,
+                "bucket" varchar NOT NULL,
+                "total_jobs" integer NOT NULL,
+                "completed_jobs" integer NOT NULL DEFAULT 0,
+                "failed_jobs" integer NOT NULL DEFAULT 0,
+                "time_created" timestamp NOT NULL DEFAULT (now() AT TIME ZONE 'UTC'),
+                "time_finalize_claimed" timestamp,
+                "finalize_attempts" integer NOT NULL DEFAULT 0,
+                "finalize_error" text,
+                "time_finalized" timestamp
+            );
+            CREATE TABLE IF NOT EXISTS "ingestion_batch_jobs" (
+                "batch_id" uuid NOT NULL REFERENCES "ingestion_batches" ("batch_id") ON DELETE CASCADE,
+                "document_key" varchar NOT NULL,
+                "status" varchar NOT NULL DEFAULT 'pending',
+                "error" text,
+                "time_updated" timestamp NOT NULL DEFAULT (now() AT TIME ZONE 'UTC'),
+                PRIMARY KEY ("batch_id", "document_key")
+            );
         """
 
         #
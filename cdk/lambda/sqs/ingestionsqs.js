@@ -0,0 +1,53 @@
+const { SQSClient, SendMessageCommand } = require("@aws-sdk/client-sqs");
+const crypto = require("crypto");
+
+// Initialize SQS client
+const sqsClient = new SQSClient({ region: process.env.AWS_REGION });
+
+exports.handler = async (event, context) => {
+  try {
+    for (const record of event.Records) {
+      const fullKey = decodeURIComponent(
+        record.s3.object.key.replace(/\+/g, " ")
+      );
+
+      // Files are stored as {category_id}/{document_name}.{document_type}
+      const pathParts = fullKey.split("/");
+      const categoryId = pathParts.length > 1 ? pathParts[0] : "unknown";
+
+      const message = {
+        eventName: record.eventName,
+        bucketName: record.s3.bucket.name,
+        filePath: fullKey,
+        categoryId: categoryId,
+      };
+
+      const params = {
+        QueueUrl: process.env.SQS_QUEUE_URL,
+        MessageBody: JSON.stringify(message),
+        // Grouping by category means only one batch per category is in flight,
+        // so bursts of uploads to a category are coalesced into a single reindex
+        MessageGroupId: categoryId,
+        // The S3 sequencer is unique per object change, so S3 notification retries are deduplicated
+        MessageDeduplicationId: crypto
+          .createHash("sha256")
+          .update(`${fullKey}-${record.s3.object.sequencer || Date.now()}`)
+          .digest("hex"),
+      };
+
+      // Send message to SQS
+      const command = new SendMessageCommand(params);
+      await sqsClient.send(command);
+    }
+
+    return {
+      statusCode: 200,
+      body: JSON.stringify({ message: "Successfully processed S3 events" }),
+    };
+  } catch (error) {
+    console.error("Error processing S3 event:", error);
+    // S3 invokes this function asynchronously, so returning would drop the event;
+    // throwing has Lambda retry it
+    throw error;
+  }
+};
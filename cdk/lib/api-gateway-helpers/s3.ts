@@ -21,6 +21,13 @@ export const createS3Buckets = (scope: Construct, id: string) => {
     removalPolicy: cdk.RemovalPolicy.DESTROY,
     enforceSSL: true,
     autoDeleteObjects: true,
+    lifecycleRules: [
+      {
+        // Vectors of comparison sessions that were never evaluated
+        prefix: "comparison-sessions/",
+        expiration: cdk.Duration.days(1),
+      },
+    ],
   });
 
   const dataIngestionBucket = new s3.Bucket(scope, `${id}-DataIngestionBucket`, {
@@ -94,6 +94,56 @@ export class ApiGatewayStack extends cdk.Stack {
       visibilityTimeout: cdk.Duration.seconds(900),
     });
 
+    // Create FIFO SQS Queue
+    // Messages are grouped by category and delayed briefly so that bursts of
+    // S3 events for one category are delivered to data ingestion as one batch
+    const dataIngestionQueue = new sqs.Queue(
+      this,
+      `${id}-DataIngestionQueue`,
+      {
+        queueName: `${id}-data-ingestion-queue.fifo`,
+        fifo: true,
+        removalPolicy: cdk.RemovalPolicy.DESTROY,
+        visibilityTimeout: cdk.Duration.seconds(900),
+        deliveryDelay: cdk.Duration.seconds(30),
+      }
+    );
+
+    // Attempts a worker makes at indexing a document and at running a batch's
+    // cleanup before recording them as failed
+    const ingestionMaxAttempts = 3;
+    const finalizeMaxAttempts = 3;
+
+    // Jobs that are still failing once the worker has recorded them as failed
+    // are moved here instead of being redelivered forever
+    const dataIngestionWorkerDLQ = new sqs.Queue(
+      this,
+      `${id}-DataIngestionWorkerDLQ`,
+      {
+        queueName: `${id}-data-ingestion-worker-dlq`,
+        removalPolicy: cdk.RemovalPolicy.DESTROY,
+        retentionPeriod: cdk.Duration.days(14),
+      }
+    );
+
+    // Create standard SQS Queue
+    // One message per changed document, consumed in parallel by the ingestion workers
+    const dataIngestionWorkerQueue = new sqs.Queue(
+      this,
+      `${id}-DataIngestionWorkerQueue`,
+      {
+        queueName: `${id}-data-ingestion-worker-queue`,
+        removalPolicy: cdk.RemovalPolicy.DESTROY,
+        visibilityTimeout: cdk.Duration.seconds(900),
+        deadLetterQueue: {
+          queue: dataIngestionWorkerDLQ,
+          // Leaves room for the indexing attempts, the attempt that records the job
+          // as failed and the cleanup attempts of the batch
+          maxReceiveCount: ingestionMaxAttempts + finalizeMaxAttempts + 1,
+        },
+      }
+    );
+
     const { jwt, postgres, psycopgLayer } = createLayers(this, id);
     this.layerList["psycopg2"] = psycopgLayer;
     this.layerList["postgres"] = postgres;
@@ -834,6 +884,40 @@ export class ApiGatewayStack extends cdk.Stack {
       }
     );
 
+    const chunkingStrategyParameter = new ssm.StringParameter(
+      this,
+      "ChunkingStrategyParameter",
+      {
+        parameterName: `/${id}/DSA/ChunkingStrategy`,
+        description:
+          "Parameter containing the data ingestion chunking strategy (recursive, semantic or hybrid)",
+        stringValue: "semantic",
+      }
+    );
+
+    // The collection that serves queries, and the collection and model that ingestion
+    // additionally writes to while an embedding model migration is in progress
+    const embeddingCollectionParameter = new ssm.StringParameter(
+      this,
+      "EmbeddingCollectionParameter",
+      {
+        parameterName: `/${id}/DSA/EmbeddingCollection`,
+        description: "Parameter containing the live vectorstore collection name",
+        stringValue: "all",
+      }
+    );
+
+    const embeddingMigrationParameter = new ssm.StringParameter(
+      this,
+      "EmbeddingMigrationParameter",
+      {
+        parameterName: `/${id}/DSA/EmbeddingMigration`,
+        description:
+          'Parameter containing the embedding model migration target as {"collection": ..., "model_id": ...}, or none',
+        stringValue: "none",
+      }
+    );
+
     const tableNameParameter = new ssm.StringParameter(
       this,
       "TableNameParameter",
@@ -844,6 +928,19 @@ export class ApiGatewayStack extends cdk.Stack {
       }
     );
 
+    // Resolved by comparison data ingestion on its first cold start, so the guardrail
+    // is not looked up or created again for every upload
+    const comparisonGuardrailParameter = new ssm.StringParameter(
+      this,
+      "ComparisonGuardrailParameter",
+      {
+        parameterName: `/${id}/DSA/ComparisonGuardrail`,
+        description:
+          'Parameter containing the comparison guardrail as {"id": ..., "version": ...}, or none',
+        stringValue: "none",
+      }
+    );
+
     const documentCompFunc = new lambda.DockerImageFunction(
       this,
       `${id}-documentCompFunction`,
@@ -864,11 +961,37 @@ export class ApiGatewayStack extends cdk.Stack {
           TABLE_NAME_PARAM: tableNameParameter.parameterName,
           COMP_TEXT_GEN_QUEUE_URL: compTextGenQueue.queueUrl,
           APPSYNC_API_URL: this.compTextGenApi.graphqlUrl,
-          API_KEY: "API_KEY"
+          API_KEY: "API_KEY",
+          COMPARISON_VECTORSTORE: "ephemeral",
+          EMBEDDING_BUCKET_NAME: embeddingStorageBucket.bucketName,
+          EVALUATION_CONCURRENCY: "4",
+          EVALUATION_GROUP_SIZE: "4",
         },
       }
     );
 
+    // Comparison sessions' vectors are read from the embedding bucket and deleted after the evaluation
+    documentCompFunc.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ["s3:GetObject", "s3:DeleteObject"],
+        resources: [
+          `arn:aws:s3:::${embeddingStorageBucket.bucketName}/comparison-sessions/*`,
+        ],
+      })
+    );
+    // The session's ingestion manifest is listed and deleted with its vectors
+    documentCompFunc.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ["s3:ListBucket"],
+        resources: [embeddingStorageBucket.bucketArn],
+        conditions: {
+          StringLike: { "s3:prefix": ["comparison-sessions/*"] },
+        },
+      })
+    );
+
     documentCompFunc.addToRolePolicy(
       new iam.PolicyStatement({
         effect: iam.Effect.ALLOW,
@@ -949,6 +1072,7 @@ export class ApiGatewayStack extends cdk.Stack {
           REGION: this.region,
           BEDROCK_LLM_PARAM: bedrockLLMParameter.parameterName,
           EMBEDDING_MODEL_PARAM: embeddingModelParameter.parameterName,
+          EMBEDDING_COLLECTION_PARAM: embeddingCollectionParameter.parameterName,
           TABLE_NAME_PARAM: tableNameParameter.parameterName,
           COMP_TEXT_GEN_QUEUE_URL: compTextGenQueue.queueUrl,
         },
@@ -1072,6 +1196,7 @@ export class ApiGatewayStack extends cdk.Stack {
         resources: [
           bedrockLLMParameter.parameterArn,
           embeddingModelParameter.parameterArn,
+          embeddingCollectionParameter.parameterArn,
           tableNameParameter.parameterArn,
         ],
       })
@@ -1102,6 +1227,7 @@ export class ApiGatewayStack extends cdk.Stack {
         environment: {
           BUCKET: comparisonBucket.bucketName,
           REGION: this.region,
+          EMBEDDING_BUCKET_NAME: embeddingStorageBucket.bucketName,
         },
         functionName: `${id}-ComparisonPreSignedURLFunc`,
         layers: [powertoolsLayer],
@@ -1116,6 +1242,15 @@ export class ApiGatewayStack extends cdk.Stack {
 
     // Grant the Lambda function the necessary permissions
     comparisonBucket.grantReadWrite(comparisonGeneratePreSignedURL);
+    // Records the files expected in each comparison session
+    comparisonGeneratePreSignedURL.addToRolePolicy(
+      new iam.PolicyStatement({
+        actions: ["s3:PutObject"],
+        resources: [
+          `arn:aws:s3:::${embeddingStorageBucket.bucketName}/comparison-sessions/*`,
+        ],
+      })
+    );
     comparisonGeneratePreSignedURL.addToRolePolicy(
       new iam.PolicyStatement({
         actions: ["s3:PutObject", "s3:GetObject"],
@@ -1240,6 +1375,13 @@ export class ApiGatewayStack extends cdk.Stack {
           REGION: this.region,
           EMBEDDING_BUCKET_NAME: embeddingStorageBucket.bucketName,
           EMBEDDING_MODEL_PARAM: embeddingModelParameter.parameterName,
+          GUARDRAIL_PARAM: comparisonGuardrailParameter.parameterName,
+          GUARDRAIL_CONCURRENCY: "4",
+          GUARDRAIL_PIPELINE: "true",
+          COMPARISON_VECTORSTORE: "ephemeral",
+          // Keeps comparison ingestion off the database; "true" caches embeddings there
+          COMPARISON_EMBEDDING_CACHE: "false",
+          COMPARISON_MAX_ATTEMPTS: "1",
           EVENT_NOTIFICATION_LAMBDA_NAME: notificationFunction.functionName,
           APPSYNC_API_URL: this.eventApi.graphqlUrl,
           APPSYNC_API_ID: this.eventApi.apiId,
@@ -1256,6 +1398,7 @@ export class ApiGatewayStack extends cdk.Stack {
           "bedrock:CreateGuardrailVersion",
           "bedrock:DeleteGuardrail", // Permission to create guardrails
           "bedrock:ListGuardrails",  // (Optional) To list existing guardrails
+          "bedrock:GetGuardrail", // To wait until a created guardrail is ready
           "bedrock:InvokeGuardrail",
           "bedrock:ApplyGuardrail"  // (Optional) To invoke the guardrail for filtering
         ],
@@ -1298,6 +1441,8 @@ export class ApiGatewayStack extends cdk.Stack {
     comparisonDataIngestFunction.addEventSource(
       new lambdaEventSources.SqsEventSource(comparisonQueue, {
         batchSize: 5,
+        // Failed files are redelivered up to COMPARISON_MAX_ATTEMPTS times
+        reportBatchItemFailures: true,
       })
     );
 
@@ -1353,7 +1498,19 @@ export class ApiGatewayStack extends cdk.Stack {
       new iam.PolicyStatement({
         effect: iam.Effect.ALLOW,
         actions: ["ssm:GetParameter"],
-        resources: [embeddingModelParameter.parameterArn],
+        resources: [
+          embeddingModelParameter.parameterArn,
+          comparisonGuardrailParameter.parameterArn,
+        ],
+      })
+    );
+
+    // The guardrail is stored in the parameter once it has been resolved
+    comparisonDataIngestFunction.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ["ssm:PutParameter"],
+        resources: [comparisonGuardrailParameter.parameterArn],
       })
     );
 
@@ -1424,6 +1581,45 @@ export class ApiGatewayStack extends cdk.Stack {
           REGION: this.region,
           EMBEDDING_BUCKET_NAME: embeddingStorageBucket.bucketName,
           EMBEDDING_MODEL_PARAM: embeddingModelParameter.parameterName,
+          CHUNKING_STRATEGY_PARAM: chunkingStrategyParameter.parameterName,
+          EMBEDDING_COLLECTION_PARAM: embeddingCollectionParameter.parameterName,
+          EMBEDDING_MIGRATION_PARAM: embeddingMigrationParameter.parameterName,
+          INGESTION_WORKER_QUEUE_URL: dataIngestionWorkerQueue.queueUrl,
+        },
+      }
+    );
+
+    /**
+     *
+     * Create Lambda with the data ingestion container image that indexes one document per job.
+     * The data ingestion function enqueues a job for every changed document of a category,
+     * and the worker that finishes the last job of a batch runs the category's cleanup.
+     * The worker shares the data ingestion function's role and therefore its permissions.
+     */
+    const dataIngestWorkerFunction = new lambda.DockerImageFunction(
+      this,
+      `${id}-DataIngestWorkerFunction`,
+      {
+        code: lambda.DockerImageCode.fromImageAsset("./data_ingestion", {
+          cmd: ["worker.handler"],
+        }),
+        memorySize: 2048,
+        timeout: cdk.Duration.seconds(900),
+        vpc: vpcStack.vpc, // Pass the VPC
+        functionName: `${id}-DataIngestWorkerFunction`,
+        role: dataIngestFunction.role,
+        environment: {
+          SM_DB_CREDENTIALS: db.secretPathAdminName,
+          RDS_PROXY_ENDPOINT: db.rdsProxyEndpointAdmin,
+          BUCKET: dataIngestionBucket.bucketName,
+          REGION: this.region,
+          EMBEDDING_BUCKET_NAME: embeddingStorageBucket.bucketName,
+          EMBEDDING_MODEL_PARAM: embeddingModelParameter.parameterName,
+          CHUNKING_STRATEGY_PARAM: chunkingStrategyParameter.parameterName,
+          EMBEDDING_COLLECTION_PARAM: embeddingCollectionParameter.parameterName,
+          EMBEDDING_MIGRATION_PARAM: embeddingMigrationParameter.parameterName,
+          INGESTION_MAX_ATTEMPTS: String(ingestionMaxAttempts),
+          FINALIZE_MAX_ATTEMPTS: String(finalizeMaxAttempts),
         },
       }
     );
@@ -1471,7 +1667,25 @@ export class ApiGatewayStack extends cdk.Stack {
     dataIngestFunction.addToRolePolicy(bedrockPolicyStatement);
     // dataIngestFunction.addToRolePolicy(inferencePolicyStatement);
 
-    dataIngestFunction.addEventSource(
+    // Forward S3 events to the data ingestion queue, grouped by category
+    const dataIngestionSqsFunction = new lambda.Function(
+      this,
+      `${id}-DataIngestionSqsFunction`,
+      {
+        runtime: lambda.Runtime.NODEJS_20_X,
+        handler: "ingestionsqs.handler",
+        memorySize: 512,
+        code: lambda.Code.fromAsset("lambda/sqs"),
+        timeout: cdk.Duration.seconds(900),
+        environment: {
+          SQS_QUEUE_URL: dataIngestionQueue.queueUrl,
+        },
+        vpc: vpcStack.vpc,
+        role: coglambdaRole,
+      }
+    );
+
+    dataIngestionSqsFunction.addEventSource(
       new lambdaEventSources.S3EventSource(dataIngestionBucket, {
         events: [
           s3.EventType.OBJECT_CREATED,
@@ -1481,6 +1695,30 @@ export class ApiGatewayStack extends cdk.Stack {
       })
     );
 
+    dataIngestionQueue.grantSendMessages(dataIngestionSqsFunction);
+
+    dataIngestFunction.addEventSource(
+      new lambdaEventSources.SqsEventSource(dataIngestionQueue, {
+        batchSize: 10,
+        reportBatchItemFailures: true,
+      })
+    );
+
+    dataIngestionQueue.grantConsumeMessages(dataIngestFunction);
+
+    dataIngestionWorkerQueue.grantSendMessages(dataIngestFunction);
+
+    // One document per invocation; concurrency is capped to protect the database and Bedrock quotas
+    dataIngestWorkerFunction.addEventSource(
+      new lambdaEventSources.SqsEventSource(dataIngestionWorkerQueue, {
+        batchSize: 1,
+        maxConcurrency: 10,
+        reportBatchItemFailures: true,
+      })
+    );
+
+    dataIngestionWorkerQueue.grantConsumeMessages(dataIngestWorkerFunction);
+
     // Grant access to Secret Manager
     dataIngestFunction.addToRolePolicy(
       new iam.PolicyStatement({
@@ -1499,8 +1737,13 @@ export class ApiGatewayStack extends cdk.Stack {
     dataIngestFunction.addToRolePolicy(
       new iam.PolicyStatement({
         effect: iam.Effect.ALLOW,
-        actions: ["ssm:GetParameter"],
-        resources: [embeddingModelParameter.parameterArn],
+        actions: ["ssm:GetParameter", "ssm:GetParameters"],
+        resources: [
+          embeddingModelParameter.parameterArn,
+          chunkingStrategyParameter.parameterArn,
+          embeddingCollectionParameter.parameterArn,
+          embeddingMigrationParameter.parameterArn,
+        ],
       })
     );
 
@@ -1578,6 +1821,7 @@ export class ApiGatewayStack extends cdk.Stack {
           RDS_PROXY_ENDPOINT: db.rdsProxyEndpoint, // RDS Proxy Endpoint
           BUCKET: dataIngestionBucket.bucketName,
           REGION: this.region,
+          EMBEDDING_BUCKET_NAME: embeddingStorageBucket.bucketName,
         },
         functionName: `${id}-DeleteDocumentFunc`,
         layers: [psycopgLayer, powertoolsLayer],
@@ -1721,6 +1965,7 @@ export class ApiGatewayStack extends cdk.Stack {
           RDS_PROXY_ENDPOINT: db.rdsProxyEndpoint, // RDS Proxy Endpoint
           BUCKET: dataIngestionBucket.bucketName,
           REGION: this.region,
+          EMBEDDING_BUCKET_NAME: embeddingStorageBucket.bucketName,
         },
         functionName: `${id}-DeleteCategoryFunc`,
         layers: [psycopgLayer, powertoolsLayer],
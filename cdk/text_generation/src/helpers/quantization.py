@@ -0,0 +1,132 @@
+import logging
+import os
+import uuid
+from typing import Any, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_postgres import PGVector
+from pydantic import ConfigDict
+from sqlalchemy import text
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "none" searches the full float32 vectors without an index, as PGVector does by default.
+# "halfvec" and "binary" add a per-collection HNSW index on a half-precision or binary-quantized
+# copy of the vectors, which is searched first and then reranked exactly on the full vectors.
+# The indexes are created by data ingestion; this module only searches through them.
+INDEX_TYPES = ("none", "halfvec", "binary")
+# Number of first-pass candidates per requested result that are reranked on the full vectors
+QUANTIZED_RERANK_FACTOR = int(os.environ.get("QUANTIZED_RERANK_FACTOR", "4"))
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+
+
+def _collection_literal(collection_uuid: Any) -> str:
+    # Partial indexes are only used when the query repeats their predicate with the same
+    # literal, so the collection id is inlined after being validated as a UUID
+    return f"'{uuid.UUID(str(collection_uuid))}'"
+
+
+def _first_pass_order(index_type: str, dimensions: int) -> str:
+    """
+    Return the ORDER BY expression of the first pass, matching the index expression.
+    """
+    if index_type == "halfvec":
+        return f"(embedding::halfvec({dimensions})) <=> CAST(:query AS halfvec({dimensions}))"
+    if index_type == "binary":
+        return (
+            f"(binary_quantize(embedding)::bit({dimensions})) "
+            f"<~> binary_quantize(CAST(:query AS vector))::bit({dimensions})"
+        )
+    return "embedding <=> CAST(:query AS vector)"
+
+
+def quantized_search(
+    vectorstore: PGVector,
+    query_embedding: List[float],
+    k: int = 4,
+    index_type: str = "none",
+    dimensions: Optional[int] = None,
+    rerank_factor: int = QUANTIZED_RERANK_FACTOR
+) -> List[Tuple[Document, float]]:
+    """
+    Search a collection by cosine distance, using its quantized index for a first pass.
+
+    With a quantized index, the `k * rerank_factor` nearest candidates by half-precision or
+    Hamming distance are fetched through the index and reranked by exact cosine distance on
+    the full vectors. With "none", the full vectors are searched directly.
+
+    Args:
+        vectorstore (PGVector): The vectorstore of the collection.
+        query_embedding (List[float]): The embedded query.
+        k (int): Number of results.
+        index_type (str): One of INDEX_TYPES.
+        dimensions (int, optional): The vector dimension; defaults to the query's dimension.
+        rerank_factor (int): First-pass candidates per result.
+
+    Returns:
+        List[Tuple[Document, float]]: The documents and their cosine distances, nearest first.
+    """
+    index_type = index_type or "none"
+    dimensions = dimensions or len(query_embedding)
+    candidates = k if index_type == "none" else k * rerank_factor
+
+    with vectorstore._make_sync_session() as session:
+        collection = vectorstore.get_collection(session)
+        if not collection:
+            return []
+
+        # HNSW returns at most ef_search rows, so it must cover the candidate count
+        session.execute(text(f"SET LOCAL hnsw.ef_search = {max(40, int(candidates))};"))
+        rows = session.execute(
+            text(f"""
+                SELECT document, cmetadata, distance FROM (
+                    SELECT document, cmetadata, embedding <=> CAST(:query AS vector) AS distance
+                    FROM {EMBEDDING_TABLE}
+                    WHERE collection_id = {_collection_literal(collection.uuid)}
+                    ORDER BY {_first_pass_order(index_type, dimensions)}
+                    LIMIT :candidates
+                ) AS first_pass
+                ORDER BY distance
+                LIMIT :k;
+            """),
+            {"query": str(list(query_embedding)), "candidates": candidates, "k": k}
+        ).fetchall()
+        session.commit()
+
+    return [
+        (Document(page_content=document, metadata=cmetadata or {}), distance)
+        for document, cmetadata, distance in rows
+    ]
+
+
+class QuantizedPGVectorRetriever(BaseRetriever):
+    """
+    Retriever that searches a PGVector collection through its quantized index with exact rerank.
+    """
+
+    vectorstore: PGVector
+    k: int = 4
+    index_type: str = "none"
+    dimensions: Optional[int] = None
+    rerank_factor: int = QUANTIZED_RERANK_FACTOR
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        query_embedding = self.vectorstore.embeddings.embed_query(query)
+        results = quantized_search(
+            vectorstore=self.vectorstore,
+            query_embedding=query_embedding,
+            k=self.k,
+            index_type=self.index_type,
+            dimensions=self.dimensions,
+            rerank_factor=self.rerank_factor
+        )
+        return [document for document, _ in results]
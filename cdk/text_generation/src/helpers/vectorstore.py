@@ -1,15 +1,18 @@
-from typing import Dict
+from typing import Dict, Optional
 
 from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import create_history_aware_retriever
 
 from helpers.helper import get_vectorstore
+from helpers.quantization import QuantizedPGVectorRetriever
 
 def get_vectorstore_retriever(
     llm,
     vectorstore_config_dict: Dict[str, str],
-    embeddings#: BedrockEmbeddings
+    embeddings,#: BedrockEmbeddings
+    index_type: Optional[str] = None,
+    dimensions: Optional[int] = None
 ) -> VectorStoreRetriever:
     """
     Retrieve the vectorstore and return the history-aware retriever object.
@@ -18,6 +21,9 @@ def get_vectorstore_retriever(
         llm: The language model instance used to generate the response.
         vectorstore_config_dict (Dict[str, str]): The configuration dictionary for the vectorstore, including parameters like collection name, database name, user, password, host, and port.
         embeddings (BedrockEmbeddings): The embeddings instance used to process the documents.
+        index_type (str, optional): Quantized index of the collection ("none", "halfvec" or "binary").
+            Collections with a quantized index are searched through it and reranked on the full vectors.
+        dimensions (int, optional): The embedding dimension of the collection.
 
     Returns:
         VectorStoreRetriever: A history-aware retriever instance.
@@ -32,7 +38,14 @@ def get_vectorstore_retriever(
         port=int(vectorstore_config_dict['port'])
     )
 
-    retriever = vectorstore.as_retriever()
+    if index_type and index_type != "none":
+        retriever = QuantizedPGVectorRetriever(
+            vectorstore=vectorstore,
+            index_type=index_type,
+            dimensions=dimensions
+        )
+    else:
+        retriever = vectorstore.as_retriever()
     # Contextualize question and create history-aware retriever
     contextualize_q_system_prompt = (
         "Given a chat history and the latest user question "
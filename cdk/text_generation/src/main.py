@@ -23,6 +23,9 @@ RDS_PROXY_ENDPOINT = os.environ["RDS_PROXY_ENDPOINT"]
 BEDROCK_LLM_PARAM = os.environ["BEDROCK_LLM_PARAM"]
 EMBEDDING_MODEL_PARAM = os.environ["EMBEDDING_MODEL_PARAM"]
 TABLE_NAME_PARAM = os.environ["TABLE_NAME_PARAM"]
+EMBEDDING_COLLECTION_PARAM = os.environ.get("EMBEDDING_COLLECTION_PARAM")
+# How long the live collection and its embedding model are cached before being read again
+EMBEDDING_CONFIG_TTL_SECONDS = int(os.environ.get("EMBEDDING_CONFIG_TTL_SECONDS", "300"))
 # AWS Clients
 sqs = boto3.client('sqs')
 secrets_manager_client = boto3.client("secretsmanager")
@@ -34,6 +37,10 @@ db_secret = None
 BEDROCK_LLM_ID = None
 EMBEDDING_MODEL_ID = None
 TABLE_NAME = None
+EMBEDDING_COLLECTION = None
+EMBEDDING_DIMENSIONS = None
+EMBEDDING_INDEX_TYPE = None
+embedding_config_expires_at = 0
 # Cached embeddings instance
 embeddings = None
 
@@ -65,17 +72,70 @@ def get_parameter(param_name, cached_var):
     return cached_var
 
 
-def initialize_constants():
-    global BEDROCK_LLM_ID, EMBEDDING_MODEL_ID, TABLE_NAME, embeddings
-    BEDROCK_LLM_ID = get_parameter(BEDROCK_LLM_PARAM, BEDROCK_LLM_ID)
-    EMBEDDING_MODEL_ID = get_parameter(EMBEDDING_MODEL_PARAM, EMBEDDING_MODEL_ID)
-    TABLE_NAME = get_parameter(TABLE_NAME_PARAM, TABLE_NAME)
-    if embeddings is None:
+def get_collection_metadata(collection_name):
+    """
+    Return the metadata of a collection: the embedding model id, the embedding dimension and
+    the index type it was created with. Empty for collections created before it was recorded.
+    """
+    connection = connect_to_db()
+    cur = None
+    try:
+        cur = connection.cursor()
+        cur.execute("SELECT to_regclass('langchain_pg_collection');")
+        if cur.fetchone()[0] is None:
+            row = None
+        else:
+            cur.execute("SELECT cmetadata FROM langchain_pg_collection WHERE name = %s;", (collection_name,))
+            row = cur.fetchone()
+        connection.commit()
+    except Exception as e:
+        logger.error(f"Error fetching the metadata of collection {collection_name}: {e}")
+        connection.rollback()
+        row = None
+    finally:
+        if cur:
+            cur.close()
+    return (row[0] if row else None) or {}
+
+
+def refresh_embedding_config():
+    """
+    Re-read the live collection and its embedding settings once the cached values expire.
+
+    An embedding model migration switches the EmbeddingCollection parameter at cutover; the
+    model, dimension and index type are read from the collection itself, so queries are always
+    embedded and searched the way the collection was built, and warm containers pick up the
+    switch within the TTL.
+    """
+    global EMBEDDING_COLLECTION, EMBEDDING_MODEL_ID, EMBEDDING_DIMENSIONS, EMBEDDING_INDEX_TYPE
+    global embeddings, embedding_config_expires_at
+    if embeddings is not None and time.time() < embedding_config_expires_at:
+        return
+
+    collection = get_parameter(EMBEDDING_COLLECTION_PARAM, None) if EMBEDDING_COLLECTION_PARAM else "all"
+    collection_metadata = get_collection_metadata(collection)
+    model_id = collection_metadata.get("embedding_model_id") or get_parameter(EMBEDDING_MODEL_PARAM, None)
+    dimensions = collection_metadata.get("embedding_dimensions")
+    if embeddings is None or model_id != EMBEDDING_MODEL_ID or dimensions != EMBEDDING_DIMENSIONS:
+        logger.info(f"Using collection {collection} with embedding model {model_id} ({dimensions or 'full'} dimensions).")
         embeddings = BedrockEmbeddings(
-            model_id=EMBEDDING_MODEL_ID,
+            model_id=model_id,
             client=bedrock_runtime,
             region_name=REGION,
+            model_kwargs={"dimensions": dimensions} if dimensions else None,
         )
+    EMBEDDING_COLLECTION = collection
+    EMBEDDING_MODEL_ID = model_id
+    EMBEDDING_DIMENSIONS = dimensions
+    EMBEDDING_INDEX_TYPE = collection_metadata.get("index_type") or "none"
+    embedding_config_expires_at = time.time() + EMBEDDING_CONFIG_TTL_SECONDS
+
+
+def initialize_constants():
+    global BEDROCK_LLM_ID, TABLE_NAME
+    BEDROCK_LLM_ID = get_parameter(BEDROCK_LLM_PARAM, BEDROCK_LLM_ID)
+    TABLE_NAME = get_parameter(TABLE_NAME_PARAM, TABLE_NAME)
+    refresh_embedding_config()
     
     create_dynamodb_history_table(TABLE_NAME)
 
@@ -469,7 +529,7 @@ def handler(event, context):
         logger.info("Retrieving vectorstore config.")
         db_secret = get_secret(DB_SECRET_NAME)
         vectorstore_config_dict = {
-            'collection_name': "all",
+            'collection_name': EMBEDDING_COLLECTION,
             'dbname': db_secret["dbname"],
             'user': db_secret["username"],
             'password': db_secret["password"],
@@ -507,7 +567,9 @@ def handler(event, context):
         history_aware_retriever = get_vectorstore_retriever(
             llm=llm,
             vectorstore_config_dict=vectorstore_config_dict,
-            embeddings=embeddings
+            embeddings=embeddings,
+            index_type=EMBEDDING_INDEX_TYPE,
+            dimensions=EMBEDDING_DIMENSIONS
         )
 
 
@@ -14,13 +14,14 @@ export const removeFileExtension = (fileName) => {
   return fileName.split(".").slice(0, -1).join(".");
 };
 
-export const generatePresignedUrl = async (file, session_id) => {
+export const generatePresignedUrl = async (file, session_id, expectedFiles) => {
   const fileName = file.name.replace(/[^a-zA-Z0-9._-]/g, "_");
   const response = await fetch(
     `${process.env.NEXT_PUBLIC_API_ENDPOINT}user/comparison_presigned_url?` +
       `session_id=${encodeURIComponent(session_id)}` +
       `&document_type=${encodeURIComponent(getFileType(fileName))}` +
-      `&document_name=${encodeURIComponent(removeFileExtension(fileName))}`,
+      `&document_name=${encodeURIComponent(removeFileExtension(fileName))}` +
+      (expectedFiles ? `&expected_files=${expectedFiles}` : ""),
     {
       method: "GET",
       headers: {
@@ -72,7 +73,11 @@ export const processAndUploadFiles = async (
 
   // Upload files
   const uploadFilePromises = processedFiles.map(async (file) => {
-    const presignedUrl = await generatePresignedUrl(file, session_id);
+    const presignedUrl = await generatePresignedUrl(
+      file,
+      session_id,
+      processedFiles.length
+    );
     await uploadFile(file, presignedUrl);
   });
 